@@ -2,32 +2,27 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.font_manager as fm
 import seaborn as sns
 import os
-import io
-import base64
+import time
+import logging
+import inspect
+import tempfile
+import threading
+from collections import Counter
+import analytics
+import charts
+from analytics import sort_quarter_key
+from entities import EntityRegistry, prepare_display
 
-# --- 1. 日本語フォント設定 (ローカル & Cloud 両対応) ---
-def setup_font():
-    """fontsフォルダからフォントを読み込み、日本語表示を有効化"""
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    font_path = os.path.join(current_dir, "fonts", "ipaexg.ttf")
-    if os.path.exists(font_path):
-        fm.fontManager.addfont(font_path)
-        prop = fm.FontProperties(fname=font_path)
-        plt.rcParams['font.family'] = prop.get_name()
-        return prop.get_name()
-    else:
-        # フォールバック: システムフォントを試行
-        plt.rcParams['font.family'] = ['Meiryo', 'MS Gothic', 'Hiragino Sans', 'sans-serif']
-        return 'sans-serif'
+logger = logging.getLogger(__name__)
 
-font_name = setup_font()
+# --- 1. 日本語フォント設定 (ローカル & Cloud 両対応) ---
+font_name = charts.setup_font()
 plt.rcParams['axes.unicode_minus'] = False  # マイナス記号の文字化け対策
 sns.set_theme(style="whitegrid", rc={"font.family": font_name})
 
-st.set_page_config(page_title="イオン 地域別業績分析ダッシュボード（四半期）", layout="wide")
+st.set_page_config(page_title="イオン 四半期別セグメント業績分析ダッシュボード", layout="wide")
 
 # --- Streamlitバージョン互換ヘルパー ---
 from packaging.version import Version as _V
@@ -45,89 +40,507 @@ def st_df(data, **kwargs):
         kwargs.setdefault("use_container_width", True)
     st.dataframe(data, **kwargs)
 
-# --- 2. ユーティリティ関数 ---
-def get_html_report(df, title, fig=None):
-    """HTMLダウンロード用データの生成（テーブル＋チャート）"""
-    chart_html = ""
-    if fig is not None:
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png', dpi=150, bbox_inches='tight', facecolor='white')
-        buf.seek(0)
-        img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-        buf.close()
-        chart_html = f'<div style="text-align:center; margin: 20px 0;"><img src="data:image/png;base64,{img_base64}" style="max-width:100%;"/></div>'
-    
-    return f"""
-    <html><head><meta charset='utf-8'>
-    <style>
-        body {{ font-family: 'Hiragino Sans', 'Meiryo', sans-serif; padding: 20px; background: #f5f5f5; }}
-        .container {{ max-width: 1200px; margin: 0 auto; background: white; padding: 30px; border-radius: 10px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }}
-        table {{ border-collapse: collapse; width: 100%; margin-top: 20px; background: white; }}
-        th, td {{ border: 1px solid #ddd; padding: 10px; text-align: right; }}
-        th {{ background: linear-gradient(135deg, #1f77b4, #ff7f0e); color: white; text-align: center; }}
-        tr:nth-child(even) {{ background-color: #f9f9f9; }}
-        tr:hover {{ background-color: #f0f0f0; }}
-        h2 {{ color: #2C3E50; border-left: 5px solid #1f77b4; padding-left: 15px; margin-top: 0; }}
-        .timestamp {{ color: #888; font-size: 12px; text-align: right; margin-top: 20px; }}
-    </style></head>
-    <body>
-    <div class="container">
-        <h2>📊 {title}</h2>
-        {chart_html}
-        <h3>📋 詳細データ</h3>
-        {df.to_html(classes='data-table')}
-        <p class="timestamp">生成日時: {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-    </div>
-    </body></html>
+def st_png(png):
+    """PNG 画像をコンテナ幅で表示（st.image の width / use_container_width 互換）"""
+    if _st_ver >= _V("1.50.0"):
+        st.image(png, width="stretch")
+    elif _st_ver >= _V("1.40.0"):
+        st.image(png, use_container_width=True)
+    else:
+        st.image(png, use_column_width=True)
+
+def st_tabs(labels, default=None, key=None):
+    """st.tabs の互換ラッパー。選択中タブを追跡できる版では切替時に再実行し、選択中のタブのみ描画する"""
+    if 'on_change' in inspect.signature(st.tabs).parameters:
+        return st.tabs(labels, default=default, key=key, on_change="rerun")
+    return st.tabs(labels)
+
+def tab_open(tab):
+    """タブを描画するか（選択状態を追跡しない旧版では全タブを描画）"""
+    return getattr(tab, 'open', None) is not False
+
+def download_on_demand(container, label, make_data, file_name, mime, key, token):
+    """クリック時にデータを生成するダウンロードボタン
+
+    遅延生成（data に関数を渡す）に未対応の版では「作成」ボタンで生成してからダウンロードする。
+    token は生成内容を決める表示条件で、変わったら作り直す。
     """
+    if 'deferred' in (st.download_button.__doc__ or ''):
+        container.download_button(label, make_data, file_name, mime, key=key)
+        return
+    state_key = f'_{key}_token'
+    if container.button(f"{label}を作成", key=f'{key}_build'):
+        st.session_state[state_key] = token
+    if st.session_state.get(state_key) == token:
+        with st.spinner("作成しています..."):
+            data = make_data()
+        container.download_button(f"📥 {file_name}（{len(data) / 1024:,.0f} KB）", data, file_name, mime, key=key)
+
+def read_query_params():
+    """URL のクエリパラメータを dict で取得（st.query_params 非対応版は experimental API）"""
+    if hasattr(st, 'query_params'):
+        return {k: st.query_params[k] for k in st.query_params}
+    return {k: v[-1] for k, v in st.experimental_get_query_params().items()}
+
+def write_query_params(params):
+    """URL のクエリパラメータを置き換え（変化がなければ何もしない）"""
+    if read_query_params() == params:
+        return
+    if hasattr(st, 'query_params'):
+        st.query_params.clear()
+        st.query_params.update(params)
+    else:
+        st.experimental_set_query_params(**params)
+
+# --- 2. ユーティリティ関数 ---
+get_html_report = charts.get_html_report
 
-def sort_quarter_key(q):
-    """四半期のソートキーを生成（例: FY2023-1Q → 20231）"""
-    parts = q.replace('FY', '').replace('Q', '').split('-')
-    return int(parts[0]) * 10 + int(parts[1])
+def render_view(view):
+    """描画済みの RenderedView（チャート＋テーブル＋HTMLダウンロード）を表示"""
+    st_png(view.png)
+    for block in view.tables:
+        st.markdown(f"#### {block.title}")
+        st_df(block.styler())
+    if view.filename:
+        st.download_button("📥 HTMLでダウンロード（チャート＋テーブル）", view.html,
+                           view.filename, "text/html", key=view.key)
 
 # --- 3. データの読み込み ---
-def convert_to_numeric(series):
-    """カンマ区切り文字列を数値に変換"""
-    if series.dtype == 'object':
-        return pd.to_numeric(
-            series.astype(str).str.replace(',', '').str.strip(),
-            errors='coerce'
-        ).fillna(0)
-    return series
-
-@st.cache_data
-def load_region_data():
-    """地域別データの読み込み（四半期）"""
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    path = os.path.join(current_dir, "data", "region_data.xlsx")
-    if os.path.exists(path):
-        df = pd.read_excel(path)
-        
-        # 決算種別がQ1, Q2, Q3, Q4のデータのみを抽出
-        df = df[df['決算種別'].isin(['Q1', 'Q2', 'Q3', 'Q4'])].reset_index(drop=True)
-        
-        # 数値カラムの変換（必要に応じて）
-        numeric_cols = ['営業収益', '営業利益', '営業収益営業利益率', '営業収益構成比', '営業利益構成比']
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = convert_to_numeric(df[col])
-        
-        # 四半期ソート用の数値列を追加（FY2023-1Q → 20231）
-        df['四半期数値'] = df['決算年度'].apply(sort_quarter_key)
-        df = df.sort_values(['地域', '四半期数値']).reset_index(drop=True)
-        
-        # 年度と四半期を分割
-        df['年度'] = df['決算年度'].str.extract(r'(FY\d{4})')[0]
-        df['四半期'] = df['決算種別']
-        
-        return df
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "segment_data.csv")
+
+def read_segment_csv(path):
+    """セグメント別CSVの読み込み（UTF-8 / Shift-JIS 両対応）"""
+    try:
+        return pd.read_csv(path, encoding='utf-8')
+    except UnicodeDecodeError:
+        return pd.read_csv(path, encoding='cp932')
+ENTITIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "entities.json")
+# カスタム指標タブの登録済みの式
+METRICS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "metrics.json")
+# 他社のデータは data/companies/<会社名>.xlsx に同じ形式で置く
+COMPANIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "companies")
+DEFAULT_COMPANY = "イオン"
+# 読み込んだデータの内容ごとの履歴（data/versions/<会社名>/<更新時刻>_<内容ハッシュ>.<拡張子>）
+VERSIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "versions")
+# 整形済みデータのスナップショット（data/snapshots/<バージョン>/）。全サーバープロセスがメモリマップで共有
+SNAPSHOTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "snapshots")
+# 保存済みバージョンのスナップショット（data/snapshots/versions/<会社名>/<バージョン>/）
+VERSION_SNAPSHOTS_DIR = os.path.join(SNAPSHOTS_DIR, "versions")
+
+def read_raw_data(path):
+    """セグメント別データファイルの読み込み（四半期・年度の全行）"""
+    df = read_segment_csv(path)
+    # 地域版と共通の列名に揃える（セグメント → 地域, 営業利益率 → 営業収益営業利益率）
+    return df.rename(columns={'セグメント': '地域', '営業利益率': '営業収益営業利益率'})
+
+def company_paths():
+    """企業名 → データファイル（既定の企業＋ data/companies/ 配下の同じ形式のファイル）"""
+    return analytics.company_paths(DATA_PATH, COMPANIES_DIR, DEFAULT_COMPANY)
+
+def data_files_version():
+    """いずれかの企業のデータファイルが更新されたら変わるバージョン文字列（スナップショットのキー）"""
+    return analytics.files_version(company_paths())
+
+def current_data_version():
+    """データ・登録簿・派生指標の定義のいずれかが更新されたら変わるバージョン文字列（表示・集計のキャッシュキー）"""
+    return "|".join([data_files_version(), str(analytics.file_version(ENTITIES_PATH)),
+                     str(analytics.file_version(METRICS_PATH))])
+
+def build_store(paths):
+    """企業名 → データファイルを1回ずつ解析して複数企業ストアを構築（設備投資列があれば年度行も保持）"""
+    return analytics.build_store_from_files(paths, read_raw_data)
+
+@st.cache_resource(show_spinner=False)
+def load_company_store(files_version):
+    """企業 × 地域 × 四半期のストアを取得（データファイルのバージョンごと。登録簿などの設定の変更では作り直さない）
+
+    スナップショットがあれば読み取り専用のメモリマップとして開く（解析なし）。
+    なければ全企業のデータを1回だけ読み込んで書き出す。同じホストの他のプロセス（API サーバー・静的サイト生成を含む）は同じファイルを共有する。
+    """
+    paths = company_paths()
+    if not paths:
+        return None
+    key = analytics.snapshot_key(files_version)
+    return analytics.open_store_snapshot(os.path.join(SNAPSHOTS_DIR, key), lambda: build_store(paths),
+                                         keep={key, os.path.basename(VERSION_SNAPSHOTS_DIR)})
+
+# データ本体（整形済みデータ・表示用データ・指標ストア）は st.cache_resource でプロセス内の1つを共有する。
+# st.cache_data は呼び出しごとに複製を返すため、小さな集計結果のみに使う。共有するデータは変更しないこと
+# この節のローダーはスピナーを出さない（事前描画スレッドから実行コンテキストなしで呼ぶため。画面のスピナーは tab_views が出す）
+
+@st.cache_resource(show_spinner=False)
+def load_region_data(data_version=None, company=DEFAULT_COMPANY):
+    """セグメント別データの読み込み（四半期）。data_version が変わると再読み込み
+
+    指標列はスナップショットのメモリマップをそのまま参照する（プロセスごとの複製なし）。
+    """
+    store = load_company_store(data_files_version())
+    if store is not None and company in store.companies:
+        return store.company_data(company)
     return None
 
-# --- 4. メイン UI ---
-st.title("🌏 イオン 地域別業績分析ダッシュボード（四半期）")
+@st.cache_resource(show_spinner=False)
+def load_display_data(data_version, company):
+    """表示順・色の登録簿を適用し、系列数が多い場合は上位＋その他に合算したデータを返す"""
+    return prepare_display(load_region_data(data_version, company), EntityRegistry.load(ENTITIES_PATH))
+
+@st.cache_resource(show_spinner=False)
+def load_metric_store(data_version, entities, company):
+    """四半期 × 地域の指標ストアを構築（データバージョンごとにキャッシュ。共有するため配列は読み取り専用）"""
+    store = analytics.build_metric_store(load_display_data(data_version, company).df, list(entities))
+    for values in store.values.values():
+        values.setflags(write=False)
+    return store
+
+@st.cache_data(show_spinner=False)
+def load_forecasts(data_version, entities, company):
+    """全地域の予測モデルを一括で当てはめ（データバージョンごとにキャッシュ）"""
+    return analytics.fit_forecasts(load_metric_store(data_version, entities, company), horizon=8)
 
-df_raw = load_region_data()
+@st.cache_data(show_spinner=False)
+def load_correlations(data_version, entities, company):
+    """地域間相関・季節指数マトリクスを計算（データバージョンごとにキャッシュ）"""
+    return analytics.compute_correlations(load_metric_store(data_version, entities, company))
+
+@st.cache_data(show_spinner=False)
+def load_growth_contributions(data_version, entities, company):
+    """前年同期比の寄与度・営業利益の要因分解を全期間で計算（データバージョンごとにキャッシュ）"""
+    return analytics.growth_contributions(load_metric_store(data_version, entities, company))
+
+@st.cache_data(show_spinner=False)
+def load_anomalies(data_version, entities, company):
+    """全地域・全指標の異常フラグを一括で検出（データバージョンごとにキャッシュ）"""
+    return analytics.detect_anomalies(load_metric_store(data_version, entities, company))
+
+@st.cache_data(show_spinner=False)
+def load_decomposition(data_version, entities, company):
+    """全地域の営業収益・営業利益を傾向・季節・残差に一括で分解（データバージョンごとにキャッシュ）"""
+    return analytics.decompose_store(load_metric_store(data_version, entities, company))
+
+@st.cache_data(show_spinner=False)
+def load_cumulative_index(data_version, entities, company):
+    """営業収益・営業利益の四半期累積和を全期間で計算（データバージョンごとにキャッシュ。累計・半期は差を取るのみ）"""
+    return analytics.build_cumulative_index(load_metric_store(data_version, entities, company))
+
+def derived_metrics():
+    """カスタム指標タブの登録済みの派生指標（先頭が既定）"""
+    return analytics.load_derived_metrics(METRICS_PATH) or [analytics.DEFAULT_DERIVED]
+
+@st.cache_data(show_spinner=False)
+def load_derived_metric(data_version, entities, company, expression):
+    """派生指標の式を全期間・全地域について評価（式 × データバージョンごとにキャッシュ）"""
+    return analytics.evaluate_expression(load_metric_store(data_version, entities, company), expression)
+
+@st.cache_data(show_spinner=False)
+def load_capex_metrics(data_version, entities, company):
+    """年度行から設備投資指標を計算（データバージョンごとにキャッシュ）。設備投資列がなければ None"""
+    annual = load_company_store(data_files_version()).company_annual(company)
+    if annual is None:
+        return None
+    mapping = load_display_data(data_version, company).mapping
+    return analytics.compute_capex_metrics(analytics.fold_entities(annual, mapping), list(entities))
+
+@st.cache_data(show_spinner=False)
+def load_version_history(data_version):
+    """各企業のデータファイルの現在の内容を履歴に保存し、企業 → 保存済みバージョン（古い順）を返す"""
+    return {company: list(analytics.archive_version(path, os.path.join(VERSIONS_DIR, company)))
+            for company, path in company_paths().items()}
+
+def version_label(version):
+    """履歴のラベル（<更新時刻>_<内容ハッシュ>）を表示用に整形"""
+    stamp, digest = version.split('_', 1)
+    return f"{stamp[:4]}-{stamp[4:6]}-{stamp[6:8]} {stamp[9:11]}:{stamp[11:13]}:{stamp[13:15]}（{digest[:7]}）"
+
+@st.cache_resource(show_spinner=False)
+def load_version_store(company, version):
+    """保存済みバージョンの整形済みデータ
+
+    バージョン（内容ハッシュ付きで不変）ごとのスナップショットをメモリマップで開く。解析はホストで最初の1回のみ。
+    """
+    archive = os.path.join(VERSIONS_DIR, company)
+    return analytics.open_store_snapshot(os.path.join(VERSION_SNAPSHOTS_DIR, company, version),
+                                         lambda: build_store({company: analytics.list_versions(archive)[version]}))
+
+@st.cache_data(show_spinner=False)
+def load_version_diff(company, old_version, new_version):
+    """2つの保存済みバージョンの差分（バージョンの組ごとにキャッシュ。内容ハッシュ付きのため再計算不要）"""
+    old, new = (load_version_store(company, v).company_data(company) for v in (old_version, new_version))
+    registry = EntityRegistry.load(ENTITIES_PATH)
+    weights = new.groupby('地域')['営業収益'].sum().to_dict()
+    entities = registry.order(set(old['地域']) | set(new['地域']), weights)
+    metrics = list(analytics.DIFF_METRICS)
+    return analytics.diff_stores(analytics.build_metric_store(old, entities, metrics=metrics),
+                                 analytics.build_metric_store(new, entities, metrics=metrics))
+
+@st.cache_data(show_spinner=False)
+def load_fx_scenarios(data_version, company, grid=analytics.FX_GRID):
+    """外貨建て地域の為替シナリオの計算に使う実績・通貨別の合計を求める（為替変動率の刻みごとにキャッシュ。スライダー操作はシナリオ1つ分の計算のみ）"""
+    display = load_display_data(data_version, company)
+    store = analytics.build_metric_store(load_region_data(data_version, company), display.entities,
+                                         metrics=analytics.AMOUNT_COLS)
+    return analytics.fx_scenarios(store, display.currencies, grid)
+
+@st.cache_data(show_spinner=False)
+def load_company_comparison(data_version):
+    """企業別の全社合計指標を計算（データバージョンごとにキャッシュ）"""
+    return analytics.compare_companies(load_company_store(data_files_version()))
+
+# --- 4. 描画済み図表のキャッシュ ---
+VIEW_CACHE_ENTRIES = 512
+ALL_PERIOD_TABS = ('seasonal', 'correlation', 'compare', 'restatement')  # 表示範囲に依存しないタブ
+
+def build_views(data_version, company, tab, quarters, params=()):
+    """タブの ReportView（描画前のチャート＋テーブル）を生成。該当データなしは None"""
+    display = load_display_data(data_version, company)
+    entities = tuple(display.series)
+    anomalies = load_anomalies(data_version, entities, company)
+    decomposition = load_decomposition(data_version, entities, company)
+    ctx = charts.ViewContext(display.df, list(quarters), display.series, display.colors, anomalies, decomposition)
+    if tab == 'overview':
+        # 集計単位（既定は単独四半期）。累計・半期は累積和の差から求める
+        basis = params[0] if params else 'quarter'
+        if basis == 'quarter':
+            views = charts.overview_views(ctx)
+        else:
+            views = charts.period_views(ctx, load_cumulative_index(data_version, entities, company), basis)
+        views += [charts.anomaly_view(ctx)]
+    elif tab == 'composition':
+        views = charts.composition_views(ctx)
+    elif tab == 'margin':
+        views = charts.margin_views(ctx)
+    elif tab == 'yoy':
+        views = charts.yoy_views(ctx) + [
+            charts.contribution_view(ctx, load_growth_contributions(data_version, entities, company), *params)]
+    elif tab == 'seasonal':
+        views = charts.seasonal_views(ctx) + charts.decomposition_views(ctx)
+    elif tab == 'forecast':
+        views = [charts.forecast_view(ctx, load_metric_store(data_version, entities, company),
+                                      load_forecasts(data_version, entities, company), *params)]
+    elif tab == 'correlation':
+        correlations = load_correlations(data_version, entities, company)
+        views = [charts.correlation_view(ctx, correlations, *params), charts.seasonal_index_view(ctx, correlations)]
+    elif tab == 'derived':
+        expression, chart = params
+        metric = next((m for m in derived_metrics() if m.expression == expression),
+                      analytics.DerivedMetric("カスタム指標", expression))
+        views = [charts.derived_metric_view(ctx, load_derived_metric(data_version, entities, company, expression),
+                                            metric, chart)]
+    elif tab == 'compare':
+        # 区間の合計は累積和の差で求めるため、区間をどこに取っても計算量は同じ
+        cumulative = load_cumulative_index(data_version, entities, company)
+        base_first, base_last, target_first, target_last = params or analytics.default_comparison(cumulative.quarters)
+        comparison = analytics.compare_periods(cumulative, (base_first, base_last), (target_first, target_last))
+        views = [charts.period_comparison_view(ctx, comparison)]
+    elif tab == 'capex':
+        views = [charts.capex_view(ctx, load_capex_metrics(data_version, entities, company), *params)]
+    elif tab == 'company':
+        colors = EntityRegistry().colors(load_company_store(data_files_version()).companies)
+        views = [charts.company_comparison_view(ctx, load_company_comparison(data_version), *params, colors)]
+    elif tab == 'fx':
+        # 為替シナリオは合算前の全地域で計算
+        detail_ctx = charts.ViewContext(load_region_data(data_version, company), list(quarters),
+                                        display.entities, display.colors)
+        views = [charts.fx_scenario_view(detail_ctx, load_fx_scenarios(data_version, company), params)]
+    elif tab == 'restatement':
+        old_version, new_version, metric = params
+        views = [charts.restatement_view(ctx, load_version_diff(company, old_version, new_version), metric)]
+    elif tab == 'detail':
+        # 地域詳細は合算前のデータで表示（異常値のマーカーは合算後の系列にある地域のみ）
+        detail_ctx = charts.ViewContext(load_region_data(data_version, company), list(quarters),
+                                        display.entities, display.colors, anomalies)
+        views = [charts.region_detail_view(detail_ctx, *params)]
+    else:
+        raise ValueError(f"unknown tab: {tab}")
+    return views
+
+@st.cache_data(max_entries=VIEW_CACHE_ENTRIES, show_spinner=False)
+def load_views(data_version, company, tab, quarters, params=()):
+    """タブの図表を PNG・HTML に描画して返す（表示条件ごとにキャッシュ）。該当データなしは None"""
+    return [charts.render_report_view(v) if v is not None else None
+            for v in build_views(data_version, company, tab, quarters, params)]
+
+def tab_views(tab, params=()):
+    """現在の表示条件でタブの描画済み図表を取得"""
+    quarters = () if tab in ALL_PERIOD_TABS else tuple(selected_quarters)
+    with st.spinner("図表を描画しています..."):
+        return load_views(data_version, selected_company, tab, quarters, tuple(params))
+
+# --- 5. 表示条件の URL 共有と人気条件の事前描画 ---
+# タブのラベル → URL 上の ID（load_views の tab と共通）
+TAB_IDS = {
+    "📊 全体概要": 'overview', "📈 構成比推移": 'composition', "💹 利益率推移": 'margin',
+    "🚀 前年同期比": 'yoy', "📅 季節性分析": 'seasonal', "🔮 業績予測": 'forecast', "🧮 相関分析": 'correlation',
+    "🧪 カスタム指標": 'derived', "⚖️ 期間比較": 'compare',
+    "🏗️ 設備投資": 'capex', "💱 為替シナリオ": 'fx', "🏢 企業比較": 'company', "🧾 修正差分": 'restatement', "🔍 地域詳細": 'detail',
+}
+DISPLAY_MODES = {'recent': "直近N四半期", 'fy': "年度指定"}
+DEFAULT_N_QUARTERS = 12
+# タブ内の選択肢（URL には含めず、事前描画は先頭の値で行う）
+FC_METRICS = ['営業収益', '営業利益']
+FC_MODELS = ['Holt-Winters', '季節ナイーブ']
+FC_HORIZON = 8
+CORR_TARGETS = ['営業収益 前年同期比', '営業利益 前年同期比', '営業利益率']
+CONTRIB_METRICS = ['営業収益', '営業利益']
+CUSTOM_EXPRESSION = "（式を入力）"
+TAB_WIDGET_KEYS = ('fc_metric', 'fc_model', 'fc_horizon', 'corr_target', 'capex_metric', 'company_metric',
+                   'diff_old', 'diff_new', 'diff_metric', 'contrib_metric', 'contrib_quarter', 'period_basis',
+                   'derived_metric', 'derived_expr', 'derived_chart')
+FX_KEY_PREFIX = 'fx_shock_'  # 為替シナリオのスライダー（通貨ごと）
+POPULAR_TOP_K = 8          # 事前描画しておく表示条件の数
+PRECOMPUTE_INTERVAL = 60   # 事前描画の間隔（秒）
+
+def select_quarters(raw_quarters, mode, n_quarters, years):
+    """表示モードに応じて表示対象の四半期を選ぶ"""
+    if mode == 'recent':
+        return raw_quarters[-n_quarters:]
+    return [q for q in raw_quarters if any(q.startswith(y) for y in years)]
+
+def default_params(tab, region, versions=(), currencies=()):
+    """タブ内の選択肢の既定値（load_views の params）。寄与度分解は最新四半期、修正差分は直前と最新、為替シナリオは実績（変動なし）"""
+    if tab == 'restatement':
+        return (versions[-2], versions[-1], next(iter(analytics.DIFF_METRICS)))
+    if tab == 'fx':
+        return (0,) * len(currencies)
+    if tab == 'derived':
+        return (derived_metrics()[0].expression, next(iter(charts.DERIVED_CHARTS)))
+    return {
+        'yoy': (CONTRIB_METRICS[0], None),
+        'forecast': (FC_METRICS[0], FC_MODELS[0], FC_HORIZON),
+        'correlation': (CORR_TARGETS[0],),
+        'capex': (next(iter(analytics.CAPEX_METRICS)),),
+        'company': (next(iter(charts.COMPARISON_UNITS)),),
+        'detail': (region,),
+    }.get(tab, ())
+
+def url_index(options, value, default=0):
+    """URL の値が選択肢にあればその位置、なければ既定の位置"""
+    return options.index(value) if value in options else default
+
+def precompute_state(state):
+    """URL 状態（表示条件）で開いたときに表示されるタブを描画し、図表・集計結果のキャッシュに載せる
+
+    事前描画スレッドから呼ぶため、画面要素には触れない（図表は pyplot を使わず Figure に直接描く）。
+    load_views の引数は閲覧時の tab_views と同じ（タブ内の選択肢は既定値）。
+    """
+    version = current_data_version()
+    df = load_region_data(version, state['company'])
+    if df is None:
+        return
+    tab = state['tab']
+    display = load_display_data(version, state['company'])
+    entities = tuple(display.series)
+    if tab == 'capex' and load_capex_metrics(version, entities, state['company']) is None:
+        return
+    versions = load_version_history(version).get(state['company'], [])
+    if tab == 'restatement' and len(versions) < 2:
+        return
+    currencies = list(dict.fromkeys(display.currencies.values()))
+    if tab == 'fx' and not currencies:
+        return
+    if tab in ALL_PERIOD_TABS:
+        quarters = ()
+    else:
+        raw_quarters = sorted(df['決算年度'].unique(), key=sort_quarter_key)
+        quarters = tuple(select_quarters(raw_quarters, state['mode'], int(state.get('n', DEFAULT_N_QUARTERS)),
+                                         state.get('fy', '').split(',')))
+    load_views(version, state['company'], tab, quarters, default_params(tab, state['region'], versions, currencies))
+
+class PopularStates:
+    """表示条件ごとのアクセス数を数え、上位 K 件をバックグラウンドで定期的に事前描画する
+
+    スレッドはどのセッションの実行コンテキストも持たない（precompute は画面要素に触れない関数に限る）。
+    """
+
+    def __init__(self, precompute, top_k=POPULAR_TOP_K, interval=PRECOMPUTE_INTERVAL):
+        self.precompute = precompute
+        self.top_k = top_k
+        self.interval = interval
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="precompute-popular-states", daemon=True)
+        self._thread.start()
+
+    def record(self, state):
+        with self._lock:
+            self.counts[tuple(sorted(state.items()))] += 1
+
+    def top(self):
+        """アクセス数の多い表示条件（上位 K 件）"""
+        with self._lock:
+            return [dict(key) for key, _ in self.counts.most_common(self.top_k)]
+
+    def _run(self):
+        # キャッシュ済みの条件はキャッシュ参照のみで終わる。データ更新・キャッシュ追い出し後はここで再描画される
+        while True:
+            time.sleep(self.interval)
+            for state in self.top():
+                try:
+                    self.precompute(state)
+                except Exception:
+                    logger.warning("precompute failed for %s", state, exc_info=True)
+
+@st.cache_resource
+def popular_states():
+    """プロセス全体で共有するアクセス数・事前描画スレッド"""
+    return PopularStates(precompute_state)
+
+# --- 6. 一括出力（レポート zip・Excel ブック） ---
+BUNDLE_SPOOL_BYTES = 8 * 1024 * 1024  # これを超えると一時ファイル（ディスク）に書き出す
+EXPORT_CACHE_ENTRIES = 32
+# Excel に書き出すタブ（ピボット表のあるもの）
+EXCEL_TABS = ('overview', 'composition', 'margin', 'yoy', 'seasonal', 'detail')
+
+def iter_views(data_version, company, tabs, quarters, region, versions=(), currencies=()):
+    """複数タブの ReportView を1つずつ生成（タブ内の選択肢は既定値、該当データなしは除く）"""
+    for tab in tabs:
+        params = default_params(tab, region, versions, currencies)
+        for view in build_views(data_version, company, tab, () if tab in ALL_PERIOD_TABS else quarters, params):
+            if view is not None:
+                yield view
+
+def spool_export(write, views):
+    """書き出し関数の出力を一時ファイル経由でバイト列にする（大きい出力はディスクに逃がす）"""
+    with tempfile.SpooledTemporaryFile(max_size=BUNDLE_SPOOL_BYTES) as f:
+        write(views, f)
+        f.seek(0)
+        return f.read()
+
+@st.cache_data(max_entries=EXPORT_CACHE_ENTRIES)
+def load_report_bundle(data_version, company, tabs, quarters, region, versions=(), currencies=()):
+    """全タブのレポートを1つの zip にまとめる（表示条件ごとにキャッシュ）
+
+    各タブの図表は1つずつ生成して zip に書き込み、すぐに解放する。
+    """
+    title = f"{company} 業績レポート一式（{quarters[0]}〜{quarters[-1]}）"
+    return spool_export(lambda views, f: charts.write_report_bundle(views, f, title),
+                        iter_views(data_version, company, tabs, quarters, region, versions, currencies))
+
+@st.cache_data(max_entries=EXPORT_CACHE_ENTRIES)
+def load_pivot_workbook(data_version, company, quarters, region):
+    """全ピボットを1つの Excel ブックにまとめる（表示条件ごとにキャッシュ）"""
+    return spool_export(charts.write_pivot_workbook,
+                        iter_views(data_version, company, EXCEL_TABS, quarters, region))
+
+# --- 7. メイン UI ---
+st.title("📊 イオン 四半期別セグメント業績分析ダッシュボード")
+
+# いずれかの企業のデータ・登録簿が更新されたらキャッシュを作り直す
+data_version = current_data_version()
+company_store = load_company_store(data_files_version())
+companies = company_store.companies if company_store is not None else [DEFAULT_COMPANY]
+
+# 表示条件はセッション開始時の URL（共有リンク）から復元し、以降は URL に書き戻す
+if '_url_state' not in st.session_state:
+    st.session_state['_url_state'] = read_query_params()
+url_state = st.session_state['_url_state']
+
+if len(companies) > 1:
+    st.sidebar.header("🏢 企業")
+    selected_company = st.sidebar.selectbox("企業を選択", companies,
+                                            index=url_index(companies, url_state.get('company')), key="company")
+else:
+    selected_company = companies[0]
+df_raw = load_region_data(data_version, selected_company)
 
 if df_raw is not None:
     # --- サイドバー ---
@@ -141,445 +554,385 @@ if df_raw is not None:
     
     # 表示範囲選択
     st.sidebar.subheader("表示範囲")
-    display_mode = st.sidebar.radio("表示モード", ["直近N四半期", "年度指定"], index=0)
+    mode_ids = list(DISPLAY_MODES)
+    display_mode = st.sidebar.radio("表示モード", list(DISPLAY_MODES.values()),
+                                    index=url_index(mode_ids, url_state.get('mode')), key="mode")
+    mode = mode_ids[list(DISPLAY_MODES.values()).index(display_mode)]
     
-    if display_mode == "直近N四半期":
-        n_quarters = st.sidebar.slider("表示四半期数", min_value=4, max_value=len(raw_quarters), value=12)
-        selected_quarters = raw_quarters[-n_quarters:]
+    n_quarters, selected_years = None, []
+    if mode == 'recent':
+        url_n = url_state.get('n', '')
+        n_quarters = st.sidebar.slider("表示四半期数", min_value=4, max_value=len(raw_quarters),
+                                       value=min(max(int(url_n), 4), len(raw_quarters)) if url_n.isdigit()
+                                       else DEFAULT_N_QUARTERS, key="n")
     else:
-        selected_years = st.sidebar.multiselect("年度を選択", fiscal_years, default=fiscal_years[-2:])
-        selected_quarters = [q for q in raw_quarters if any(q.startswith(y) for y in selected_years)]
+        url_years = [y for y in url_state.get('fy', '').split(',') if y in fiscal_years]
+        selected_years = st.sidebar.multiselect("年度を選択", fiscal_years, default=url_years or fiscal_years[-2:],
+                                                key="fy")
+    selected_quarters = select_quarters(raw_quarters, mode, n_quarters, selected_years)
     
-    # 地域リスト取得（表示順序を固定）
-    region_order = ['日本', '中国', 'アセアン', 'その他']
-    region_list = [r for r in region_order if r in df_raw['地域'].unique()]
+    # 地域リスト・色は登録簿（data/entities.json）から取得。系列が多い場合は上位＋その他に合算
+    display = load_display_data(data_version, selected_company)
+    region_list, all_regions = display.series, display.entities
     
-    # 地域詳細分析用の選択
+    # 地域詳細分析用の選択（合算前の全地域）
     st.sidebar.markdown("---")
     st.sidebar.subheader("地域詳細分析")
-    selected_region = st.sidebar.selectbox("地域を選択", region_list)
+    selected_region = st.sidebar.selectbox("地域を選択", all_regions,
+                                           index=url_index(all_regions, url_state.get('region')), key="region")
+
+    # 設備投資指標（設備投資列を持つデータのみ）
+    capex = load_capex_metrics(data_version, tuple(region_list), selected_company)
 
     # --- タブ構成 ---
-    tab_overview, tab_composition, tab_margin, tab_yoy, tab_seasonal, tab_detail = st.tabs([
-        "📊 全体概要", "📈 構成比推移", "💹 利益率推移", "🚀 前年同期比", "📅 季節性分析", "🔍 地域詳細"
-    ])
+    tab_labels = ["📊 全体概要", "📈 構成比推移", "💹 利益率推移", "🚀 前年同期比", "📅 季節性分析",
+                  "🔮 業績予測", "🧮 相関分析", "🧪 カスタム指標", "⚖️ 期間比較"]
+    if capex is not None:
+        tab_labels.append("🏗️ 設備投資")
+    fx_currencies = list(dict.fromkeys(display.currencies.values()))
+    if fx_currencies:
+        tab_labels.append("💱 為替シナリオ")
+    if len(companies) > 1:
+        tab_labels.append("🏢 企業比較")
+    versions = load_version_history(data_version).get(selected_company, [])
+    if len(versions) > 1:
+        tab_labels.append("🧾 修正差分")
+    tab_labels.append("🔍 地域詳細")
+    # 非表示のタブのウィジェットは描画されないため、選択値を保持しておく
+    for key in list(st.session_state):
+        if key in TAB_WIDGET_KEYS or str(key).startswith(FX_KEY_PREFIX):
+            st.session_state[key] = st.session_state[key]
+    tab_ids = [TAB_IDS[label] for label in tab_labels]
+    url_tab = tab_labels[url_index(tab_ids, url_state.get('tab'))]
+    tabs = dict(zip(tab_labels, st_tabs(tab_labels, default=url_tab, key="tab")))
+    (tab_overview, tab_composition, tab_margin, tab_yoy, tab_seasonal,
+     tab_forecast, tab_corr, tab_derived, tab_compare) = list(tabs.values())[:9]
+    tab_capex = tabs.get("🏗️ 設備投資")
+    tab_fx = tabs.get("💱 為替シナリオ")
+    tab_company = tabs.get("🏢 企業比較")
+    tab_restatement = tabs.get("🧾 修正差分")
+    tab_detail = tabs["🔍 地域詳細"]
 
-    # --- 色パレット定義 ---
-    region_colors = {
-        '日本': '#1f77b4',      # 青
-        '中国': '#d62728',      # 赤
-        'アセアン': '#2ca02c',  # 緑
-        'その他': '#7f7f7f'     # グレー
-    }
+    # 現在の表示条件を URL に書き戻し、条件が変わったときにアクセス数を記録
+    state = {'company': selected_company, 'mode': mode, 'region': selected_region,
+             'tab': TAB_IDS[st.session_state.get("tab") or url_tab]}
+    if mode == 'recent':
+        state['n'] = str(n_quarters)
+    else:
+        state['fy'] = ','.join(selected_years)
+    write_query_params({k: v for k, v in state.items() if k != 'company' or len(companies) > 1})
+    if st.session_state.get('_recorded_state') != state:
+        st.session_state['_recorded_state'] = state
+        popular_states().record(state)
 
-    # 表示用データのフィルタリング
-    df_filtered = df_raw[df_raw['決算年度'].isin(selected_quarters)].copy()
+    # 全タブのレポート（共有CSS・SVG画像の zip）と全ピボット（Excel）をクリック時に生成して出力
+    if selected_quarters:
+        st.sidebar.markdown("---")
+        st.sidebar.subheader("📦 一括出力")
+        bundle_key = (data_version, selected_company, tuple(tab_ids), tuple(selected_quarters), selected_region,
+                      tuple(versions), tuple(fx_currencies))
+        download_on_demand(st.sidebar, "📦 全タブのレポート（ZIP）", lambda: load_report_bundle(*bundle_key),
+                           "業績レポート一式.zip", "application/zip", "bundle_zip", bundle_key)
+        workbook_key = (data_version, selected_company, tuple(selected_quarters), selected_region)
+        download_on_demand(st.sidebar, "📊 全ピボット（Excel）", lambda: load_pivot_workbook(*workbook_key),
+                           "業績ピボット一式.xlsx",
+                           "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                           "pivot_xlsx", workbook_key)
 
     # ==========================================================
     # タブ1: 全体概要
     # ==========================================================
-    with tab_overview:
-        st.subheader("地域別収益・利益の推移（四半期）")
-        
-        # 営業収益の積み上げ棒グラフ
-        pivot_revenue = df_filtered.pivot_table(
-            index='決算年度', columns='地域', values='営業収益', aggfunc='sum'
-        ).reindex(selected_quarters).reindex(columns=region_list)
-        
-        fig1, ax1 = plt.subplots(figsize=(14, 6))
-        pivot_revenue.plot(kind='bar', stacked=True, ax=ax1, 
-                          color=[region_colors.get(r, '#333') for r in pivot_revenue.columns])
-        ax1.set_title('地域別営業収益の推移（四半期・積み上げ）', fontsize=14, fontweight='bold')
-        ax1.set_xlabel('決算四半期')
-        ax1.set_ylabel('営業収益（百万円）')
-        ax1.legend(title='地域', bbox_to_anchor=(1.02, 1), loc='upper left')
-        ax1.tick_params(axis='x', rotation=45)
-        ax1.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: format(int(x), ',')))
-        plt.tight_layout()
-        st.pyplot(fig1)
-        
-        # 営業収益テーブル
-        st.markdown("#### 営業収益一覧（百万円）")
-        revenue_table = pivot_revenue.T
-        st_df(revenue_table.style.format("{:,.0f}"))
-        
-        html_rev = get_html_report(revenue_table, "地域別営業収益の推移（四半期）", fig1)
-        st.download_button("📥 HTMLでダウンロード（チャート＋テーブル）", html_rev, "地域別営業収益レポート_四半期.html", "text/html", key="rev_html")
-        
-        st.divider()
-        
-        # 営業利益の積み上げ棒グラフ
-        pivot_profit = df_filtered.pivot_table(
-            index='決算年度', columns='地域', values='営業利益', aggfunc='sum'
-        ).reindex(selected_quarters).reindex(columns=region_list)
-        
-        fig2, ax2 = plt.subplots(figsize=(14, 6))
-        pivot_profit.plot(kind='bar', stacked=True, ax=ax2, 
-                         color=[region_colors.get(r, '#333') for r in pivot_profit.columns])
-        ax2.set_title('地域別営業利益の推移（四半期・積み上げ）', fontsize=14, fontweight='bold')
-        ax2.set_xlabel('決算四半期')
-        ax2.set_ylabel('営業利益（百万円）')
-        ax2.axhline(y=0, color='black', linewidth=0.5)
-        ax2.legend(title='地域', bbox_to_anchor=(1.02, 1), loc='upper left')
-        ax2.tick_params(axis='x', rotation=45)
-        ax2.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: format(int(x), ',')))
-        plt.tight_layout()
-        st.pyplot(fig2)
-        
-        # 営業利益テーブル
-        st.markdown("#### 営業利益一覧（百万円）")
-        profit_table = pivot_profit.T
-        st_df(profit_table.style.format("{:,.0f}"))
-        
-        html_profit = get_html_report(profit_table, "地域別営業利益の推移（四半期）", fig2)
-        st.download_button("📥 HTMLでダウンロード（チャート＋テーブル）", html_profit, "地域別営業利益レポート_四半期.html", "text/html", key="profit_html")
+    if tab_open(tab_overview):
+        with tab_overview:
+            st.subheader("地域別収益・利益の推移（四半期）")
+            basis_ids = list(analytics.PERIOD_BASES)
+            basis_label = st.radio("集計単位", list(analytics.PERIOD_BASES.values()), horizontal=True,
+                                   key="period_basis",
+                                   help="累計: 決算年度の1Qからの合計（1Q累計〜4Q累計）／半期: 上期（1Q〜2Q）・下期（3Q〜4Q）")
+            basis = basis_ids[list(analytics.PERIOD_BASES.values()).index(basis_label)]
+            # 単独四半期は既定値（引数なし）として渡し、事前描画したキャッシュを使う
+            view_revenue, view_profit, view_anomaly = tab_views('overview', () if basis == 'quarter' else (basis,))
+            render_view(view_revenue)
+            st.divider()
+            render_view(view_profit)
+            st.divider()
+            st.subheader("⚠️ 異常値の検出")
+            st.caption("営業収益・営業利益・営業利益率の季節調整後の残差（傾向・四半期ごとの季節成分を除いた値）を"
+                       f"地域・指標ごとのロバスト z スコアに換算し、|z| が {analytics.ANOMALY_THRESHOLD} を超える四半期を表示します。"
+                       "利益率推移・地域詳細のチャートでは赤丸で表示します。")
+            render_view(view_anomaly)
 
     # ==========================================================
     # タブ2: 構成比推移
     # ==========================================================
-    with tab_composition:
-        st.subheader("地域別構成比の推移（四半期）")
-        
-        # 営業収益構成比 - エリアチャート
-        pivot_rev_comp = df_filtered.pivot_table(
-            index='決算年度', columns='地域', values='営業収益構成比', aggfunc='sum'
-        ).reindex(selected_quarters).reindex(columns=region_list)
-        
-        fig3, ax3 = plt.subplots(figsize=(14, 6))
-        pivot_rev_comp.plot(kind='area', stacked=True, ax=ax3, alpha=0.8,
-                           color=[region_colors.get(r, '#333') for r in pivot_rev_comp.columns])
-        ax3.set_title('地域別営業収益構成比の推移（四半期）', fontsize=14, fontweight='bold')
-        ax3.set_xlabel('決算四半期')
-        ax3.set_ylabel('構成比（%）')
-        ax3.set_ylim(0, 100)
-        ax3.legend(title='地域', bbox_to_anchor=(1.02, 1), loc='upper left')
-        ax3.tick_params(axis='x', rotation=45)
-        plt.tight_layout()
-        st.pyplot(fig3)
-        
-        st.markdown("#### 営業収益構成比一覧（%）")
-        crosstab_rev_comp = pivot_rev_comp.T
-        st_df(crosstab_rev_comp.style.format("{:.1f}").bar(subset=crosstab_rev_comp.columns, color='skyblue', vmin=0))
-        
-        html_comp1 = get_html_report(crosstab_rev_comp, "営業収益構成比の推移（四半期）", fig3)
-        st.download_button("📥 HTMLでダウンロード（チャート＋テーブル）", html_comp1, "営業収益構成比レポート_四半期.html", "text/html", key="comp_rev_html")
-        
-        st.divider()
-        
-        # 営業利益構成比 - 積み上げ棒グラフ（正負両方の積み上げに対応）
-        pivot_profit_comp = df_filtered.pivot_table(
-            index='決算年度', columns='地域', values='営業利益構成比', aggfunc='sum'
-        ).reindex(selected_quarters).reindex(columns=region_list)
-        
-        fig4, ax4 = plt.subplots(figsize=(14, 6))
-        pivot_profit_comp.plot(kind='bar', stacked=True, ax=ax4,
-                              color=[region_colors.get(r, '#333') for r in pivot_profit_comp.columns])
-        ax4.set_title('地域別営業利益構成比の推移（四半期・積み上げ）', fontsize=14, fontweight='bold')
-        ax4.set_xlabel('決算四半期')
-        ax4.set_ylabel('構成比（%）')
-        ax4.axhline(y=0, color='black', linewidth=0.5)
-        ax4.legend(title='地域', bbox_to_anchor=(1.02, 1), loc='upper left')
-        ax4.tick_params(axis='x', rotation=45)
-        plt.tight_layout()
-        st.pyplot(fig4)
-        
-        st.markdown("#### 営業利益構成比一覧（%）")
-        crosstab_profit_comp = pivot_profit_comp.T
-        st_df(crosstab_profit_comp.style.format("{:.1f}"))
-        
-        html_comp2 = get_html_report(crosstab_profit_comp, "営業利益構成比の推移（四半期）", fig4)
-        st.download_button("📥 HTMLでダウンロード（チャート＋テーブル）", html_comp2, "営業利益構成比レポート_四半期.html", "text/html", key="comp_profit_html")
+    if tab_open(tab_composition):
+        with tab_composition:
+            st.subheader("地域別構成比の推移（四半期）")
+            view_rev_comp, view_profit_comp = tab_views('composition')
+            render_view(view_rev_comp)
+            st.divider()
+            render_view(view_profit_comp)
 
     # ==========================================================
     # タブ3: 利益率推移
     # ==========================================================
-    with tab_margin:
-        st.subheader("地域別営業利益率の推移（四半期）")
-        
-        fig5, ax5 = plt.subplots(figsize=(14, 7))
-        for region in region_list:
-            reg_data = df_filtered[df_filtered['地域'] == region].sort_values('四半期数値')
-            ax5.plot(reg_data['決算年度'], reg_data['営業収益営業利益率'], 
-                    marker='o', label=region, color=region_colors.get(region, '#333'), linewidth=2, markersize=4)
-        ax5.set_title('地域別営業利益率の推移（四半期）', fontsize=14, fontweight='bold')
-        ax5.set_xlabel('決算四半期')
-        ax5.set_ylabel('営業利益率（%）')
-        ax5.axhline(y=0, color='black', linewidth=0.5)
-        ax5.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
-        ax5.tick_params(axis='x', rotation=45)
-        ax5.grid(True, alpha=0.3)
-        plt.tight_layout()
-        st.pyplot(fig5)
-        
-        # 営業利益率テーブル
-        st.markdown("#### 営業利益率一覧（%）")
-        pivot_margin = df_filtered.pivot_table(
-            index='決算年度', columns='地域', values='営業収益営業利益率', aggfunc='sum'
-        ).reindex(selected_quarters).reindex(columns=region_list).T
-        st_df(pivot_margin.style.format("{:.1f}"))
-        
-        html_margin = get_html_report(pivot_margin, "地域別営業利益率の推移（四半期）", fig5)
-        st.download_button("📥 HTMLでダウンロード（チャート＋テーブル）", html_margin, "営業利益率レポート_四半期.html", "text/html", key="margin_html")
+    if tab_open(tab_margin):
+        with tab_margin:
+            st.subheader("地域別営業利益率の推移（四半期）")
+            for view in tab_views('margin'):
+                render_view(view)
 
     # ==========================================================
     # タブ4: 前年同期比
     # ==========================================================
-    with tab_yoy:
-        st.subheader("地域別営業収益 前年同期比成長率")
-        
-        # 前年同期比を計算
-        yoy_df = pd.DataFrame()
-        for region in region_list:
-            reg_data = df_raw[df_raw['地域'] == region].sort_values('四半期数値').copy()
-            # 前年同期（4四半期前）との比較
-            reg_data['前年同期比'] = np.round(
-                (reg_data['営業収益'] / reg_data['営業収益'].shift(4) - 1) * 100, 1
-            )
-            yoy_df = pd.concat([yoy_df, reg_data], axis=0)
-        
-        yoy_df = yoy_df.reset_index(drop=True)
-        yoy_filtered = yoy_df[yoy_df['決算年度'].isin(selected_quarters)]
-        
-        fig6, ax6 = plt.subplots(figsize=(14, 7))
-        for region in region_list:
-            reg_data = yoy_filtered[yoy_filtered['地域'] == region].sort_values('四半期数値')
-            ax6.plot(reg_data['決算年度'], reg_data['前年同期比'], 
-                    marker='o', label=region, color=region_colors.get(region, '#333'), linewidth=2, markersize=4)
-        ax6.set_title('地域別営業収益 前年同期比成長率', fontsize=14, fontweight='bold')
-        ax6.set_xlabel('決算四半期')
-        ax6.set_ylabel('成長率（%）')
-        ax6.axhline(y=0, color='black', linewidth=0.5, linestyle='--')
-        ax6.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
-        ax6.tick_params(axis='x', rotation=45)
-        ax6.grid(True, alpha=0.3)
-        plt.tight_layout()
-        st.pyplot(fig6)
-        
-        # 前年同期比テーブル
-        st.markdown("#### 前年同期比成長率一覧（%）")
-        pivot_yoy = yoy_filtered.pivot_table(
-            index='決算年度', columns='地域', values='前年同期比', aggfunc='sum'
-        ).reindex(selected_quarters).reindex(columns=region_list).T
-        st_df(pivot_yoy.style.format("{:.1f}"))
-        
-        html_yoy = get_html_report(pivot_yoy, "地域別営業収益 前年同期比成長率", fig6)
-        st.download_button("📥 HTMLでダウンロード（チャート＋テーブル）", html_yoy, "前年同期比レポート.html", "text/html", key="yoy_html")
-        
-        st.divider()
-        
-        # 営業利益の前年同期比
-        st.subheader("地域別営業利益 前年同期比成長率")
-        
-        yoy_profit_df = pd.DataFrame()
-        for region in region_list:
-            reg_data = df_raw[df_raw['地域'] == region].sort_values('四半期数値').copy()
-            reg_data['営業利益前年同期比'] = np.round(
-                (reg_data['営業利益'] / reg_data['営業利益'].shift(4) - 1) * 100, 1
-            )
-            yoy_profit_df = pd.concat([yoy_profit_df, reg_data], axis=0)
-        
-        yoy_profit_df = yoy_profit_df.reset_index(drop=True)
-        yoy_profit_filtered = yoy_profit_df[yoy_profit_df['決算年度'].isin(selected_quarters)]
-        
-        fig7, ax7 = plt.subplots(figsize=(14, 7))
-        for region in region_list:
-            reg_data = yoy_profit_filtered[yoy_profit_filtered['地域'] == region].sort_values('四半期数値')
-            ax7.plot(reg_data['決算年度'], reg_data['営業利益前年同期比'], 
-                    marker='o', label=region, color=region_colors.get(region, '#333'), linewidth=2, markersize=4)
-        ax7.set_title('地域別営業利益 前年同期比成長率', fontsize=14, fontweight='bold')
-        ax7.set_xlabel('決算四半期')
-        ax7.set_ylabel('成長率（%）')
-        ax7.axhline(y=0, color='black', linewidth=0.5, linestyle='--')
-        ax7.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
-        ax7.tick_params(axis='x', rotation=45)
-        ax7.grid(True, alpha=0.3)
-        plt.tight_layout()
-        st.pyplot(fig7)
-        
-        # 営業利益前年同期比テーブル
-        st.markdown("#### 営業利益 前年同期比成長率一覧（%）")
-        pivot_yoy_profit = yoy_profit_filtered.pivot_table(
-            index='決算年度', columns='地域', values='営業利益前年同期比', aggfunc='sum'
-        ).reindex(selected_quarters).reindex(columns=region_list).T
-        st_df(pivot_yoy_profit.style.format("{:.1f}"))
-        
-        html_yoy_profit = get_html_report(pivot_yoy_profit, "地域別営業利益 前年同期比成長率", fig7)
-        st.download_button("📥 HTMLでダウンロード（チャート＋テーブル）", html_yoy_profit, "営業利益前年同期比レポート.html", "text/html", key="yoy_profit_html")
+    if tab_open(tab_yoy):
+        with tab_yoy:
+            # 寄与度分解の選択肢は成長率の下に置くため、成長率は先に確保した枠に描画する
+            growth_area = st.container()
+            st.divider()
+            st.subheader("前年同期比の寄与度分解")
+            st.caption("全体の前年同期比を地域別の寄与度（前年同期差 ÷ 前年同期の全体合計）に分解します。"
+                       "営業利益の増減は、増収効果・構成変化効果（地域構成の変化）・利益率変化効果と、"
+                       "営業収益が0の地域の利益などそれらで表せない差額（その他）に分けて表示します。")
+            if selected_quarters and st.session_state.get('contrib_quarter') not in selected_quarters:
+                st.session_state['contrib_quarter'] = selected_quarters[-1]
+            contrib_col1, contrib_col2 = st.columns(2)
+            with contrib_col1:
+                contrib_metric = st.radio("寄与度の指標", CONTRIB_METRICS, horizontal=True, key="contrib_metric")
+            with contrib_col2:
+                contrib_quarter = st.selectbox("ウォーターフォールの四半期", selected_quarters, key="contrib_quarter")
+            # 最新四半期は既定値（None）として渡し、事前描画したキャッシュを使う
+            latest = selected_quarters[-1] if selected_quarters else None
+            view_yoy, view_yoy_profit, view_contribution = tab_views(
+                'yoy', (contrib_metric, None if contrib_quarter == latest else contrib_quarter))
+            with growth_area:
+                st.subheader("地域別営業収益 前年同期比成長率")
+                render_view(view_yoy)
+                st.divider()
+                st.subheader("地域別営業利益 前年同期比成長率")
+                render_view(view_yoy_profit)
+            if view_contribution is not None:
+                render_view(view_contribution)
+            else:
+                st.info("表示範囲の四半期がありません。")
 
     # ==========================================================
     # タブ5: 季節性分析
     # ==========================================================
-    with tab_seasonal:
-        st.subheader("四半期別季節性分析")
-        
-        # 四半期別の平均を計算
-        seasonal_df = df_raw.copy()
-        seasonal_df['Q'] = seasonal_df['決算種別']
-        
-        # 営業収益の四半期別平均（地域別）
-        seasonal_rev = seasonal_df.pivot_table(
-            index='Q', columns='地域', values='営業収益', aggfunc='mean'
-        ).reindex(['Q1', 'Q2', 'Q3', 'Q4']).reindex(columns=region_list)
-        
-        fig8, ax8 = plt.subplots(figsize=(10, 6))
-        x = np.arange(4)
-        width = 0.2
-        for i, region in enumerate(region_list):
-            ax8.bar(x + i * width, seasonal_rev[region], width, 
-                   label=region, color=region_colors.get(region, '#333'))
-        ax8.set_title('地域別 四半期平均営業収益', fontsize=14, fontweight='bold')
-        ax8.set_xlabel('四半期')
-        ax8.set_ylabel('平均営業収益（百万円）')
-        ax8.set_xticks(x + width * (len(region_list) - 1) / 2)
-        ax8.set_xticklabels(['Q1', 'Q2', 'Q3', 'Q4'])
-        ax8.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
-        ax8.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: format(int(x), ',')))
-        ax8.grid(True, alpha=0.3, axis='y')
-        plt.tight_layout()
-        st.pyplot(fig8)
-        
-        st.markdown("#### 四半期別平均営業収益（百万円）")
-        st_df(seasonal_rev.T.style.format("{:,.0f}"))
-        
-        st.divider()
-        
-        # 営業利益の四半期別平均（地域別）
-        seasonal_profit = seasonal_df.pivot_table(
-            index='Q', columns='地域', values='営業利益', aggfunc='mean'
-        ).reindex(['Q1', 'Q2', 'Q3', 'Q4']).reindex(columns=region_list)
-        
-        fig9, ax9 = plt.subplots(figsize=(10, 6))
-        for i, region in enumerate(region_list):
-            ax9.bar(x + i * width, seasonal_profit[region], width, 
-                   label=region, color=region_colors.get(region, '#333'))
-        ax9.set_title('地域別 四半期平均営業利益', fontsize=14, fontweight='bold')
-        ax9.set_xlabel('四半期')
-        ax9.set_ylabel('平均営業利益（百万円）')
-        ax9.set_xticks(x + width * (len(region_list) - 1) / 2)
-        ax9.set_xticklabels(['Q1', 'Q2', 'Q3', 'Q4'])
-        ax9.axhline(y=0, color='black', linewidth=0.5)
-        ax9.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
-        ax9.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: format(int(x), ',')))
-        ax9.grid(True, alpha=0.3, axis='y')
-        plt.tight_layout()
-        st.pyplot(fig9)
-        
-        st.markdown("#### 四半期別平均営業利益（百万円）")
-        st_df(seasonal_profit.T.style.format("{:,.0f}"))
-        
-        st.divider()
-        
-        # 営業利益率の四半期別平均（地域別）
-        seasonal_margin = seasonal_df.pivot_table(
-            index='Q', columns='地域', values='営業収益営業利益率', aggfunc='mean'
-        ).reindex(['Q1', 'Q2', 'Q3', 'Q4']).reindex(columns=region_list)
-        
-        fig10, ax10 = plt.subplots(figsize=(10, 6))
-        for region in region_list:
-            ax10.plot(['Q1', 'Q2', 'Q3', 'Q4'], seasonal_margin[region], 
-                     marker='o', label=region, color=region_colors.get(region, '#333'), linewidth=2)
-        ax10.set_title('地域別 四半期平均営業利益率', fontsize=14, fontweight='bold')
-        ax10.set_xlabel('四半期')
-        ax10.set_ylabel('平均営業利益率（%）')
-        ax10.axhline(y=0, color='black', linewidth=0.5)
-        ax10.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
-        ax10.grid(True, alpha=0.3)
-        plt.tight_layout()
-        st.pyplot(fig10)
-        
-        st.markdown("#### 四半期別平均営業利益率（%）")
-        st_df(seasonal_margin.T.style.format("{:.1f}"))
-        
-        html_seasonal = get_html_report(seasonal_margin.T, "四半期別季節性分析", fig10)
-        st.download_button("📥 HTMLでダウンロード（チャート＋テーブル）", html_seasonal, "季節性分析レポート.html", "text/html", key="seasonal_html")
+    if tab_open(tab_seasonal):
+        with tab_seasonal:
+            st.subheader("四半期別季節性分析")
+            views = tab_views('seasonal')
+            average_views, factor_views = views[:3], views[3:]
+            for i, view in enumerate(average_views):
+                if i > 0:
+                    st.divider()
+                render_view(view)
+            st.divider()
+            st.subheader("季節成分（傾向・季節・残差への分解）")
+            st.caption("四半期平均には成長・縮小の傾向も含まれるため、中心化移動平均で求めた傾向を除き、"
+                       "四半期区分ごとの季節成分のみを表示します。季節成分を除いた系列（季節調整済み）は"
+                       "全体概要・利益率推移のチャートに破線で重ねています。")
+            for view in factor_views:
+                render_view(view)
 
     # ==========================================================
-    # タブ6: 地域詳細
+    # タブ6: 業績予測
     # ==========================================================
-    with tab_detail:
-        st.subheader(f"🔍 {selected_region} - 詳細分析（四半期）")
-        
-        # 地域データ抽出
-        reg_detail = df_filtered[df_filtered['地域'] == selected_region].sort_values('四半期数値').copy()
-        
-        if not reg_detail.empty:
-            # 前年同期比計算
-            reg_all = df_raw[df_raw['地域'] == selected_region].sort_values('四半期数値').copy()
-            reg_all['前年同期比'] = np.round(
-                (reg_all['営業収益'] / reg_all['営業収益'].shift(4) - 1) * 100, 1
-            )
-            reg_detail = reg_all[reg_all['決算年度'].isin(selected_quarters)].copy()
+    if tab_open(tab_forecast):
+        with tab_forecast:
+            st.subheader("地域別業績予測（四半期）")
             
-            quarters_display = reg_detail['決算年度'].tolist()
+            # 全地域・全モデルの予測はデータ読み込み後に一括計算済み（キャッシュ）
+            fc_col1, fc_col2, fc_col3 = st.columns(3)
+            with fc_col1:
+                fc_metric = st.radio("予測指標", FC_METRICS, horizontal=True, key="fc_metric")
+            with fc_col2:
+                fc_model = st.radio("予測モデル", FC_MODELS, horizontal=True, key="fc_model")
+            with fc_col3:
+                # 既定値は Session State で与える（保持した選択値との二重指定を避ける）
+                st.session_state.setdefault("fc_horizon", FC_HORIZON)
+                fc_horizon = st.slider("予測四半期数", min_value=4, max_value=FC_HORIZON, key="fc_horizon")
             
-            # 2x2サブプロット
-            fig11, axs = plt.subplots(2, 2, figsize=(14, 10))
-            
-            # 営業収益
-            axs[0, 0].bar(quarters_display, reg_detail['営業収益'], color=region_colors.get(selected_region, 'skyblue'))
-            axs[0, 0].set_title('営業収益', fontsize=12, fontweight='bold')
-            axs[0, 0].set_ylabel('金額（百万円）')
-            axs[0, 0].tick_params(axis='x', rotation=45)
-            axs[0, 0].yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: format(int(x), ',')))
-            
-            # 営業利益
-            colors = ['orange' if v >= 0 else 'red' for v in reg_detail['営業利益']]
-            axs[0, 1].bar(quarters_display, reg_detail['営業利益'], color=colors)
-            axs[0, 1].set_title('営業利益', fontsize=12, fontweight='bold')
-            axs[0, 1].set_ylabel('金額（百万円）')
-            axs[0, 1].axhline(y=0, color='black', linewidth=0.5)
-            axs[0, 1].tick_params(axis='x', rotation=45)
-            axs[0, 1].yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: format(int(x), ',')))
-            
-            # 前年同期比成長率
-            axs[1, 0].plot(quarters_display, reg_detail['前年同期比'], marker='o', 
-                          color=region_colors.get(selected_region, 'green'), linewidth=2)
-            axs[1, 0].set_title('営業収益 前年同期比成長率', fontsize=12, fontweight='bold')
-            axs[1, 0].set_ylabel('成長率（%）')
-            axs[1, 0].axhline(y=0, color='black', linewidth=0.5, linestyle='--')
-            axs[1, 0].tick_params(axis='x', rotation=45)
-            axs[1, 0].grid(True, alpha=0.3)
-            
-            # 営業利益率
-            axs[1, 1].plot(quarters_display, reg_detail['営業収益営業利益率'], marker='o', color='purple', linewidth=2)
-            axs[1, 1].set_title('営業利益率', fontsize=12, fontweight='bold')
-            axs[1, 1].set_ylabel('利益率（%）')
-            axs[1, 1].axhline(y=0, color='black', linewidth=0.5)
-            axs[1, 1].tick_params(axis='x', rotation=45)
-            axs[1, 1].grid(True, alpha=0.3)
-            
-            plt.tight_layout()
-            st.pyplot(fig11)
-            
-            # 詳細テーブル
-            st.markdown("#### 業績推移テーブル")
-            display_cols = ['決算年度', '営業収益', '営業利益', '前年同期比', '営業収益営業利益率']
-            display_df = reg_detail[display_cols].copy()
-            display_df = display_df.rename(columns={'営業収益営業利益率': '営業利益率'})
-            display_df = display_df.set_index('決算年度')
+            view_fc, = tab_views('forecast', (fc_metric, fc_model, fc_horizon))
+            if view_fc is not None:
+                render_view(view_fc)
+            else:
+                st.warning("予測に必要なデータ（2年分以上の四半期実績）が不足しているか、表示範囲に四半期がありません。")
+
+    # ==========================================================
+    # タブ7: 相関分析
+    # ==========================================================
+    if tab_open(tab_corr):
+        with tab_corr:
+            st.subheader("地域間の相関分析（全期間）")
             
-            format_dict = {
-                '営業収益': '{:,.0f}',
-                '営業利益': '{:,.0f}',
-                '前年同期比': '{:.1f}',
-                '営業利益率': '{:.1f}'
-            }
-            st_df(display_df.style.format(format_dict))
+            # 相関行列・季節指数はデータバージョンごとに一括計算済み（キャッシュ）
+            corr_target = st.radio("相関を見る指標", CORR_TARGETS, horizontal=True, key="corr_target")
+            view_corr, view_seasonal_index = tab_views('correlation', (corr_target,))
+            render_view(view_corr)
             
-            # 構成比テーブル（横持ち・バーチャート風スタイル）
-            st.markdown("#### 構成比推移")
-            comp_df = reg_detail[['決算年度', '営業収益構成比', '営業利益構成比']].copy()
-            comp_df = comp_df.set_index('決算年度').T
+            st.divider()
             
-            st_df(
-                comp_df.style.format("{:.1f}%").bar(subset=comp_df.columns, color='skyblue', vmin=0)
-            )
+            st.subheader("地域別 季節指数（営業収益・年度平均=100）")
+            render_view(view_seasonal_index)
+
+    # ==========================================================
+    # タブ8: カスタム指標
+    # ==========================================================
+    if tab_open(tab_derived):
+        with tab_derived:
+            st.subheader("カスタム指標（式で定義）")
+            st.caption("指標名（営業収益・営業利益・営業利益率・営業収益構成比・営業利益構成比）と四則演算、"
+                       "関数 lag / diff / qoq / yoy / total / share / abs を組み合わせて指標を定義できます"
+                       "（例: `営業利益構成比 - 営業収益構成比`、`diff(営業利益率, 4)`）。"
+                       "よく使う式は `data/metrics.json` に登録するとここに表示されます。")
+            presets = derived_metrics()
+            derived_col1, derived_col2 = st.columns([2, 1])
+            with derived_col1:
+                derived_name = st.selectbox("指標", [m.name for m in presets] + [CUSTOM_EXPRESSION],
+                                            key="derived_metric")
+            with derived_col2:
+                chart_label = st.radio("図表の種類", list(charts.DERIVED_CHARTS.values()), horizontal=True,
+                                       key="derived_chart")
+            if derived_name == CUSTOM_EXPRESSION:
+                st.session_state.setdefault('derived_expr', presets[0].expression)
+                expression = st.text_input("式", key="derived_expr")
+            else:
+                expression = next(m.expression for m in presets if m.name == derived_name)
+                st.caption(f"式: `{expression}`")
+            chart = list(charts.DERIVED_CHARTS)[list(charts.DERIVED_CHARTS.values()).index(chart_label)]
+            try:
+                view_derived, = tab_views('derived', (expression.strip(), chart))
+            except analytics.ExpressionError as e:
+                st.error(f"⚠️ {e}")
+            else:
+                render_view(view_derived)
+
+    # ==========================================================
+    # タブ9: 期間比較
+    # ==========================================================
+    if tab_open(tab_compare):
+        with tab_compare:
+            st.subheader("期間比較（任意の四半期区間）")
+            st.caption("基準期間と比較期間の営業収益・営業利益の合計、営業利益率・構成比の変化、"
+                       "営業収益の CAGR（1四半期あたりの平均額を区間の中央どうしの間隔で年率換算）を比較します。"
+                       "表示範囲の設定によらず全期間から選べます。")
+            all_quarters = list(load_cumulative_index(data_version, tuple(display.series), selected_company).quarters)
+            compare_default = analytics.default_comparison(all_quarters)
+            # 範囲スライダーは value で範囲を与える必要があるため、選択値は Session State の別キーに保持する
+            # （会社の切替などで選択中の四半期がなくなった場合は既定の区間に戻す）
+            compare_ranges = {}
+            compare_col1, compare_col2 = st.columns(2)
+            for col, key, label, default in ((compare_col1, 'cmp_base', "基準期間", compare_default[:2]),
+                                             (compare_col2, 'cmp_target', "比較期間", compare_default[2:])):
+                kept = st.session_state.get(f'_{key}', default)
+                with col:
+                    compare_ranges[key] = st.select_slider(
+                        label, all_quarters, value=kept if set(kept) <= set(all_quarters) else default, key=key)
+                st.session_state[f'_{key}'] = compare_ranges[key]
+            compare_params = compare_ranges['cmp_base'] + compare_ranges['cmp_target']
+            view_compare, = tab_views('compare', () if compare_params == compare_default else compare_params)
+            render_view(view_compare)
+
+    # ==========================================================
+    # タブ10: 設備投資（年度）
+    # ==========================================================
+    if tab_capex is not None and tab_open(tab_capex):
+        with tab_capex:
+            st.subheader("地域別 設備投資の分析（年度）")
+            st.caption("設備投資は通期（年度）の値のみのため、表示範囲に含まれる年度単位で表示します。"
+                       "投資回収年数 = 設備投資 ÷ 営業利益（営業利益が0以下の年度は空欄）。")
+
+            capex_metric = st.radio("設備投資の指標", list(analytics.CAPEX_METRICS),
+                                    horizontal=True, key="capex_metric")
+            view_capex, = tab_views('capex', (capex_metric,))
+            if view_capex is not None:
+                render_view(view_capex)
+            else:
+                st.info("表示範囲に設備投資データのある年度が含まれていません。")
+
+    # ==========================================================
+    # タブ11: 為替シナリオ（外貨建ての地域がある場合のみ）
+    # ==========================================================
+    if tab_fx is not None and tab_open(tab_fx):
+        with tab_fx:
+            st.subheader("為替感応度シナリオ（四半期）")
+            st.caption("外貨建て地域の円換算額（営業収益・営業利益）に為替変動率を適用します。+ は円安（円換算額が増加）。"
+                       "換算による増減は通貨ごとに「変動率 × その通貨建て地域の円換算額」を足し合わせて求めます。"
+                       "通貨別の円換算額は計算済みのため、スライダー操作は選んだ変動率の1シナリオ分の計算のみです。")
+
+            grid = analytics.FX_GRID
+            fx_cols = st.columns(len(fx_currencies))
+            fx_shocks = []
+            for col, currency in zip(fx_cols, fx_currencies):
+                with col:
+                    key = f"{FX_KEY_PREFIX}{currency}"
+                    st.session_state.setdefault(key, 0)
+                    fx_shocks.append(st.slider(f"{currency}の為替変動率（%）", min_value=grid[0], max_value=grid[-1],
+                                               step=grid[1] - grid[0], key=key))
+            view_fx, = tab_views('fx', tuple(fx_shocks))
+            render_view(view_fx)
+
+    # ==========================================================
+    # タブ12: 企業比較（複数企業のデータがある場合のみ）
+    # ==========================================================
+    if tab_company is not None and tab_open(tab_company):
+        with tab_company:
+            st.subheader("企業間の比較（全社合計・四半期）")
+
+            company_metric = st.radio("比較する指標", list(charts.COMPARISON_UNITS),
+                                      horizontal=True, key="company_metric")
+            view_company, = tab_views('company', (company_metric,))
+            render_view(view_company)
+
+    # ==========================================================
+    # タブ13: 修正差分（データの履歴が2バージョン以上ある場合のみ）
+    # ==========================================================
+    if tab_restatement is not None and tab_open(tab_restatement):
+        with tab_restatement:
+            st.subheader("データ修正の差分（全期間）")
+            st.caption("データファイルの内容が変わるたびに data/versions/ に履歴を保存します。"
+                       "2つのバージョンを比較し、修正（追加・削除を含む）されたセルと全地域合計の変動を表示します。")
+
+            # 既定は直前のバージョンと最新のバージョンの比較（Session State で与える）
+            if st.session_state.get("diff_old") not in versions:
+                st.session_state["diff_old"] = versions[-2]
+            if st.session_state.get("diff_new") not in versions:
+                st.session_state["diff_new"] = versions[-1]
+            diff_col1, diff_col2 = st.columns(2)
+            with diff_col1:
+                diff_old = st.selectbox("比較元（修正前）", versions, format_func=version_label, key="diff_old")
+            with diff_col2:
+                diff_new = st.selectbox("比較先（修正後）", versions, format_func=version_label, key="diff_new")
+            diff_metric = st.radio("比較する指標", list(analytics.DIFF_METRICS), horizontal=True, key="diff_metric")
+
+            if diff_old == diff_new:
+                st.info("異なる2つのバージョンを選択してください。")
+            else:
+                diff = load_version_diff(selected_company, diff_old, diff_new)
+                m_col1, m_col2, m_col3 = st.columns(3)
+                m_col1.metric("修正されたセル（全指標）", f"{diff.n_changed():,}")
+                m_col2.metric("修正を含む四半期", f"{len(diff.changed_quarters()):,}")
+                m_col3.metric(f"{diff_metric}の修正セル", f"{diff.n_changed(diff_metric):,}")
+                view_restatement, = tab_views('restatement', (diff_old, diff_new, diff_metric))
+                if view_restatement is not None:
+                    render_view(view_restatement)
+                else:
+                    st.info(f"選択した2つのバージョンの間で{diff_metric}の修正はありません。")
+
+    # ==========================================================
+    # タブ14: 地域詳細
+    # ==========================================================
+    if tab_open(tab_detail):
+        with tab_detail:
+            st.subheader(f"🔍 {selected_region} - 詳細分析（四半期）")
             
-            html_content = get_html_report(display_df, f"{selected_region} - 業績推移（四半期）", fig11)
-            st.download_button(f"📥 HTMLでダウンロード（チャート＋テーブル）", html_content, f"{selected_region}_詳細レポート_四半期.html", "text/html", key="detail_html")
-        
-        else:
-            st.warning("選択された地域のデータが見つかりません。")
+            view_detail, = tab_views('detail', (selected_region,))
+            if view_detail is not None:
+                render_view(view_detail)
+            else:
+                st.warning("選択された地域のデータが見つかりません。")
 
 else:
     st.error("データファイルが見つかりません。リポジトリの data/ フォルダを確認してください。")
@@ -588,6 +941,6 @@ else:
 st.divider()
 st.markdown("""
 <div style="text-align: center; color: #888; font-size: 12px;">
-    🌏 イオン 地域別業績分析ダッシュボード（四半期） | Powered by Streamlit
+    📊 イオン 四半期別セグメント業績分析ダッシュボード | Powered by Streamlit
 </div>
 """, unsafe_allow_html=True)
@@ -0,0 +1,146 @@
+"""エンティティ（地域・セグメント・企業）の登録簿
+
+表示順・色・グループ・通貨を data/entities.json で定義する。登録されていないエンティティは
+データから検出して末尾に追加し、色はパレットから自動で割り当てる。
+系列数が max_series を超える場合は、営業収益の上位のみを残して残りをグループ（未設定は「その他」）に合算する
+（合算先を含めて max_series 以内）。
+"""
+import json
+import os
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+import analytics
+
+OTHER = 'その他'
+MAX_SERIES = 10  # チャートに個別表示する系列数の上限（「その他」を含む）
+OTHER_COLOR = '#7f7f7f'
+# 未登録エンティティ用のパレット（tab20 からグレーを除いたもの）
+PALETTE = [
+    '#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#bcbd22', '#17becf',
+    '#aec7e8', '#ffbb78', '#98df8a', '#ff9896', '#c5b0d5', '#c49c94', '#f7b6d2', '#dbdb8d', '#9edae5',
+]
+
+
+@dataclass
+class Entity:
+    """登録済みエンティティ"""
+    name: str
+    color: str = None
+    group: str = None  # 例: 小売 / 金融（集計・凡例の補助情報）
+    currency: str = None  # 外貨建てで円換算している場合の通貨（為替シナリオの対象。円建ては None）
+
+@dataclass
+class EntityRegistry:
+    """エンティティの表示順・色・グループ"""
+    entities: list = field(default_factory=list)  # Entity（表示順）
+    max_series: int = MAX_SERIES
+
+    @classmethod
+    def load(cls, path):
+        """JSON 定義を読み込む（ファイルがなければ空の登録簿）"""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, encoding='utf-8') as f:
+            spec = json.load(f)
+        return cls(
+            entities=[Entity(**e) for e in spec.get('entities', [])],
+            max_series=spec.get('max_series', MAX_SERIES),
+        )
+
+    @property
+    def names(self):
+        return [e.name for e in self.entities]
+
+    def order(self, present, weights=None):
+        """データに存在するエンティティを表示順に並べる
+
+        登録済みは登録順、未登録は weights（営業収益合計など）の降順で末尾に追加。
+        「その他」は常に最後。
+        """
+        present = set(present)
+        registered = [n for n in self.names if n in present and n != OTHER]
+        weights = weights or {}
+        extra = sorted((n for n in present if n not in self.names and n != OTHER),
+                       key=lambda n: (-weights.get(n, 0), n))
+        return registered + extra + ([OTHER] if OTHER in present else [])
+
+    def fold_map(self, present, weights=None):
+        """エンティティ → 表示系列名
+
+        系列数が max_series 以下なら恒等写像。超える場合は weights（営業収益合計など）の上位を残し、
+        残りは登録済みのグループ名（未設定なら「その他」）に合算する。上位の件数は合算先の数を含めて
+        max_series に収まるまで減らし、グループだけで収まらない場合は残りをすべて「その他」に合算する。
+        """
+        ordered = self.order(present, weights)
+        if len(ordered) <= self.max_series:
+            return {n: n for n in ordered}
+        weights = weights or {}
+        ranked = sorted((n for n in ordered if n != OTHER), key=lambda n: -weights.get(n, 0))
+        groups = self.groups(ordered)
+        for k in range(self.max_series - 1, 0, -1):
+            rest = ranked[k:] + ([OTHER] if OTHER in ordered else [])
+            if k + len({groups[n] or OTHER for n in rest}) <= self.max_series:
+                top = set(ranked[:k])
+                return {n: n if n in top else (groups[n] or OTHER) for n in ordered}
+        top = set(ranked[:self.max_series - 1])
+        return {n: n if n in top else OTHER for n in ordered}
+
+    def display(self, present, weights=None):
+        """チャートに表示する系列名（表示順、「その他」は最後）"""
+        series = list(dict.fromkeys(self.fold_map(present, weights).values()))
+        return [n for n in series if n != OTHER] + ([OTHER] if OTHER in series else [])
+
+    def colors(self, names):
+        """エンティティ → 色。未登録は登録色と重ならないようパレットから順に割り当て"""
+        registered = {e.name: e.color for e in self.entities if e.color}
+        used = set(registered.values())
+        palette = [c for c in PALETTE if c not in used] or PALETTE
+        result, i = {}, 0
+        for name in names:
+            if name in registered:
+                result[name] = registered[name]
+            elif name == OTHER:
+                result[name] = OTHER_COLOR
+            else:
+                result[name] = palette[i % len(palette)]
+                i += 1
+        return result
+
+    def groups(self, names):
+        """エンティティ → グループ（未登録・未設定は None）"""
+        registered = {e.name: e.group for e in self.entities}
+        return {name: registered.get(name) for name in names}
+
+    def currencies(self, names):
+        """外貨建てエンティティ → 通貨（円建て・未登録は含めない）"""
+        registered = {e.name: e.currency for e in self.entities if e.currency}
+        return {name: registered[name] for name in names if name in registered}
+
+
+@dataclass
+class DisplayData:
+    """登録簿を適用した表示用データ"""
+    df: pd.DataFrame   # 上位＋その他に合算済みのデータ
+    series: list       # チャートに表示する系列（表示順）
+    entities: list     # 合算前の全エンティティ（表示順）
+    colors: dict       # 系列・エンティティ → 色
+    mapping: dict      # 元のエンティティ → 表示系列
+    currencies: dict = field(default_factory=dict)  # 外貨建てエンティティ → 通貨
+
+def prepare_display(df, registry, entity_col='地域'):
+    """登録簿の表示順・色・合算ルールをデータに適用（app.py・prerender.py 共通）"""
+    weights = df.groupby(entity_col)['営業収益'].sum().to_dict()
+    present = df[entity_col].unique()
+    mapping = registry.fold_map(present, weights)
+    all_entities = registry.order(present, weights)
+    series = registry.display(present, weights)
+    return DisplayData(
+        df=analytics.fold_entities(df, mapping, entity_col),
+        series=series,
+        entities=all_entities,
+        colors=registry.colors(list(dict.fromkeys(all_entities + series))),
+        mapping=mapping,
+        currencies=registry.currencies(all_entities),
+    )
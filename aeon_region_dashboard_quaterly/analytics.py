@@ -0,0 +1,1279 @@
+"""業績データの集計・分析ロジック（Streamlit 非依存）
+
+app.py の UI から呼び出される数値処理をまとめたモジュール。
+四半期 × エンティティ（地域・セグメント）の行列を単位に、全エンティティをまとめて計算する。
+"""
+import ast
+import functools
+import hashlib
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+SEASON_LENGTH = 4  # 四半期データの季節周期
+METRIC_COLS = ['営業収益', '営業利益', '営業収益営業利益率', '営業収益構成比', '営業利益構成比']
+
+
+# --- 1. 四半期ラベル ---
+def sort_quarter_key(q):
+    """四半期のソートキーを生成（例: FY2023-1Q → 20231）"""
+    parts = q.replace('FY', '').replace('Q', '').split('-')
+    return int(parts[0]) * 10 + int(parts[1])
+
+def shift_quarter(q, n):
+    """四半期ラベルを n 四半期ずらす（例: FY2025-3Q, 2 → FY2026-1Q）"""
+    key = sort_quarter_key(q)
+    idx = (key // 10) * 4 + (key % 10 - 1) + n
+    return f"FY{idx // 4}-{idx % 4 + 1}Q"
+
+
+# --- 2. データの前処理 ---
+def convert_to_numeric(series):
+    """カンマ区切り文字列を数値に変換"""
+    if not pd.api.types.is_numeric_dtype(series):
+        return pd.to_numeric(
+            series.astype(str).str.replace(',', '').str.strip(),
+            errors='coerce'
+        ).fillna(0)
+    return series
+
+def prepare_quarterly_data(df, entity_col='地域'):
+    """読み込んだ生データを四半期分析用に整形（app.py・API サーバー共通）"""
+    # 決算種別がQ1, Q2, Q3, Q4のデータのみを抽出
+    df = df[df['決算種別'].isin(['Q1', 'Q2', 'Q3', 'Q4'])].reset_index(drop=True)
+    
+    # 数値カラムの変換（必要に応じて）
+    numeric_cols = METRIC_COLS
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = convert_to_numeric(df[col])
+    
+    # 四半期ソート用の数値列を追加（FY2023-1Q → 20231）
+    df['四半期数値'] = df['決算年度'].apply(sort_quarter_key)
+    df = df.sort_values([entity_col, '四半期数値']).reset_index(drop=True)
+    
+    # 年度と四半期を分割
+    df['年度'] = df['決算年度'].str.extract(r'(FY\d{4})')[0]
+    df['四半期'] = df['決算種別']
+    
+    return df
+
+SUM_COLS = ['営業収益', '営業利益', '営業収益構成比', '営業利益構成比', '設備投資']  # 合算可能な列
+ID_COLS = ['決算年度', '決算種別', '四半期数値', '年度', '四半期']
+
+def fold_entities(df, mapping, entity_col='地域'):
+    """エンティティ名を mapping（元の名前 → 表示系列名）で置き換え、同じ系列になった行を合算
+
+    合算した系列の営業利益率は合算後の営業収益・営業利益から再計算する。
+    合算の対象にならない系列の行はそのまま残す。
+    """
+    target = df[entity_col].map(mapping).fillna(df[entity_col])
+    merged = target.isin(target[target != df[entity_col]].unique())
+    if not merged.any():
+        return df
+    rows = df[merged].assign(**{entity_col: target[merged]})
+    keys = [entity_col] + [c for c in ID_COLS if c in df.columns]
+    sum_cols = [c for c in SUM_COLS if c in df.columns and pd.api.types.is_numeric_dtype(df[c])]
+    folded = rows.groupby(keys, sort=False)[sum_cols].sum(min_count=1).reset_index()
+    if '営業収益営業利益率' in df.columns:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            margin = (folded['営業利益'] / folded['営業収益'] * 100).round(1)
+        folded['営業収益営業利益率'] = margin.where(np.isfinite(margin), 0.0)
+    df = pd.concat([df[~merged], folded], ignore_index=True)
+    order = [entity_col, '四半期数値'] if '四半期数値' in df.columns else [entity_col, '決算年度']
+    return df.sort_values(order).reset_index(drop=True)
+
+
+# --- 3. データバージョンと指標ストア ---
+def file_version(path):
+    """ファイルの更新時刻とサイズからデータバージョン文字列を生成（キャッシュキー用）"""
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+@dataclass
+class MetricStore:
+    """四半期 × エンティティの指標行列をまとめたストア"""
+    quarters: list   # ソート済み四半期ラベル（行）
+    entities: list   # 表示順のエンティティ名（列）
+    values: dict     # 指標名 → (四半期数, エンティティ数) の float 配列
+
+    def frame(self, metric):
+        """指標を DataFrame（行: 四半期, 列: エンティティ）として取得"""
+        return pd.DataFrame(self.values[metric], index=self.quarters, columns=self.entities)
+
+    @property
+    def fiscal_years(self):
+        """各行の決算年度（例: FY2023）"""
+        return np.array([q.split('-')[0] for q in self.quarters])
+
+    @property
+    def quarter_labels(self):
+        """各行の四半期区分（Q1〜Q4）"""
+        return np.array([f"Q{sort_quarter_key(q) % 10}" for q in self.quarters])
+
+def build_metric_store(df, entities, entity_col='地域', metrics=METRIC_COLS):
+    """縦持ちデータから指標ストアを構築"""
+    quarters = sorted(df['決算年度'].unique(), key=sort_quarter_key)
+    values = {}
+    for metric in metrics:
+        if metric not in df.columns:
+            continue
+        pivot = df.pivot_table(
+            index='決算年度', columns=entity_col, values=metric, aggfunc='sum'
+        ).reindex(quarters).reindex(columns=entities)
+        values[metric] = pivot.to_numpy(dtype=float)
+    return MetricStore(quarters=list(quarters), entities=list(entities), values=values)
+
+
+def yoy_growth(values, m=SEASON_LENGTH):
+    """前年同期比成長率（%）を全列同時に計算。先頭1年分と前年値0の期はNaN"""
+    prev = np.full_like(values, np.nan)
+    prev[m:] = values[:-m]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = (values / prev - 1) * 100
+    growth[~np.isfinite(growth)] = np.nan
+    return growth
+
+
+# --- 4. 業績予測（全エンティティ一括） ---
+@dataclass
+class ForecastResult:
+    """予測結果（行: 将来四半期, 列: エンティティ）"""
+    point: pd.DataFrame
+    lower: pd.DataFrame
+    upper: pd.DataFrame
+    params: pd.DataFrame = None  # Holt-Winters の平滑化パラメータ（行: エンティティ）
+
+HW_GRID = np.array([0.1, 0.3, 0.5, 0.7, 0.9])  # α, β, γ の探索候補
+HW_TREND_GRID = np.array([0.01, 0.05, 0.1, 0.2])
+
+def seasonal_naive_batch(y, horizon, m=SEASON_LENGTH):
+    """季節ナイーブ予測（前年同期の値をそのまま延長）を全列同時に計算"""
+    T = y.shape[0]
+    steps = np.arange(horizon)
+    point = y[T - m + steps % m]
+    resid = y[m:] - y[:-m]
+    sigma = np.sqrt(np.nanmean(resid ** 2, axis=0))
+    # 何年先の同期を参照しているかに応じて誤差幅を拡大
+    spread = np.sqrt(steps // m + 1)[:, None] * sigma[None, :]
+    return point, spread
+
+def holt_winters_batch(y, horizon, m=SEASON_LENGTH):
+    """加法型 Holt-Winters を全パラメータ候補 × 全列で一括当てはめ・予測
+
+    時間方向の漸化式のみループし、パラメータ候補とエンティティは
+    (候補数, 列数) の配列としてまとめて更新する。候補は1期先予測誤差の二乗和で選択。
+    """
+    T, E = y.shape
+    a, b, g = np.meshgrid(HW_GRID, HW_TREND_GRID, HW_GRID, indexing='ij')
+    a, b, g = a.reshape(-1, 1), b.reshape(-1, 1), g.reshape(-1, 1)
+    P = a.shape[0]
+
+    # 初期値: 1年目の平均を水準、1年目→2年目の平均差をトレンドとする
+    level = np.broadcast_to(y[:m].mean(axis=0), (P, E)).copy()
+    trend = np.broadcast_to((y[m:2 * m].mean(axis=0) - y[:m].mean(axis=0)) / m, (P, E)).copy()
+    season = np.broadcast_to(y[:m] - y[:m].mean(axis=0), (P, m, E)).transpose(1, 0, 2).copy()
+    sse = np.zeros((P, E))
+
+    for t in range(m, T):
+        s_prev = season[t % m]
+        err = y[t] - (level + trend + s_prev)
+        sse += err ** 2
+        new_level = a * (y[t] - s_prev) + (1 - a) * (level + trend)
+        trend = b * (new_level - level) + (1 - b) * trend
+        season[t % m] = g * (y[t] - new_level) + (1 - g) * s_prev
+        level = new_level
+
+    best = sse.argmin(axis=0)
+    cols = np.arange(E)
+    steps = np.arange(1, horizon + 1)
+    season_idx = (T + steps - 1) % m
+    point = (level[best, cols][None, :]
+             + steps[:, None] * trend[best, cols][None, :]
+             + season[season_idx][:, best, cols])
+    sigma = np.sqrt(sse[best, cols] / max(T - m, 1))
+    spread = np.sqrt(steps)[:, None] * sigma[None, :]
+    params = np.column_stack([a[best, 0], b[best, 0], g[best, 0]])
+    return point, spread, params
+
+def fit_forecasts(store, metrics=('営業収益', '営業利益'), horizon=8):
+    """指定指標について季節ナイーブ・Holt-Winters の予測を全エンティティ分まとめて計算"""
+    future = [shift_quarter(store.quarters[-1], h) for h in range(1, horizon + 1)]
+    results = {}
+    for metric in metrics:
+        # 欠損四半期は0扱い（読み込み時の数値変換と同じ方針）
+        y = np.nan_to_num(store.values[metric])
+        if y.shape[0] < 2 * SEASON_LENGTH:
+            continue
+
+        def to_frame(arr):
+            return pd.DataFrame(arr, index=future, columns=store.entities)
+
+        point, spread = seasonal_naive_batch(y, horizon)
+        results[(metric, '季節ナイーブ')] = ForecastResult(
+            to_frame(point), to_frame(point - 1.96 * spread), to_frame(point + 1.96 * spread)
+        )
+        point, spread, params = holt_winters_batch(y, horizon)
+        results[(metric, 'Holt-Winters')] = ForecastResult(
+            to_frame(point), to_frame(point - 1.96 * spread), to_frame(point + 1.96 * spread),
+            pd.DataFrame(params, index=store.entities, columns=['α（水準）', 'β（トレンド）', 'γ（季節）'])
+        )
+    return results
+
+
+# --- 5. 相関・季節性マトリクス ---
+def nan_corr(x):
+    """列間の相関行列をペアごとの有効データで計算（欠損を含む行列を一括処理）"""
+    mask = np.isfinite(x).astype(float)
+    x0 = np.where(mask > 0, x, 0.0)
+    n = mask.T @ mask
+    sx = x0.T @ mask               # sx[i, j]: 列 j が有効な行での列 i の合計
+    sxx = (x0 ** 2).T @ mask
+    sxy = x0.T @ x0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sxy - sx * sx.T / n
+        var_x = sxx - sx ** 2 / n
+        corr = cov / np.sqrt(var_x * var_x.T)
+    corr[n < 3] = np.nan
+    return np.clip(corr, -1, 1)
+
+def seasonal_index(store, metric='営業収益'):
+    """季節指数（各年度平均=100 に対する四半期ごとの平均水準）を全エンティティ同時に計算"""
+    df = store.frame(metric)
+    fy = store.fiscal_years
+    grouped = df.groupby(fy)
+    # 4四半期そろった年度のみを対象
+    full_year = grouped.transform('count') == SEASON_LENGTH
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = (df / grouped.transform('mean')).where(full_year) * 100
+    return ratio.groupby(store.quarter_labels).mean().reindex(['Q1', 'Q2', 'Q3', 'Q4'])
+
+def compute_correlations(store):
+    """相関分析タブ用のマトリクスをまとめて計算"""
+    corr_sources = {
+        '営業収益 前年同期比': yoy_growth(store.values['営業収益']),
+        '営業利益 前年同期比': yoy_growth(store.values['営業利益']),
+        '営業利益率': store.values['営業収益営業利益率'],
+    }
+    result = {
+        name: pd.DataFrame(nan_corr(x), index=store.entities, columns=store.entities)
+        for name, x in corr_sources.items()
+    }
+    result['季節指数'] = seasonal_index(store, '営業収益')
+    return result
+
+
+# --- 6. 指標ビュー（API など UI 以外からの参照用） ---
+METRIC_VIEWS = {
+    'revenue': '営業収益',
+    'profit': '営業利益',
+    'margin': '営業収益営業利益率',
+    'revenue_share': '営業収益構成比',
+    'profit_share': '営業利益構成比',
+}
+YOY_VIEWS = {
+    'revenue_yoy': '営業収益',
+    'profit_yoy': '営業利益',
+}
+
+def build_metric_views(store):
+    """全期間の指標ビュー（行: 四半期, 列: エンティティ）をまとめて生成"""
+    views = {name: store.frame(metric) for name, metric in METRIC_VIEWS.items() if metric in store.values}
+    for name, metric in YOY_VIEWS.items():
+        # ダッシュボードの前年同期比テーブルと同じく小数1桁に丸める
+        views[name] = pd.DataFrame(np.round(yoy_growth(store.values[metric]), 1),
+                                   index=store.quarters, columns=store.entities)
+    return views
+
+def seasonal_stats(frame):
+    """四半期区分（Q1〜Q4）ごとの平均値"""
+    labels = [f"Q{sort_quarter_key(q) % 10}" for q in frame.index]
+    stats = frame.groupby(labels).mean().reindex(['Q1', 'Q2', 'Q3', 'Q4'])
+    stats.index.name = '四半期'
+    return stats
+
+
+# --- 7. 設備投資（年度データ） ---
+CAPEX_WINDOW = 3  # 複数年累計の年数
+CAPEX_METRICS = {
+    # 指標名 → (単位, 表示書式)
+    '設備投資': ('百万円', "{:,.0f}"),
+    '設備投資比率': ('%', "{:.1f}"),
+    '設備投資 前年比': ('%', "{:.1f}"),
+    '投資回収年数': ('年', "{:.2f}"),
+    f'設備投資 {CAPEX_WINDOW}年累計': ('百万円', "{:,.0f}"),
+    f'投資回収年数 {CAPEX_WINDOW}年累計': ('年', "{:.2f}"),
+}
+
+def prepare_annual_data(df):
+    """年度（通期）行のみを抽出して数値化（設備投資は年度行にのみ計上されている）"""
+    df = df[df['決算種別'] == '年度'].reset_index(drop=True)
+    for col in ['営業収益', '営業利益', '設備投資']:
+        if col in df.columns:
+            df[col] = convert_to_numeric(df[col])
+    return df
+
+def rolling_sum(values, window):
+    """累積和の差分で直近 window 行の合計を全列同時に計算（先頭 window-1 行は NaN）"""
+    csum = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+    result = np.full_like(values, np.nan)
+    result[window - 1:] = csum[window:] - csum[:-window]
+    return result
+
+def compute_capex_metrics(annual_df, entities, entity_col='地域', window=CAPEX_WINDOW):
+    """設備投資の指標（行: 年度, 列: エンティティ）をまとめて計算
+
+    設備投資比率 = 設備投資 / 営業収益、投資回収年数 = 設備投資 / 営業利益
+    （営業利益が0以下の年度は NaN）。累計指標は直近 window 年度の合計で計算する。
+    """
+    years = sorted(annual_df['決算年度'].unique(), key=lambda y: int(y.replace('FY', '')))
+
+    def matrix(col):
+        return annual_df.pivot_table(
+            index='決算年度', columns=entity_col, values=col, aggfunc='sum'
+        ).reindex(years).reindex(columns=entities).to_numpy(dtype=float)
+
+    capex, revenue, profit = matrix('設備投資'), matrix('営業収益'), matrix('営業利益')
+    capex_total, profit_total = rolling_sum(capex, window), rolling_sum(profit, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intensity = capex / revenue * 100
+        payback = np.where(profit > 0, capex / profit, np.nan)
+        payback_total = np.where(profit_total > 0, capex_total / profit_total, np.nan)
+    intensity[~np.isfinite(intensity)] = np.nan
+
+    arrays = {
+        '設備投資': capex,
+        '設備投資比率': intensity,
+        '設備投資 前年比': yoy_growth(capex, m=1),
+        '投資回収年数': payback,
+        f'設備投資 {window}年累計': capex_total,
+        f'投資回収年数 {window}年累計': payback_total,
+    }
+    return {name: pd.DataFrame(x, index=years, columns=entities) for name, x in arrays.items()}
+
+
+# --- 8. 複数企業ストア ---
+AMOUNT_COLS = ['営業収益', '営業利益']  # 整数（百万円）の列
+DIMENSION_COLS = ['会社', '地域', '決算年度']
+ANNUAL_COLS = ['営業収益', '営業利益', '設備投資']  # 年度行から保持する列（設備投資の指標用）
+
+@dataclass
+class CompanyStore:
+    """企業 × エンティティ × 四半期の縦持ちストア
+
+    次元（会社・地域・決算年度）はカテゴリ型で保持し、文字列は各カテゴリにつき1回だけ持つ。
+    行は 会社 → 地域 → 四半期 の順に並べ、1社分は連続した行範囲になる。
+    金額列は値域に収まる最小の整数型に縮める。比率列は表示値を変えないよう float64 のまま。
+    """
+    data: pd.DataFrame
+    dtypes: dict  # 指標列 → 縮める前の型（company_data で元に戻す）
+    annual: pd.DataFrame = None  # 設備投資列を持つ企業の年度行（会社はカテゴリ型で、カテゴリが該当企業）
+
+    @property
+    def companies(self):
+        return list(self.data['会社'].cat.categories)
+
+    @property
+    def quarters(self):
+        return list(self.data['決算年度'].cat.categories)
+
+    def memory_bytes(self):
+        return int(self.data.memory_usage(deep=True).sum())
+
+    def company_rows(self, company):
+        """1社分の行範囲"""
+        i = self.companies.index(company)
+        start, stop = np.searchsorted(self.data['会社'].cat.codes.to_numpy(), [i, i + 1])
+        return slice(int(start), int(stop))
+
+    def company_data(self, company, entity_col='地域'):
+        """1社分を prepare_quarterly_data と同じ形の DataFrame に戻す
+        比率列はストアの配列の行範囲をそのまま参照する（スナップショットではメモリマップのまま）。金額列は縮める前の型に戻す（1社分のみコピー）。
+        指標列はストアの配列の行範囲をそのまま参照する（型が元のままならコピーなし。スナップショットではメモリマップのまま）。
+        文字列の列はカテゴリのコードから組み立てる。
+        """
+        rows = self.company_rows(company)
+        quarters = self.data['決算年度'].array[rows]
+        keys = np.array([sort_quarter_key(q) for q in quarters.categories], dtype=np.int64)[quarters.codes]
+        kinds = np.array([f"Q{k % 10}" for k in keys], dtype=object)
+        data = {
+            entity_col: self.data['地域'].array[rows].astype(str),
+            '決算年度': quarters.astype(str),
+            '決算種別': kinds,
+        }
+        for col in METRIC_COLS:
+            if col in self.data.columns:
+                data[col] = self.data[col].to_numpy()[rows].astype(self.dtypes[col], copy=False)
+        data['四半期数値'] = keys
+        data['年度'] = np.array([q.split('-')[0] for q in data['決算年度']], dtype=object)
+        data['四半期'] = kinds
+        return pd.DataFrame(data, copy=False)
+
+    def company_annual(self, company, entity_col='地域'):
+        """1社分の年度行（prepare_annual_data の出力のうち設備投資の指標に使う列）。設備投資列がなければ None"""
+        if self.annual is None or company not in self.annual['会社'].cat.categories:
+            return None
+        rows = self.annual[self.annual['会社'] == company]
+        df = pd.DataFrame({entity_col: rows['地域'].astype(str).to_numpy(),
+                           '決算年度': rows['決算年度'].astype(str).to_numpy()})
+        for col in ANNUAL_COLS:
+            df[col] = rows[col].to_numpy()
+        return df
+
+def build_annual_frame(frames, entity_col='地域'):
+    """企業名 → 年度行（prepare_annual_data の出力）を1つの縦持ち表にまとめる（次元はカテゴリ型）"""
+    parts = [df[[entity_col, '決算年度'] + ANNUAL_COLS].rename(columns={entity_col: '地域'}).assign(会社=company)
+             for company, df in frames.items()]
+    annual = pd.concat(parts, ignore_index=True)
+    annual['会社'] = pd.Categorical(annual['会社'], categories=list(frames))
+    for col in ['地域', '決算年度']:
+        annual[col] = pd.Categorical(annual[col])
+    return annual[DIMENSION_COLS + ANNUAL_COLS]
+
+def build_company_store(frames, entity_col='地域', annual_frames=None):
+    """企業名 → 整形済みデータ（prepare_quarterly_data の出力）から複数企業ストアを構築
+
+    annual_frames（企業名 → prepare_annual_data の出力）を渡すと、設備投資の指標用に年度行も保持する。
+    """
+    parts = []
+    for company, df in frames.items():
+        cols = [entity_col, '決算年度'] + [c for c in METRIC_COLS if c in df.columns]
+        parts.append(df[cols].rename(columns={entity_col: '地域'}).assign(会社=company))
+    data = pd.concat(parts, ignore_index=True)
+    quarters = sorted(data['決算年度'].unique(), key=sort_quarter_key)
+    data['会社'] = pd.Categorical(data['会社'], categories=list(frames))
+    data['地域'] = pd.Categorical(data['地域'])
+    data['決算年度'] = pd.Categorical(data['決算年度'], categories=quarters, ordered=True)
+    data = data.sort_values(DIMENSION_COLS, kind='stable').reset_index(drop=True)
+    dtypes = {col: data[col].dtype for col in METRIC_COLS if col in data.columns}
+    for col in AMOUNT_COLS:
+        if col in data.columns and pd.api.types.is_integer_dtype(data[col]):
+            data[col] = pd.to_numeric(data[col], downcast='integer')
+    return CompanyStore(data=data[DIMENSION_COLS + [c for c in data.columns if c not in DIMENSION_COLS]],
+                        dtypes=dtypes,
+                        annual=build_annual_frame(annual_frames, entity_col) if annual_frames else None)
+
+def compare_companies(store):
+    """企業別の全社合計（営業収益・営業利益・営業利益率・前年同期比）を計算（行: 四半期, 列: 企業）"""
+    totals = store.data.groupby(['決算年度', '会社'], observed=False)[AMOUNT_COLS].sum(min_count=1)
+    revenue = totals['営業収益'].unstack('会社').astype(float)
+    profit = totals['営業利益'].unstack('会社').astype(float)
+    revenue.index, profit.index = list(revenue.index), list(profit.index)
+    revenue.columns.name = profit.columns.name = None
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margin = profit / revenue * 100
+    return {
+        '営業収益': revenue,
+        '営業利益': profit,
+        '営業利益率': margin.where(np.isfinite(margin)),
+        '営業収益 前年同期比': pd.DataFrame(yoy_growth(revenue.to_numpy()),
+                                    index=revenue.index, columns=revenue.columns),
+    }
+
+# 複数企業ストアのスナップショット（列ごとの .npy ＋ meta.json。年度行は annual*.npy）。
+# 書き出しは1回だけ行い、各プロセスは読み取り専用のメモリマップとして共有する（ページキャッシュ上の1部のみ）。
+# 列はストアの型（金額列は縮めた整数型）のまま書き出し、meta.json に列ごとの型を記録する。縮める前の型は company_data で戻す
+SNAPSHOT_FORMAT = 4
+SNAPSHOT_META = 'meta.json'
+
+def snapshot_key(data_version):
+    """データバージョン文字列からスナップショットのディレクトリ名を生成"""
+    return f"v{SNAPSHOT_FORMAT}_{hashlib.sha256(str(data_version).encode()).hexdigest()[:16]}"
+
+def _write_columns(df, directory, prefix):
+    """DataFrame を列ごとの .npy（カテゴリ型はコード）に型を変えずに書き出し、列の定義（名前・保存した型）を返す"""
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            values = series.cat.codes.to_numpy()
+            entry = {'name': col, 'categories': [str(c) for c in series.cat.categories],
+                     'ordered': bool(series.cat.ordered)}
+        else:
+            values = series.to_numpy()
+            entry = {'name': col}
+        entry['dtype'] = values.dtype.str
+        np.save(os.path.join(directory, f"{prefix}{i}.npy"), np.ascontiguousarray(values))
+        columns.append(entry)
+    return columns
+
+def _read_columns(directory, prefix, columns):
+    """_write_columns で書き出した列を読み取り専用のメモリマップとして開き、DataFrame にまとめる"""
+    data = {}
+    for i, entry in enumerate(columns):
+        values = np.load(os.path.join(directory, f"{prefix}{i}.npy"), mmap_mode='r').view(np.ndarray)
+        if 'categories' in entry:
+            values = pd.Categorical.from_codes(values, categories=entry['categories'], ordered=entry['ordered'])
+        data[entry['name']] = values
+    return pd.DataFrame(data, copy=False)
+
+def write_store_snapshot(store, directory):
+    """ストアを列ごとの .npy に書き出し、メモリマップで開き直したストアを返す
+
+    一時ディレクトリに書いてから rename するため、同時に起動したプロセスが書きかけを読むことはない。
+    先に別のプロセスが書き終えていれば、そちらを使う。
+    """
+    tmp = f"{directory}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    meta = {'format': SNAPSHOT_FORMAT, 'rows': len(store.data),
+            'columns': _write_columns(store.data, tmp, 'col'),
+            'annual': None if store.annual is None else _write_columns(store.annual, tmp, 'annual'),
+            'dtypes': {col: np.dtype(dtype).str for col, dtype in store.dtypes.items()}}
+    with open(os.path.join(tmp, SNAPSHOT_META), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    try:
+        os.rename(tmp, directory)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)  # 別のプロセスが先に書き出した
+    return attach_store_snapshot(directory)
+
+def attach_store_snapshot(directory):
+    """スナップショットを読み取り専用のメモリマップとして開く（解析・コピーなし）。なければ None"""
+    meta_path = os.path.join(directory, SNAPSHOT_META)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('format') != SNAPSHOT_FORMAT:
+        return None
+    return CompanyStore(data=_read_columns(directory, 'col', meta['columns']),
+                        dtypes={col: np.dtype(dtype) for col, dtype in meta['dtypes'].items()},
+                        annual=None if meta['annual'] is None else _read_columns(directory, 'annual', meta['annual']))
+
+def prune_snapshots(snapshots_dir, keep):
+    """keep（ディレクトリ名の集合）以外のスナップショットを削除（開いているプロセスのマップはファイル削除後も有効）"""
+    if not os.path.isdir(snapshots_dir):
+        return
+    for name in os.listdir(snapshots_dir):
+        if name not in keep and '.tmp-' not in name:
+            shutil.rmtree(os.path.join(snapshots_dir, name), ignore_errors=True)
+
+def company_paths(data_path, companies_dir, default_company):
+    """企業名 → データファイル（既定の企業＋ companies_dir 配下の同じ拡張子のファイル）"""
+    paths = {default_company: data_path} if os.path.exists(data_path) else {}
+    ext = os.path.splitext(data_path)[1]
+    if os.path.isdir(companies_dir):
+        for name in sorted(os.listdir(companies_dir)):
+            company, file_ext = os.path.splitext(name)
+            if file_ext == ext and company not in paths:
+                paths[company] = os.path.join(companies_dir, name)
+    return paths
+
+def files_version(paths):
+    """いずれかの企業のデータファイルが更新されたら変わるバージョン文字列（スナップショットのキー）"""
+    return "|".join(f"{company}:{file_version(path)}" for company, path in paths.items())
+
+def build_store_from_files(paths, read):
+    """企業名 → データファイルを read で1回ずつ解析して複数企業ストアを構築（設備投資列があれば年度行も保持）"""
+    raw = {company: read(path) for company, path in paths.items()}
+    annual = {company: prepare_annual_data(df) for company, df in raw.items() if '設備投資' in df.columns}
+    return build_company_store({company: prepare_quarterly_data(df) for company, df in raw.items()},
+                               annual_frames=annual)
+
+def open_store_snapshot(directory, build, keep=None):
+    """スナップショットをメモリマップで開く。なければ build() のストアを書き出して開く
+
+    keep（ディレクトリ名の集合）を渡すと、書き出した後に同じ親ディレクトリの他のスナップショットを削除する。
+    """
+    store = attach_store_snapshot(directory)
+    if store is None:
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        store = write_store_snapshot(build(), directory)
+        if keep is not None:
+            prune_snapshots(os.path.dirname(directory), keep)
+    return store
+
+
+# --- 9. データバージョンの履歴と差分（過去四半期の修正再表示） ---
+DIFF_METRICS = {'営業収益': ('百万円', "{:,.0f}"), '営業利益': ('百万円', "{:,.0f}"),
+                '営業収益営業利益率': ('%', "{:.1f}")}  # 指標名 → (単位, 表示書式)
+# 表示上の丸め（百万円・0.1%）未満の差は修正とみなさない
+DIFF_TOLERANCE = {'営業収益': 0.5, '営業利益': 0.5, '営業収益営業利益率': 0.05}
+
+def content_hash(path, length=12):
+    """ファイル内容の SHA-256（先頭 length 桁）。更新時刻が変わっても内容が同じなら同じ値"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+def list_versions(archive_dir):
+    """保存済みバージョン（ラベル → ファイル）を古い順に返す。ラベルは <更新時刻>_<内容ハッシュ>"""
+    if not os.path.isdir(archive_dir):
+        return {}
+    return {os.path.splitext(name)[0]: os.path.join(archive_dir, name) for name in sorted(os.listdir(archive_dir))}
+
+def archive_version(path, archive_dir):
+    """データファイルの現在の内容が未保存なら履歴に追加し、保存済みバージョンを返す"""
+    digest = content_hash(path)
+    versions = list_versions(archive_dir)
+    if not any(label.endswith(f"_{digest}") for label in versions):
+        os.makedirs(archive_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(os.stat(path).st_mtime))
+        shutil.copy2(path, os.path.join(archive_dir, f"{stamp}_{digest}{os.path.splitext(path)[1]}"))
+        versions = list_versions(archive_dir)
+    return versions
+
+@dataclass
+class VersionDiff:
+    """2つのデータバージョンを四半期 × エンティティに揃えた差分"""
+    quarters: list   # 両バージョンの四半期の和集合（ソート済み）
+    entities: list   # 両バージョンのエンティティの和集合（新しい版の表示順が先）
+    old: dict        # 指標名 → (四半期数, エンティティ数) の配列（該当なしは NaN）
+    new: dict
+    changed: dict    # 指標名 → 修正されたセルの bool 配列（追加・削除されたセルを含む）
+
+    @property
+    def metrics(self):
+        return list(self.changed)
+
+    def n_changed(self, metric=None):
+        """修正されたセル数（metric 省略時は全指標の合計）"""
+        metrics = self.metrics if metric is None else [metric]
+        return int(sum(self.changed[m].sum() for m in metrics))
+
+    def changed_quarters(self, metric=None):
+        """修正を含む四半期"""
+        metrics = self.metrics if metric is None else [metric]
+        rows = np.logical_or.reduce([self.changed[m].any(axis=1) for m in metrics])
+        return [q for q, hit in zip(self.quarters, rows) if hit]
+
+    def frame(self, metric, version='new'):
+        """指標を DataFrame（行: 四半期, 列: エンティティ）として取得"""
+        values = self.new[metric] if version == 'new' else self.old[metric]
+        return pd.DataFrame(values, index=self.quarters, columns=self.entities)
+
+    def mask(self, metric):
+        """修正されたセルの bool DataFrame（行: 四半期, 列: エンティティ）"""
+        return pd.DataFrame(self.changed[metric], index=self.quarters, columns=self.entities)
+
+    def changed_cells(self, metric, entity_col='地域'):
+        """修正されたセルの一覧（決算年度・エンティティ・修正前・修正後・差分・差分率）"""
+        rows, cols = np.nonzero(self.changed[metric])
+        old, new = self.old[metric][rows, cols], self.new[metric][rows, cols]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.where(old != 0, (new - old) / np.abs(old) * 100, np.nan)
+        return pd.DataFrame({
+            '決算年度': np.asarray(self.quarters, dtype=object)[rows],
+            entity_col: np.asarray(self.entities, dtype=object)[cols],
+            '修正前': old, '修正後': new, '差分': new - old, '差分率(%)': rate,
+        })
+
+    def totals(self, metric):
+        """全エンティティ合計の修正前後（行: 四半期）。利益率は合計の営業利益 ÷ 営業収益"""
+        def amount(values):
+            return np.where(np.isnan(values).all(axis=1), np.nan, np.nansum(values, axis=1))
+
+        def total(values):
+            if metric in AMOUNT_COLS:
+                return amount(values[metric])
+            revenue, profit = amount(values['営業収益']), amount(values['営業利益'])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.where(revenue != 0, profit / revenue * 100, np.nan)
+        old, new = total(self.old), total(self.new)
+        return pd.DataFrame({'修正前': old, '修正後': new, '差分': new - old}, index=self.quarters)
+
+def diff_stores(old, new, metrics=DIFF_METRICS, tolerance=DIFF_TOLERANCE):
+    """2つの指標ストアを四半期 × エンティティに揃え、修正されたセルをベクトル演算で検出"""
+    quarters = sorted(set(old.quarters) | set(new.quarters), key=sort_quarter_key)
+    entities = list(new.entities) + [e for e in old.entities if e not in new.entities]
+    aligned_old, aligned_new, changed = {}, {}, {}
+    for metric in metrics:
+        if metric not in old.values or metric not in new.values:
+            continue
+        a = old.frame(metric).reindex(index=quarters, columns=entities).to_numpy(dtype=float)
+        b = new.frame(metric).reindex(index=quarters, columns=entities).to_numpy(dtype=float)
+        # 片方のみ値があるセル（追加・削除）も修正として扱う
+        changed[metric] = ~(np.isnan(a) & np.isnan(b)) & ~(np.abs(b - a) <= tolerance.get(metric, 0))
+        aligned_old[metric], aligned_new[metric] = a, b
+    return VersionDiff(quarters=quarters, entities=entities, old=aligned_old, new=aligned_new, changed=changed)
+
+
+# --- 10. 為替感応度シナリオ（外貨建てエンティティの円換算） ---
+FX_GRID = tuple(range(-30, 31, 5))  # 為替変動率（%）の刻み。+ は円安（円換算額が増える）
+
+@dataclass
+class FxScenarios:
+    """為替変動率に対する円換算後の業績
+
+    換算による増減は通貨ごとに加法的（変動率 × その通貨建てエンティティの換算額）なため、
+    全組合せは展開せず、実績と通貨別の合計のみを保持して任意のシナリオを四半期 × エンティティ1回分の計算で求める。
+    """
+    currencies: list       # 対象通貨
+    grid: tuple            # 各通貨の為替変動率（%）の刻み
+    quarters: list
+    entities: list
+    membership: np.ndarray  # (通貨数, エンティティ数) のエンティティの通貨（0/1）
+    values: dict           # 指標名 → (四半期数, エンティティ数) の実績
+    totals: dict           # 指標名 → (四半期数,) の全エンティティ合計（実績）
+    exposure: dict         # 指標名 → (通貨数, 四半期数) の通貨別の外貨建てエンティティ合計
+
+    def factors(self, shocks):
+        """通貨ごとの為替変動率（通貨順のタプル、刻みの値）→ エンティティ別の換算係数 (エンティティ数,)"""
+        for s in shocks:
+            self.grid.index(s)  # 刻みにない変動率は ValueError
+        return 1 + np.asarray(shocks, dtype=float) @ self.membership / 100
+
+    def total(self, metric, shocks):
+        """全エンティティ合計 (四半期数,)。実績の合計に通貨別の増減を足すのみ"""
+        return self.totals[metric] + np.asarray(shocks, dtype=float) @ self.exposure[metric] / 100
+
+    def scenario(self, shocks):
+        """1シナリオ分の結果を DataFrame（行: 四半期）で取得"""
+        factors = self.factors(shocks)
+        frame = lambda values: pd.DataFrame(values, index=self.quarters, columns=self.entities)
+        result, totals = {}, {}
+        for metric in ('営業収益', '営業利益'):
+            values = self.values[metric] * factors
+            totals[metric] = self.total(metric, shocks)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                share = np.where(totals[metric][:, None] != 0, values / totals[metric][:, None] * 100, np.nan)
+            result[metric], result[f'{metric}構成比'] = frame(values), frame(share)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            margin = np.where(totals['営業収益'] != 0, totals['営業利益'] / totals['営業収益'] * 100, np.nan)
+        result['合計'] = pd.DataFrame({'営業収益': totals['営業収益'], '営業利益': totals['営業利益'],
+                                     '営業利益率': margin}, index=self.quarters)
+        return result
+
+    def sensitivity(self, rows, shocks, metric='営業利益'):
+        """指定四半期の合計の実績からの増減を刻み上で求める
+
+        通貨が1つなら (刻み数,)、2つ以上なら先頭2通貨の (刻み数, 刻み数) の面（他の通貨は shocks の変動率で固定）。
+        """
+        exposure = self.exposure[metric][:, rows].sum(axis=1) / 100
+        grid = np.asarray(self.grid, dtype=float)
+        if len(self.currencies) == 1:
+            return grid * exposure[0]
+        fixed = float(np.dot(np.asarray(shocks[2:], dtype=float), exposure[2:]))
+        return grid[:, None] * exposure[0] + grid[None, :] * exposure[1] + fixed
+
+def fx_scenarios(store, currencies, grid=FX_GRID):
+    """指標ストアの外貨建てエンティティについて、為替シナリオの計算に使う実績と通貨別の合計を求める
+
+    currencies はエンティティ → 通貨。エンティティ単体の利益率は換算で変わらないが、合計・構成比・全体の利益率は変わる。
+    """
+    names = list(dict.fromkeys(currencies[e] for e in store.entities if e in currencies))
+    membership = np.array([[currencies.get(e) == c for e in store.entities] for c in names],
+                          dtype=float).reshape(len(names), len(store.entities))
+    values = {m: store.values[m] for m in ('営業収益', '営業利益')}
+    return FxScenarios(
+        currencies=names, grid=tuple(grid), quarters=list(store.quarters), entities=list(store.entities),
+        membership=membership, values=values,
+        totals={m: np.nansum(v, axis=1) for m, v in values.items()},
+        exposure={m: membership @ np.nan_to_num(v).T for m, v in values.items()},
+    )
+
+
+# --- 11. 前年同期比の寄与度分解 ---
+PROFIT_EFFECTS = ['増収効果', '構成変化効果', '利益率変化効果', 'その他']
+
+@dataclass
+class GrowthContribution:
+    """全体の前年同期比をエンティティ別の寄与度と営業利益の要因（増収・構成変化・利益率変化）に分解した結果"""
+    quarters: list
+    entities: list
+    change: dict        # 指標名 → (四半期数, エンティティ数) の前年同期差
+    contribution: dict  # 指標名 → (四半期数, エンティティ数) の寄与度（ポイント、合計が全体の成長率）
+    growth: dict        # 指標名 → (四半期数,) の全体の前年同期比成長率（%）
+    totals: dict        # 指標名 → (四半期数, 2) の前年同期・当期の全体合計
+    effects: np.ndarray  # (四半期数, 4) の営業利益の前年同期差の要因（PROFIT_EFFECTS の順、合計が前年同期差）
+
+    @property
+    def metrics(self):
+        return list(self.contribution)
+
+    def frame(self, metric, kind='contribution'):
+        """寄与度（kind='contribution'）または前年同期差（kind='change'）の DataFrame（行: 四半期）"""
+        values = self.contribution[metric] if kind == 'contribution' else self.change[metric]
+        return pd.DataFrame(values, index=self.quarters, columns=self.entities)
+
+    def summary(self, metric):
+        """前年同期・当期の全体合計と成長率の DataFrame（行: 四半期）"""
+        prev, cur = self.totals[metric].T
+        return pd.DataFrame({'前年同期': prev, '当期': cur, '成長率': self.growth[metric]}, index=self.quarters)
+
+    def effect_frame(self):
+        """営業利益の前年同期差の要因分解の DataFrame（行: 四半期）"""
+        return pd.DataFrame(self.effects, index=self.quarters, columns=PROFIT_EFFECTS)
+
+def growth_contributions(store, m=SEASON_LENGTH):
+    """全期間・全エンティティの前年同期比寄与度と営業利益の要因分解を一括で計算
+
+    寄与度 = エンティティの前年同期差 ÷ 前年同期の全体合計 × 100（ポイント）で、合計が全体の成長率になる。
+    営業利益の前年同期差は、増収効果（全体の増収 × 前年同期の利益率）、構成変化効果（構成比の変化 × 前年同期の
+    エンティティ別利益率）、利益率変化効果（当期の構成比 × エンティティ別利益率の変化）× 当期の全体営業収益に分解する。
+    営業収益が 0 で利益率を定義できないエンティティの利益などの差額は「その他」とし、要因の合計は常に前年同期差に一致する。
+    欠損は 0 として扱い、前年同期の全体合計が 0 の期の成長率・寄与度は NaN。
+    """
+    change, contribution, growth, totals = {}, {}, {}, {}
+    lagged = {}
+    for metric in ('営業収益', '営業利益'):
+        cur = np.nan_to_num(store.values[metric])
+        prev = np.full_like(cur, np.nan)
+        prev[m:] = cur[:-m]
+        total_prev, total_cur = prev.sum(axis=1), cur.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            base = np.where(total_prev != 0, total_prev, np.nan)[:, None]
+            contribution[metric] = (cur - prev) / base * 100
+            growth[metric] = (total_cur / base[:, 0] - 1) * 100
+        change[metric] = cur - prev
+        totals[metric] = np.column_stack([total_prev, total_cur])
+        lagged[metric] = (prev, cur)
+
+    (rev_prev, rev_cur), (prof_prev, prof_cur) = lagged['営業収益'], lagged['営業利益']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = lambda a, b: np.nan_to_num(np.where(b != 0, a / b, np.nan))
+        margin_prev, margin_cur = ratio(prof_prev, rev_prev), ratio(prof_cur, rev_cur)  # エンティティ別利益率
+        share_prev = ratio(rev_prev, rev_prev.sum(axis=1, keepdims=True))
+        share_cur = ratio(rev_cur, rev_cur.sum(axis=1, keepdims=True))
+    rev_total_prev, rev_total_cur = totals['営業収益'].T
+    volume = (rev_total_cur - rev_total_prev) * (share_prev * margin_prev).sum(axis=1)
+    mix = rev_total_cur * ((share_cur - share_prev) * margin_prev).sum(axis=1)
+    rate = rev_total_cur * (share_cur * (margin_cur - margin_prev)).sum(axis=1)
+    prof_total_prev, prof_total_cur = totals['営業利益'].T
+    other = (prof_total_cur - prof_total_prev) - (volume + mix + rate)
+    effects = np.column_stack([volume, mix, rate, other])
+    effects[np.isnan(rev_total_prev)] = np.nan
+
+    return GrowthContribution(
+        quarters=list(store.quarters), entities=list(store.entities),
+        change=change, contribution=contribution, growth=growth, totals=totals, effects=effects,
+    )
+
+
+# --- 12. 異常値検出（季節調整後の残差とロバスト z スコア） ---
+ANOMALY_METRICS = ['営業収益', '営業利益', '営業収益営業利益率']
+ANOMALY_THRESHOLD = 3.5  # ロバスト z スコアの閾値（Iglewicz & Hoaglin）
+MAD_SCALE = 0.6745       # 正規分布で MAD を標準偏差に換算する係数
+
+def seasonal_decompose(values, labels, m=SEASON_LENGTH):
+    """四半期 × 系列の行列を傾向・季節・残差に一括で分解（古典的分解、加法型）
+
+    傾向は中心化移動平均（m が偶数なら 2×m、奇数なら m 項）。窓が揃わない両端と欠損を含む窓は NaN のまま残し、
+    季節成分は傾向のある期の偏差のみを四半期区分ごとに平均する（合計0）。labels は各行の四半期区分（Q1〜Q4）。
+    """
+    frame = pd.DataFrame(values)
+    if m % 2:
+        trend = frame.rolling(m, center=True).mean()
+    else:
+        trend = frame.rolling(m, center=True).mean().rolling(2).mean().shift(-1)
+    trend = trend.to_numpy()
+    detrended = values - trend
+    seasonal_means = pd.DataFrame(detrended).groupby(np.asarray(labels)).mean()
+    seasonal_means -= seasonal_means.mean()
+    seasonal = seasonal_means.reindex(labels).to_numpy()
+    return trend, seasonal, detrended - seasonal
+
+def _line_fit(y):
+    """各列に直線を最小二乗で当てはめた値（欠損は除いて当てはめる。値が2つ未満の列は NaN）"""
+    x = np.arange(len(y), dtype=float)[:, None]
+    w = np.isfinite(y)
+    y0 = np.where(w, y, 0.0)
+    n, sx, sy = w.sum(axis=0), (w * x).sum(axis=0), y0.sum(axis=0)
+    sxx, sxy = (w * x * x).sum(axis=0), (x * y0).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * sxy - sx * sy) / (n * sxx - sx ** 2)
+        intercept = (sy - slope * sx) / n
+    return intercept + slope * x
+
+def extend_trend(trend, adjusted, m=SEASON_LENGTH):
+    """中心化移動平均で欠ける両端 m//2 期の傾向を補う（四半期 × 系列）
+
+    両端の傾向は、端から2年分の季節調整済みの値に当てはめた直線の値とする。
+    データが2年分に満たない場合・欠損による途中の空白は最も近い傾向の値で埋める。
+    """
+    trend = trend.copy()
+    half, window = m // 2, 2 * m
+    if half and len(trend) >= window:
+        trend[-half:] = _line_fit(adjusted[-window:])[-half:]
+        trend[:half] = _line_fit(adjusted[:window])[:half]
+    return pd.DataFrame(trend).ffill().bfill().to_numpy()
+
+def robust_zscore(values, axis=0, reference=None):
+    """中央値・MAD によるロバスト z スコア（MAD が 0 の系列は NaN）
+
+    reference を渡すと中央値・MAD はそちらから求め、values に適用する。
+    """
+    reference = values if reference is None else reference
+    median = np.nanmedian(reference, axis=axis, keepdims=True)
+    mad = np.nanmedian(np.abs(reference - median), axis=axis, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = MAD_SCALE * (values - median) / np.where(mad > 0, mad, np.nan)
+    return z
+
+@dataclass
+class AnomalyIndex:
+    """全エンティティ・全指標の異常フラグ（指標 × 四半期 × エンティティ）"""
+    quarters: list
+    entities: list
+    metrics: list
+    values: np.ndarray    # (指標数, 四半期数, エンティティ数) の元の値
+    residual: np.ndarray  # 季節調整後の残差
+    zscore: np.ndarray    # 残差のロバスト z スコア
+    threshold: float = ANOMALY_THRESHOLD
+
+    @property
+    def flags(self):
+        return np.abs(np.nan_to_num(self.zscore)) > self.threshold
+
+    def mask(self, metric):
+        """指標の異常フラグ（行: 四半期, 列: エンティティ）"""
+        return pd.DataFrame(self.flags[self.metrics.index(metric)], index=self.quarters, columns=self.entities)
+
+    def records(self, quarters=None, entity_col='地域'):
+        """フラグの一覧（四半期・エンティティ・指標ごとに1行、|z| の大きい順）"""
+        m, q, e = np.nonzero(self.flags)
+        table = pd.DataFrame({
+            '決算年度': np.array(self.quarters)[q], entity_col: np.array(self.entities)[e],
+            '指標': np.array(self.metrics)[m], '値': self.values[m, q, e],
+            '季節調整後の残差': self.residual[m, q, e], 'ロバストz': self.zscore[m, q, e],
+        })
+        table['方向'] = np.where(table['ロバストz'] > 0, '急上昇', '急低下')
+        if quarters is not None:
+            table = table[table['決算年度'].isin(quarters)]
+        return table.reindex(table['ロバストz'].abs().sort_values(ascending=False).index).reset_index(drop=True)
+
+def detect_anomalies(store, metrics=ANOMALY_METRICS, threshold=ANOMALY_THRESHOLD, m=SEASON_LENGTH):
+    """指標ストアの全エンティティ・全指標を1回で季節調整し、残差のロバスト z スコアで異常な四半期を検出
+
+    指標 × エンティティの全系列を (四半期数, 系列数) の1つの行列にまとめて分解する。
+    z スコアの中央値・MAD は系列ごとに傾向のある期の残差から求め、両端を含む全期間の残差に適用する。
+    """
+    decomposition = decompose_store(store, metrics, m)
+    # 傾向のない両端の四半期は延長した傾向で残差を求め、最新四半期も判定できるようにする（季節成分の推定には使わない）
+    n_metrics, n_quarters, n_entities = decomposition.values.shape
+    flatten = lambda a: a.transpose(1, 0, 2).reshape(n_quarters, n_metrics * n_entities)
+    trend = extend_trend(flatten(decomposition.trend), flatten(decomposition.adjusted), m)
+    trend = trend.reshape(n_quarters, n_metrics, n_entities).transpose(1, 0, 2)
+    residual = decomposition.values - trend - decomposition.seasonal
+    return AnomalyIndex(
+        quarters=decomposition.quarters, entities=decomposition.entities, metrics=decomposition.metrics,
+        values=decomposition.values, residual=residual,
+        zscore=robust_zscore(residual, axis=1, reference=decomposition.residual), threshold=threshold,
+    )
+
+
+# --- 13. 季節調整（全エンティティ一括の傾向・季節・残差分解） ---
+DECOMPOSE_METRICS = ['営業収益', '営業利益']
+DECOMPOSE_COMPONENTS = {'trend': '傾向', 'seasonal': '季節', 'residual': '残差', 'adjusted': '季節調整済み'}
+
+@dataclass
+class SeasonalDecomposition:
+    """全エンティティ・全指標の加法分解（値 = 傾向 + 季節 + 残差。配列は指標 × 四半期 × エンティティ）"""
+    quarters: list
+    entities: list
+    metrics: list
+    values: np.ndarray
+    trend: np.ndarray
+    seasonal: np.ndarray
+
+    @property
+    def residual(self):
+        return self.values - self.trend - self.seasonal
+
+    @property
+    def adjusted(self):
+        """季節調整済み系列（値 − 季節成分）"""
+        return self.values - self.seasonal
+
+    def frame(self, metric, component='adjusted'):
+        """成分を DataFrame（行: 四半期, 列: エンティティ）として取得"""
+        return pd.DataFrame(getattr(self, component)[self.metrics.index(metric)],
+                            index=self.quarters, columns=self.entities)
+
+    def seasonal_factors(self, metric):
+        """四半期区分ごとの季節成分（行: Q1〜Q4, 列: エンティティ）。分解で各区分に一定の値を割り当てている"""
+        labels = [f"Q{sort_quarter_key(q) % 10}" for q in self.quarters]
+        return self.frame(metric, 'seasonal').groupby(labels).first()
+
+    def adjusted_margin(self):
+        """季節調整済みの営業利益 ÷ 営業収益（%）
+
+        季節成分が営業収益の半分を超える期（規模が小さく調整が不安定な系列）と、調整後の営業収益が0以下の期は NaN。
+        """
+        revenue = self.frame('営業収益')
+        stable = self.frame('営業収益', 'seasonal').abs() < self.frame('営業収益', 'values').abs() * 0.5
+        with np.errstate(divide='ignore', invalid='ignore'):
+            margin = self.frame('営業利益') / revenue * 100
+        return margin.where(np.isfinite(margin) & (revenue > 0) & stable)
+
+def decompose_store(store, metrics=DECOMPOSE_METRICS, m=SEASON_LENGTH):
+    """指標ストアの全エンティティ・全指標を1回で傾向・季節・残差に分解
+
+    指標 × エンティティの全系列を (四半期数, 系列数) の1つの行列にまとめて seasonal_decompose に渡す。
+    """
+    metrics = [metric for metric in metrics if metric in store.values]
+    stacked = np.stack([store.values[metric] for metric in metrics])  # (指標, 四半期, エンティティ)
+    n_metrics, n_quarters, n_entities = stacked.shape
+    flat = stacked.transpose(1, 0, 2).reshape(n_quarters, n_metrics * n_entities)
+    trend, seasonal, _ = seasonal_decompose(flat, store.quarter_labels, m)
+    unflatten = lambda a: a.reshape(n_quarters, n_metrics, n_entities).transpose(1, 0, 2)
+    return SeasonalDecomposition(
+        quarters=list(store.quarters), entities=list(store.entities), metrics=metrics,
+        values=stacked, trend=unflatten(trend), seasonal=unflatten(seasonal),
+    )
+
+
+# --- 14. 累計・半期（四半期の累積和インデックス） ---
+PERIOD_BASES = {'quarter': '単独', 'ytd': '累計', 'half': '半期'}
+HALF_ENDS = {2: '上期', 4: '下期'}  # 半期の最終四半期 → 名称
+
+@dataclass
+class CumulativeIndex:
+    """金額指標の四半期方向の累積和（prefix[t] は先頭から t 四半期分の合計、prefix[0] は0）
+
+    連続する四半期の合計は prefix の差1回で求まる。欠損は0として足し込み、
+    区間内の値のある四半期数（counts の差）が区間長に満たないエンティティは NaN とする。
+    """
+    quarters: list
+    entities: list
+    metrics: list
+    prefix: np.ndarray    # (指標数, 四半期数+1, エンティティ数)
+    counts: np.ndarray    # (指標数, 四半期数+1, エンティティ数) 値のある四半期数の累積
+    fy_start: np.ndarray  # 各四半期が属する決算年度の先頭行（同じ決算年度の四半期が連続していない場合はその行）
+
+    def range_sum(self, metric, start, stop):
+        """行 start〜stop-1 の合計（エンティティごと）。欠損を含むエンティティは NaN
+
+        start・stop は整数または同じ長さの配列（配列なら区間ごとに1行の (区間数, エンティティ数) を返す）。
+        """
+        i = self.metrics.index(metric)
+        total = self.prefix[i, stop] - self.prefix[i, start]
+        complete = self.counts[i, stop] - self.counts[i, start] == np.asarray(stop - start)[..., None]
+        return np.where(complete, total, np.nan)
+
+    @functools.cached_property
+    def positions(self):
+        """四半期ラベル → 行（区間の端の参照を定数時間で行う）"""
+        return {q: i for i, q in enumerate(self.quarters)}
+
+    def period_sum(self, metric, first, last):
+        """四半期 first〜last（両端を含む）の合計（エンティティごと）"""
+        return self.range_sum(metric, self.positions[first], self.positions[last] + 1)
+
+    def _quarter_numbers(self):
+        return np.array([sort_quarter_key(q) % 10 for q in self.quarters])
+
+    def ytd(self, metric):
+        """決算年度の1Qからの累計（行: 四半期, 列: エンティティ）。年度の途中から始まる行は NaN"""
+        rows = np.arange(len(self.quarters))
+        values = self.range_sum(metric, self.fy_start, rows + 1)
+        whole = rows - self.fy_start + 1 == self._quarter_numbers()  # 1Q から欠けずに並んでいる
+        return pd.DataFrame(np.where(whole[:, None], values, np.nan), index=self.quarters, columns=self.entities)
+
+    def halves(self, metric, quarters=None):
+        """上期（1Q〜2Q）・下期（3Q〜4Q）の合計（行: 半期, 列: エンティティ）
+
+        quarters を指定した場合は、最終四半期がその中にある半期のみ。2四半期が揃わない半期は含めない。
+        """
+        numbers = self._quarter_numbers()
+        rows = [t for t, n in enumerate(numbers)
+                if n in HALF_ENDS and t >= 1 and numbers[t - 1] == n - 1 and t - 1 >= self.fy_start[t]
+                and (quarters is None or self.quarters[t] in quarters)]
+        ends = np.array(rows, dtype=int)
+        values = self.range_sum(metric, ends - 1, ends + 1)
+        labels = [f"{self.quarters[t].split('-')[0]} {HALF_ENDS[numbers[t]]}" for t in rows]
+        return pd.DataFrame(values, index=labels, columns=self.entities)
+
+def build_cumulative_index(store, metrics=AMOUNT_COLS):
+    """指標ストアの金額指標から累積和インデックスを構築（全期間・全エンティティを1回の cumsum で）"""
+    metrics = [metric for metric in metrics if metric in store.values]
+    stacked = np.stack([store.values[metric] for metric in metrics])  # (指標, 四半期, エンティティ)
+    zero = np.zeros((len(metrics), 1, stacked.shape[2]))
+    prefix = np.concatenate([zero, np.nancumsum(stacked, axis=1)], axis=1)
+    counts = np.concatenate([zero, np.cumsum(~np.isnan(stacked), axis=1)], axis=1)
+    years = store.fiscal_years
+    starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    fy_start = starts[np.searchsorted(starts, np.arange(len(years)), side='right') - 1]
+    return CumulativeIndex(quarters=list(store.quarters), entities=list(store.entities), metrics=metrics,
+                           prefix=prefix, counts=counts, fy_start=fy_start)
+
+
+# --- 15. 派生指標（式による定義） ---
+METRIC_ALIASES = {'営業利益率': '営業収益営業利益率'}  # 式中で使える短い名前 → ストアの指標名
+DERIVED_FORMAT = "{:,.1f}"
+
+class ExpressionError(ValueError):
+    """派生指標の式の誤り（画面にメッセージを表示する）"""
+
+def _lag(x, n=1):
+    n = int(n)
+    out = np.full_like(x, np.nan)
+    if 0 < n < len(x):
+        out[n:] = x[:-n]
+    return out
+
+def _total(x):
+    """行（四半期）ごとの全エンティティ合計を各列に複製"""
+    total = np.nansum(x, axis=1, keepdims=True)
+    total[np.isnan(x).all(axis=1)] = np.nan
+    return np.broadcast_to(total, x.shape)
+
+# 式で使える関数（引数・戻り値は (四半期数, エンティティ数) の配列。第2引数以降は定数）
+DERIVED_FUNCTIONS = {
+    'lag': _lag,                                            # n 四半期前の値
+    'diff': lambda x, n=1: x - _lag(x, n),                  # n 四半期前との差
+    'qoq': lambda x: (x / _lag(x, 1) - 1) * 100,            # 前四半期比（%）
+    'yoy': lambda x: yoy_growth(x),                         # 前年同期比（%）
+    'total': _total,                                        # 全エンティティ合計
+    'share': lambda x: x / _total(x) * 100,                 # 全エンティティ合計に占める割合（%）
+    'abs': np.abs,
+}
+_BINARY_OPS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide, ast.Pow: np.power}
+_UNARY_OPS = {ast.USub: np.negative, ast.UAdd: np.positive}
+
+@dataclass
+class DerivedMetric:
+    """data/metrics.json に定義した派生指標"""
+    name: str
+    expression: str
+    unit: str = ''
+    format: str = DERIVED_FORMAT
+
+def load_derived_metrics(path):
+    """派生指標の定義を読み込む（ファイルがなければ空）"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        spec = json.load(f)
+    return [DerivedMetric(**m) for m in spec.get('metrics', [])]
+
+# data/metrics.json がない場合の既定の派生指標
+DEFAULT_DERIVED = DerivedMetric("利益構成比 − 収益構成比", "営業利益構成比 - 営業収益構成比", "pt", "{:+.1f}")
+
+@functools.lru_cache(maxsize=256)
+def compile_expression(expression):
+    """式を構文解析し、指標名 → 配列 の辞書を受け取ってベクトル演算で評価する関数に変換（式ごとにキャッシュ）
+
+    使えるのは指標名（METRIC_ALIASES の別名を含む）・数値・四則演算と累乗・DERIVED_FUNCTIONS の関数のみ。
+    返り値: (評価関数, 参照する指標名のタプル)
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ExpressionError(f"式を解釈できません: {e.msg}") from None
+    names = []
+
+    def build(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            value = float(node.value)
+            return lambda env: value
+        if isinstance(node, ast.Name):
+            name = METRIC_ALIASES.get(node.id, node.id)
+            names.append(name)
+            return lambda env: env[name]
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+            op, left, right = _BINARY_OPS[type(node.op)], build(node.left), build(node.right)
+            return lambda env: op(left(env), right(env))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+            op, operand = _UNARY_OPS[type(node.op)], build(node.operand)
+            return lambda env: op(operand(env))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            func = DERIVED_FUNCTIONS.get(node.func.id)
+            if func is None:
+                raise ExpressionError(f"関数 {node.func.id} は使えません（使える関数: {', '.join(DERIVED_FUNCTIONS)}）")
+            if not node.args:
+                raise ExpressionError(f"関数 {node.func.id} に引数がありません")
+            first = build(node.args[0])
+            rest = []
+            for arg in node.args[1:]:
+                if not (isinstance(arg, ast.Constant) and isinstance(arg.value, (int, float))):
+                    raise ExpressionError(f"関数 {node.func.id} の第2引数以降は数値で指定してください")
+                rest.append(arg.value)
+            return lambda env: func(first(env), *rest)
+        raise ExpressionError(f"式に使えない要素があります: {ast.get_source_segment(expression.strip(), node) or type(node).__name__}")
+
+    evaluate = build(tree.body)
+    return evaluate, tuple(dict.fromkeys(names))
+
+def evaluate_expression(store, expression):
+    """派生指標を指標ストアの全四半期 × 全エンティティについて評価（行: 四半期, 列: エンティティ）
+
+    0除算・定義域外の値は NaN。ストアにない指標を参照した場合は ExpressionError。
+    """
+    evaluate, names = compile_expression(expression)
+    missing = [name for name in names if name not in store.values]
+    if missing:
+        raise ExpressionError(f"指標 {', '.join(missing)} はありません（使える指標: "
+                              f"{', '.join(list(store.values) + list(METRIC_ALIASES))}）")
+    shape = (len(store.quarters), len(store.entities))
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        values = np.broadcast_to(np.asarray(evaluate(store.values), dtype=float), shape).copy()
+    values[~np.isfinite(values)] = np.nan
+    return pd.DataFrame(values, index=store.quarters, columns=store.entities)
+
+
+# --- 16. 任意の期間同士の比較（累積和インデックスの参照のみ） ---
+TOTAL_LABEL = '合計'
+COMPARE_SPAN = 4  # 期間比較の既定の区間の長さ（四半期）
+
+def default_comparison(quarters):
+    """期間比較の既定の区間: 直近4四半期（比較）とその前の4四半期（基準）"""
+    base, target = quarters[-2 * COMPARE_SPAN:-COMPARE_SPAN] or quarters[:1], quarters[-COMPARE_SPAN:]
+    return (base[0], base[-1], target[0], target[-1])
+
+@dataclass
+class PeriodComparison:
+    """2つの四半期区間の比較（行: エンティティ＋合計）
+
+    金額は区間の合計。CAGR は1四半期あたりの平均額で比べ、区間の中央どうしの間隔（年）で年率換算する。
+    """
+    base: tuple    # 基準期間 (最初の四半期, 最後の四半期)
+    target: tuple  # 比較期間
+    table: pd.DataFrame
+
+    @staticmethod
+    def label(period):
+        first, last = period
+        return first if first == last else f"{first}〜{last}"
+
+    @property
+    def base_label(self):
+        return self.label(self.base)
+
+    @property
+    def target_label(self):
+        return self.label(self.target)
+
+def compare_periods(cumulative, base, target):
+    """累積和インデックスから2つの区間（各 (最初の四半期, 最後の四半期)）の合計・利益率・構成比・CAGR を比較
+
+    区間の合計は累積和の差1回で求まるため、計算量は期間の長さ・履歴の長さによらずエンティティ数に比例する。
+    区間内に欠損のあるエンティティは NaN。合計行は値のあるエンティティの和。
+    """
+    def sums(period):
+        revenue, profit = (cumulative.period_sum(metric, *period) for metric in AMOUNT_COLS)
+        return np.append(revenue, np.nansum(revenue)), np.append(profit, np.nansum(profit))
+
+    def length(period):
+        return cumulative.positions[period[1]] - cumulative.positions[period[0]] + 1
+
+    def midpoint(period):
+        return (cumulative.positions[period[0]] + cumulative.positions[period[1]]) / 2
+
+    (rev_b, prof_b), (rev_t, prof_t) = sums(base), sums(target)
+    years = (midpoint(target) - midpoint(base)) / SEASON_LENGTH
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margin_b, margin_t = prof_b / rev_b * 100, prof_t / rev_t * 100
+        share_b, share_t = rev_b / rev_b[-1] * 100, rev_t / rev_t[-1] * 100
+        ratio = (rev_t / length(target)) / (rev_b / length(base))
+        cagr = np.where((ratio > 0) & (years > 0), (ratio ** (1 / years) - 1) * 100, np.nan) if years else np.nan
+        table = pd.DataFrame({
+            '営業収益（基準）': rev_b, '営業収益（比較）': rev_t, '営業収益 増減': rev_t - rev_b,
+            '営業収益 増減率': (rev_t / rev_b - 1) * 100,
+            '営業利益（基準）': prof_b, '営業利益（比較）': prof_t, '営業利益 増減': prof_t - prof_b,
+            '営業利益率（基準）': margin_b, '営業利益率（比較）': margin_t, '営業利益率 差': margin_t - margin_b,
+            '営業収益構成比（基準）': share_b, '営業収益構成比（比較）': share_t, '営業収益構成比 差': share_t - share_b,
+            '営業収益 CAGR': cagr,
+        }, index=list(cumulative.entities) + [TOTAL_LABEL])
+    return PeriodComparison(base=tuple(base), target=tuple(target),
+                            table=table.where(np.isfinite(table.to_numpy(dtype=float))))
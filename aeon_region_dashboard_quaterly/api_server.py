@@ -0,0 +1,255 @@
+"""地域別業績指標のローカル HTTP API
+
+ダッシュボードと同じ指標（ピボット・前年同期比・構成比・季節性）を
+HTML を介さずに JSON / Arrow IPC で返す軽量サーバー。
+
+起動:
+    python api_server.py --port 8600
+
+エンドポイント:
+    GET /api/views
+        利用可能なビュー・四半期・地域とデータバージョン
+    GET /api/metrics?view=revenue&from=FY2024-1Q&to=FY2025-3Q&regions=日本,中国&format=json
+        view    : revenue / profit / margin / revenue_share / profit_share /
+                  revenue_yoy / profit_yoy / seasonal
+        metric  : view=seasonal の対象指標（revenue / profit / margin、既定 revenue）
+        format  : json（既定）/ arrow（Accept: application/vnd.apache.arrow.stream でも可）
+
+レスポンスには ETag を付与し、If-None-Match が一致すれば 304 を返す。HEAD は GET と同じヘッダーを本文なしで返す。
+想定外の例外はログに記録し、500 と JSON のエラー本文を返す。
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+import analytics
+from entities import EntityRegistry
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "region_data.xlsx")
+ENTITIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "entities.json")
+# ダッシュボードと共通の他社データ・スナップショットの置き場所（app.py と同じ）
+COMPANIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "companies")
+SNAPSHOTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "snapshots")
+DEFAULT_COMPANY = "イオン"
+ARROW_MIME = 'application/vnd.apache.arrow.stream'
+SEASONAL_METRICS = {'revenue': '営業収益', 'profit': '営業利益', 'margin': '営業収益営業利益率'}
+RESPONSE_CACHE_SIZE = 256
+
+logger = logging.getLogger(__name__)
+
+
+class BadRequest(ValueError):
+    """クエリパラメータの誤り（400 で返す）"""
+
+
+# --- 1. 事前計算ストア ---
+class MetricsRepository:
+    """データファイルのバージョンを監視し、全期間の指標ビューを事前計算して保持"""
+
+    def __init__(self, path=DATA_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._version = None
+        self._store = None
+        self._views = None
+        self._responses = OrderedDict()  # (ETag) → (本文, Content-Type)
+
+    def snapshot(self):
+        """最新バージョンのストアとビューを取得（ファイル更新時のみ再計算）
+
+        データはダッシュボードと同じスナップショットをメモリマップで開く（なければ解析して書き出す。削除はダッシュボードが行う）。
+        """
+        paths = analytics.company_paths(self.path, COMPANIES_DIR, DEFAULT_COMPANY)
+        if DEFAULT_COMPANY not in paths:
+            raise FileNotFoundError(self.path)
+        files_version = analytics.files_version(paths)
+        version = f"{files_version}|{analytics.file_version(ENTITIES_PATH)}"
+        with self._lock:
+            if version != self._version:
+                company_store = analytics.open_store_snapshot(
+                    os.path.join(SNAPSHOTS_DIR, analytics.snapshot_key(files_version)),
+                    lambda: analytics.build_store_from_files(paths, pd.read_excel))
+                df = company_store.company_data(DEFAULT_COMPANY)
+                # API は合算せず、全地域を登録簿の表示順で返す
+                weights = df.groupby('地域')['営業収益'].sum().to_dict()
+                entities = EntityRegistry.load(ENTITIES_PATH).order(df['地域'].unique(), weights)
+                self._store = analytics.build_metric_store(df, entities)
+                self._views = analytics.build_metric_views(self._store)
+                self._version = version
+                self._responses.clear()
+            return self._version, self._store, self._views
+
+    def cached_response(self, etag):
+        with self._lock:
+            if etag in self._responses:
+                self._responses.move_to_end(etag)
+                return self._responses[etag]
+        return None
+
+    def store_response(self, etag, response):
+        with self._lock:
+            self._responses[etag] = response
+            while len(self._responses) > RESPONSE_CACHE_SIZE:
+                self._responses.popitem(last=False)
+
+
+# --- 2. クエリ解釈とシリアライズ ---
+def parse_query(query, store, accept=''):
+    """クエリ文字列を正規化した (view, metric, 開始, 終了, 地域, 形式) に変換"""
+    params = {k: v[-1] for k, v in parse_qs(query).items()}
+    view = params.get('view', 'revenue')
+    if view not in analytics.METRIC_VIEWS and view not in analytics.YOY_VIEWS and view != 'seasonal':
+        raise BadRequest(f"unknown view: {view}")
+    metric = params.get('metric', 'revenue') if view == 'seasonal' else ''
+    if view == 'seasonal' and metric not in SEASONAL_METRICS:
+        raise BadRequest(f"unknown metric: {metric}")
+
+    start = params.get('from', store.quarters[0])
+    end = params.get('to', store.quarters[-1])
+    for q in (start, end):
+        if q not in store.quarters:
+            raise BadRequest(f"unknown quarter: {q}")
+    if store.quarters.index(start) > store.quarters.index(end):
+        raise BadRequest("'from' must not be after 'to'")
+
+    if params.get('regions'):
+        regions = [r.strip() for r in params['regions'].split(',') if r.strip()]
+        if not regions:
+            raise BadRequest("no regions specified")
+        unknown = [r for r in regions if r not in store.entities]
+        if unknown:
+            raise BadRequest(f"unknown regions: {','.join(unknown)}")
+    else:
+        regions = list(store.entities)
+
+    fmt = params.get('format') or ('arrow' if ARROW_MIME in accept else 'json')
+    if fmt not in ('json', 'arrow'):
+        raise BadRequest(f"unknown format: {fmt}")
+    return view, metric, start, end, tuple(regions), fmt
+
+def make_etag(version, key):
+    """データバージョンと正規化済みクエリから ETag を生成"""
+    digest = hashlib.sha1(f"{version}|{key!r}".encode('utf-8')).hexdigest()[:20]
+    return f'"{digest}"'
+
+def select_frame(store, views, view, metric, start, end, regions):
+    """事前計算済みビューから四半期範囲・地域を切り出す"""
+    rows = slice(store.quarters.index(start), store.quarters.index(end) + 1)
+    if view == 'seasonal':
+        frame = store.frame(SEASONAL_METRICS[metric]).iloc[rows]
+        return analytics.seasonal_stats(frame.loc[:, list(regions)])
+    frame = views[view].iloc[rows].loc[:, list(regions)]
+    frame.index.name = '決算年度'
+    return frame
+
+def to_json_bytes(frame, meta):
+    """DataFrame を split 形式の JSON に変換（NaN は null）"""
+    values = frame.astype(object).where(frame.notna(), None).to_numpy().tolist()
+    payload = dict(meta, index=list(frame.index), columns=list(frame.columns), data=values)
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+def to_arrow_bytes(frame):
+    """DataFrame を Arrow IPC ストリーム形式に変換"""
+    import pyarrow as pa
+    table = pa.Table.from_pandas(frame.reset_index(), preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# --- 3. HTTP ハンドラ ---
+class MetricsHandler(BaseHTTPRequestHandler):
+    repository = None  # serve() で設定
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            version, store, views = self.repository.snapshot()
+            if url.path == '/api/views':
+                body = json.dumps({
+                    'data_version': version,
+                    'views': list(views) + ['seasonal'],
+                    'quarters': store.quarters,
+                    'regions': store.entities,
+                }, ensure_ascii=False).encode('utf-8')
+                self._send(200, body, 'application/json; charset=utf-8', make_etag(version, 'views'))
+            elif url.path == '/api/metrics':
+                self._send_metrics(url.query, version, store, views)
+            else:
+                self._send_error(404, f"not found: {url.path}")
+        except BadRequest as e:
+            self._send_error(400, str(e))
+        except FileNotFoundError:
+            self._send_error(503, "data file not found")
+        except Exception:
+            logger.exception("request failed: %s %s", self.command, self.path)
+            self._send_error(500, "internal server error")
+
+    do_HEAD = do_GET  # 本文は _send で省く
+
+    def _send_metrics(self, query, version, store, views):
+        key = parse_query(query, store, self.headers.get('Accept', ''))
+        etag = make_etag(version, key)
+        if etag in [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]:
+            self._send(304, b'', None, etag)
+            return
+        response = self.repository.cached_response(etag)
+        if response is None:
+            view, metric, start, end, regions, fmt = key
+            frame = select_frame(store, views, view, metric, start, end, regions)
+            if fmt == 'arrow':
+                response = (to_arrow_bytes(frame), ARROW_MIME)
+            else:
+                meta = {'view': view, 'metric': metric or None, 'from': start, 'to': end, 'data_version': version}
+                response = (to_json_bytes(frame, meta), 'application/json; charset=utf-8')
+            self.repository.store_response(etag, response)
+        self._send(200, response[0], response[1], etag)
+
+    def _send(self, status, body, content_type, etag=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        body = json.dumps({'error': message}, ensure_ascii=False).encode('utf-8')
+        self._send(status, body, 'application/json; charset=utf-8')
+
+
+def serve(host='127.0.0.1', port=8600, path=DATA_PATH):
+    """API サーバーを起動（Ctrl+C で停止）"""
+    MetricsHandler.repository = MetricsRepository(path)
+    MetricsHandler.repository.snapshot()  # 起動時に事前計算しておく
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    print(f"metrics API: http://{host}:{port}/api/views")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="地域別業績指標のローカル HTTP API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--data', default=DATA_PATH, help="region_data.xlsx のパス")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    serve(args.host, args.port, args.data)
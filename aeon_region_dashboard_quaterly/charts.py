@@ -0,0 +1,1213 @@
+"""ダッシュボード各タブの図表生成（Streamlit 非依存）
+
+app.py の各タブと静的サイト生成（prerender.py）で共通に使う。
+各関数は表示条件（ViewContext）からチャート＋テーブルの ReportView を返す。
+"""
+import base64
+import hashlib
+import html
+import io
+import math
+import os
+import re
+import zipfile
+from dataclasses import dataclass, field
+
+import matplotlib
+import matplotlib.font_manager as fm
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
+from matplotlib.ticker import FuncFormatter
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+import analytics
+
+QUARTER_LABELS = ['Q1', 'Q2', 'Q3', 'Q4']
+
+
+# --- 1. 日本語フォント設定 (ローカル & Cloud 両対応) ---
+def setup_font():
+    """fontsフォルダからフォントを読み込み、日本語表示を有効化"""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    font_path = os.path.join(current_dir, "fonts", "ipaexg.ttf")
+    if os.path.exists(font_path):
+        fm.fontManager.addfont(font_path)
+        prop = fm.FontProperties(fname=font_path)
+        matplotlib.rcParams['font.family'] = prop.get_name()
+        return prop.get_name()
+    else:
+        # フォールバック: システムフォントを試行
+        matplotlib.rcParams['font.family'] = ['Meiryo', 'MS Gothic', 'Hiragino Sans', 'sans-serif']
+        return 'sans-serif'
+
+
+# --- 2. HTML レポート ---
+REPORT_CSS = """
+        body { font-family: 'Hiragino Sans', 'Meiryo', sans-serif; padding: 20px; background: #f5f5f5; }
+        .container { max-width: 1200px; margin: 0 auto; background: white; padding: 30px; border-radius: 10px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
+        table { border-collapse: collapse; width: 100%; margin-top: 20px; background: white; }
+        th, td { border: 1px solid #ddd; padding: 10px; text-align: right; }
+        th { background: linear-gradient(135deg, #1f77b4, #ff7f0e); color: white; text-align: center; }
+        tr:nth-child(even) { background-color: #f9f9f9; }
+        tr:hover { background-color: #f0f0f0; }
+        h2 { color: #2C3E50; border-left: 5px solid #1f77b4; padding-left: 15px; margin-top: 0; }
+        .timestamp { color: #888; font-size: 12px; text-align: right; margin-top: 20px; }
+"""
+
+def figure_to_png(fig, dpi=150):
+    """Figure を PNG バイト列に変換"""
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=dpi, bbox_inches='tight', facecolor='white')
+    data = buf.getvalue()
+    buf.close()
+    return data
+
+@dataclass(frozen=True)
+class RenderProfile:
+    """描画先ごとの画像形式・解像度・サイズ予算"""
+    dpi: int
+    budget: int    # 画像1枚あたりの目安（バイト）
+    vector: bool   # SVG を使ってよいか
+
+RENDER_PROFILES = {
+    'screen': RenderProfile(dpi=200, budget=600_000, vector=False),  # ダッシュボード表示（st.pyplot の既定 dpi）
+    'report': RenderProfile(dpi=150, budget=300_000, vector=True),   # HTMLレポート（base64 で埋め込み）
+    'bundle': RenderProfile(dpi=150, budget=400_000, vector=True),   # レポート一式（zip）
+    'site': RenderProfile(dpi=150, budget=300_000, vector=False),    # 静的サイト
+}
+MIN_DPI = 72
+VECTOR_MAX_ELEMENTS = 4000  # これを超える図（点・棒・セルの数）は SVG が重くなるため PNG にする
+
+def _element_count(fig):
+    """図に含まれる描画要素（折れ線の点・棒・散布点・ヒートマップのセル・文字）の数"""
+    count = 0
+    for ax in fig.axes:
+        count += sum(len(line.get_xdata()) for line in ax.lines) + len(ax.patches) + len(ax.texts)
+        for collection in ax.collections:
+            array = collection.get_array()
+            count += array.size if array is not None else len(collection.get_offsets())
+    return count
+
+def render_figure(fig, target='screen'):
+    """描画先に合わせて Figure を画像化。返り値: (バイト列, MIME タイプ)
+
+    SVG を使える描画先では要素数が少なく予算内なら SVG。PNG が予算を超える場合は
+    サイズが dpi の2乗に比例するとみて dpi を下げ、1回だけ描き直す。
+    """
+    profile = RENDER_PROFILES[target]
+    if profile.vector and _element_count(fig) <= VECTOR_MAX_ELEMENTS:
+        svg = figure_to_svg(fig)
+        if len(svg) <= profile.budget:
+            return svg, 'image/svg+xml'
+    png = figure_to_png(fig, profile.dpi)
+    if len(png) > profile.budget:
+        dpi = max(MIN_DPI, int(profile.dpi * math.sqrt(profile.budget / len(png)) * 0.9))
+        png = figure_to_png(fig, dpi)
+    return png, 'image/png'
+
+IMAGE_EXTENSIONS = {'image/png': 'png', 'image/svg+xml': 'svg'}
+
+def get_html_report(df, title, fig=None):
+    """HTMLダウンロード用データの生成（テーブル＋チャート）"""
+    chart_html = ""
+    if fig is not None:
+        image, mime = render_figure(fig, 'report')
+        img_base64 = base64.b64encode(image).decode('utf-8')
+        chart_html = f'<div style="text-align:center; margin: 20px 0;"><img src="data:{mime};base64,{img_base64}" style="max-width:100%;"/></div>'
+
+    return f"""
+    <html><head><meta charset='utf-8'>
+    <style>{REPORT_CSS}    </style></head>
+    <body>
+    <div class="container">
+        <h2>📊 {title}</h2>
+        {chart_html}
+        <h3>📋 詳細データ</h3>
+        {df.to_html(classes='data-table')}
+        <p class="timestamp">生成日時: {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
+    </div>
+    </body></html>
+    """
+
+def figure_to_svg(fig):
+    """Figure を SVG に変換（同じ図が同じバイト列になるよう日付・要素IDを固定）"""
+    buf = io.BytesIO()
+    with matplotlib.rc_context({'svg.hashsalt': 'report'}):
+        fig.savefig(buf, format='svg', bbox_inches='tight', facecolor='white', metadata={'Date': None})
+    return buf.getvalue()
+
+def write_report_bundle(views, out, title="レポート一式"):
+    """ReportView を1つの zip（共有CSS・重複排除した画像・複数セクションの index.html）として書き出す
+
+    out はシークできない書き込みストリーム（HTTP レスポンスなど）でもよい。views はジェネレーターでよく、
+    画像は1枚ずつ書き出して Figure を解放し、HTML はセクション単位で書き込むため、全体を文字列として組み立てない。
+    """
+    sections, images = [], set()
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('report.css', REPORT_CSS)
+        for view in views:
+            data, mime = render_figure(view.fig, 'bundle')
+            image = f"images/{hashlib.sha1(data).hexdigest()[:16]}.{IMAGE_EXTENSIONS[mime]}"
+            if image not in images:
+                zf.writestr(image, data)
+                images.add(image)
+            sections.append((view.title, image, view.tables))
+
+        with io.TextIOWrapper(zf.open('index.html', 'w'), encoding='utf-8') as f:
+            f.write(f"<html><head><meta charset='utf-8'><title>{html.escape(title)}</title>"
+                    "<link rel='stylesheet' href='report.css'></head><body><div class='container'>"
+                    f"<h2>📦 {html.escape(title)}</h2><ul>")
+            for i, (section_title, _, _) in enumerate(sections):
+                f.write(f"<li><a href='#s{i}'>{html.escape(section_title)}</a></li>")
+            f.write("</ul>")
+            for i, (section_title, image, tables) in enumerate(sections):
+                f.write(f"<h2 id='s{i}'>📊 {html.escape(section_title)}</h2>"
+                        f"<div style='text-align:center; margin: 20px 0;'><img src='{image}' style='max-width:100%;'/></div>")
+                for block in tables:
+                    f.write(f"<h3>📋 {html.escape(block.title)}</h3>")
+                    f.write(block.table.to_html(classes='data-table'))
+            f.write(f"<p class='timestamp'>生成日時: {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')}</p>"
+                    "</div></body></html>")
+
+EXCEL_INVALID_CHARS = re.compile(r'[\\/*?:\[\]]')
+EXCEL_SHEET_TITLE_MAX = 31
+
+def excel_number_format(fmt):
+    """TableBlock の書式（"{:,.0f}" など）を Excel の表示形式に変換。変換できない書式は 'General'"""
+    m = re.fullmatch(r'\{:(\+?)(,?)\.(\d+)f\}(%?)', fmt) if isinstance(fmt, str) else None
+    if m is None:
+        return 'General'
+    sign, comma, digits, percent = m.groups()
+    number = ('#,##0' if comma else '0') + ('.' + '0' * int(digits) if int(digits) else '')
+    suffix = '"%"' if percent else ''  # 値はパーセント単位の数値（100倍済み）
+    if sign:
+        return f'+{number}{suffix};-{number}{suffix};{number}{suffix}'
+    return number + suffix
+
+def _sheet_title(title, used):
+    """Excel のシート名（使えない文字を置換し31文字以内・重複なし）"""
+    base = EXCEL_INVALID_CHARS.sub('_', title)[:EXCEL_SHEET_TITLE_MAX]
+    name, i = base, 2
+    while name in used:
+        suffix = f"_{i}"
+        name, i = base[:EXCEL_SHEET_TITLE_MAX - len(suffix)] + suffix, i + 1
+    used.add(name)
+    return name
+
+def _excel_value(value):
+    """セルに書き込む値（NaN は空セル、numpy の数値は Python の数値）"""
+    if pd.isna(value):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+def write_pivot_workbook(views, out):
+    """ReportView のテーブルを1つの Excel ブック（ビューごとに1シート、数値は Excel の表示形式付き）として書き出す
+
+    書き込み専用モードで1行ずつ書き出すため、行数が増えてもメモリ使用量はほぼ一定。
+    views はジェネレーターでよく、Figure は使わずにすぐ解放する。out はファイルパスまたは書き込みストリーム。
+    """
+    wb = Workbook(write_only=True)
+    used = set()
+    bold = Font(bold=True)
+
+    def cell(ws, value, font=None, number_format=None):
+        c = WriteOnlyCell(ws, value=_excel_value(value))
+        if font is not None:
+            c.font = font
+        if number_format is not None:
+            c.number_format = number_format
+        return c
+
+    for view in views:
+        ws = wb.create_sheet(_sheet_title(view.title, used))
+        ws.column_dimensions['A'].width = 16
+        ws.append([cell(ws, view.title, Font(bold=True, size=14))])
+        for block in view.tables:
+            table = block.table
+            formats = [excel_number_format(block.fmt.get(c) if isinstance(block.fmt, dict) else block.fmt)
+                       for c in table.columns]
+            ws.append([])
+            ws.append([cell(ws, block.title, bold)])
+            ws.append([cell(ws, table.index.name or '', bold)] + [cell(ws, str(c), bold) for c in table.columns])
+            for label, row in zip(table.index, table.itertuples(index=False)):
+                ws.append([cell(ws, str(label), bold)]
+                          + [cell(ws, v, number_format=f) for v, f in zip(row, formats)])
+    wb.save(out)
+
+
+# --- 3. 表示条件と図表の入れ物 ---
+@dataclass
+class ViewContext:
+    """タブ描画に必要な表示条件"""
+    df_raw: pd.DataFrame
+    quarters: list   # 表示対象の四半期（ソート済み）
+    regions: list    # 表示順の地域
+    colors: dict     # 地域 → 色
+    anomalies: object = None  # analytics.AnomalyIndex（チャートに異常値のマーカーを重ねる。None は重ねない）
+    decomposition: object = None  # analytics.SeasonalDecomposition（季節調整済み系列を重ねる。None は重ねない）
+
+    @property
+    def df_filtered(self):
+        return self.df_raw[self.df_raw['決算年度'].isin(self.quarters)]
+
+    def color(self, region, default='#333'):
+        return self.colors.get(region, default)
+
+    def pivot(self, values, df=None, aggfunc='sum'):
+        """四半期 × 地域のピボット（表示範囲・表示順に整列）"""
+        df = self.df_filtered if df is None else df
+        return df.pivot_table(
+            index='決算年度', columns='地域', values=values, aggfunc=aggfunc
+        ).reindex(self.quarters).reindex(columns=self.regions)
+
+@dataclass
+class TableBlock:
+    """見出し付きテーブル"""
+    title: str
+    table: pd.DataFrame
+    fmt: object = "{:,.0f}"
+    style: str = None  # 'bar'（横棒）/ 'diverging'（相関用グラデーション）
+    mask: pd.DataFrame = None  # True のセルを強調表示（table と同じ形）
+
+    def styler(self):
+        """書式・スタイルを適用した Styler"""
+        styler = self.table.style.format(self.fmt)
+        if self.style == 'bar':
+            styler = styler.bar(subset=self.table.columns, color='skyblue', vmin=0)
+        elif self.style == 'diverging':
+            styler = styler.background_gradient(cmap='RdBu_r', vmin=-1, vmax=1)
+        if self.mask is not None:
+            styler = styler.apply(lambda _: np.where(self.mask, 'background-color: #ffe08a', ''), axis=None)
+        return styler
+
+@dataclass
+class ReportView:
+    """チャート＋テーブルの表示単位（HTMLレポートの単位でもある）"""
+    key: str                # ダウンロードボタンのキー
+    title: str              # レポートタイトル
+    fig: object             # matplotlib Figure
+    tables: list = field(default_factory=list)  # TableBlock（先頭がレポート本体の表）
+    filename: str = None    # ダウンロードファイル名（None はダウンロードなし）
+
+    @property
+    def table(self):
+        return self.tables[0].table
+
+    def html_report(self):
+        return get_html_report(self.table, self.title, self.fig)
+
+@dataclass
+class RenderedView:
+    """描画済みの ReportView（画像・HTML を保持し、キャッシュに載せられる）"""
+    key: str
+    title: str
+    png: bytes
+    tables: list = field(default_factory=list)
+    filename: str = None
+    html: str = None
+
+def render_report_view(view, target='screen'):
+    """ReportView を画面表示用の PNG・HTML に描画（Figure は保持しない）"""
+    rendered = RenderedView(view.key, view.title, render_figure(view.fig, target)[0], view.tables,
+                            view.filename, view.html_report() if view.filename else None)
+    return rendered
+
+def _subplots(nrows=1, ncols=1, figsize=None, **kwargs):
+    """plt.subplots 相当。pyplot の状態を使わないため、バックグラウンドのスレッドからも描画できる"""
+    fig = Figure(figsize=figsize)
+    return fig, fig.subplots(nrows, ncols, **kwargs)
+
+def _thousands(ax):
+    ax.yaxis.set_major_formatter(FuncFormatter(lambda x, p: format(int(x), ',')))
+
+MAX_TICK_LABELS = 16    # x 軸に表示する四半期ラベルの上限
+LINE_POINT_BUDGET = 48  # これを超える折れ線は形状を保って間引き、マーカーを省く
+
+def _quarter_axis(ax, quarters, rotation=45, **kwargs):
+    """x 軸（位置 0〜n-1）に四半期ラベルを設定。多い場合は同じ四半期区分が並ぶよう4の倍数おきに間引く"""
+    step = math.ceil(len(quarters) / MAX_TICK_LABELS)
+    if step > 2:
+        step = math.ceil(step / 4) * 4
+    positions = np.arange(len(quarters))[::max(step, 1)]
+    ax.set_xticks(positions)
+    ax.set_xticklabels([quarters[i] for i in positions], rotation=rotation, **kwargs)
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets で折れ線を n_out 点に間引く（山・谷の形を保つ）。返り値: 残す点の添字"""
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)  # 先頭・末尾を除いた n_out-2 個のバケット
+    keep = [0]
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # 次のバケットの平均点（最後のバケットは末尾の点）
+        nxt = slice(edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else slice(n - 1, n)
+        ax_, ay_ = x[keep[-1]], y[keep[-1]]
+        bx, by = x[nxt].mean(), y[nxt].mean()
+        area = np.abs((ax_ - bx) * (y[lo:hi] - ay_) - (ax_ - x[lo:hi]) * (by - ay_))
+        keep.append(lo + int(np.argmax(area)))
+    keep.append(n - 1)
+    return np.array(keep)
+
+def _plot_line(ax, x, y, **kwargs):
+    """折れ線を描画。点数が LINE_POINT_BUDGET を超える場合は LTTB で間引き、マーカーを省く"""
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    valid = ~np.isnan(y)
+    if valid.sum() > LINE_POINT_BUDGET:
+        x, y = x[valid], y[valid]
+        keep = lttb(x, y, LINE_POINT_BUDGET)
+        x, y = x[keep], y[keep]
+        kwargs.pop('marker', None)
+    return ax.plot(x, y, **kwargs)
+
+def _mark_anomalies(ax, ctx, metric, frame):
+    """異常フラグの立った四半期にマーカーを重ねる（frame は描画した値。行: 四半期（x 位置 0〜n-1）, 列: 地域）"""
+    if ctx.anomalies is None or metric not in ctx.anomalies.metrics:
+        return
+    mask = ctx.anomalies.mask(metric).reindex(index=frame.index, columns=frame.columns, fill_value=False)
+    quarters, regions = np.nonzero(mask.to_numpy())
+    if len(quarters) == 0:
+        return
+    ax.scatter(quarters, frame.to_numpy()[quarters, regions], s=160, facecolors='none',
+               edgecolors='red', linewidths=2, zorder=5, label='異常値（季節調整後）')
+
+def _adjusted(ctx, metric):
+    """季節調整済み系列（行: 表示範囲の四半期, 列: 表示順の地域）。分解がなければ None"""
+    decomposition = ctx.decomposition
+    if decomposition is None or (metric != '営業収益営業利益率' and metric not in decomposition.metrics):
+        return None
+    frame = decomposition.adjusted_margin() if metric == '営業収益営業利益率' else decomposition.frame(metric)
+    return frame.reindex(index=ctx.quarters, columns=ctx.regions)
+
+def _plot_adjusted_total(ax, ctx, metric):
+    """積み上げ棒グラフに表示中の地域合計の季節調整済み系列を破線で重ねる。重ねた表（行: 地域＋合計）を返す"""
+    adjusted = _adjusted(ctx, metric)
+    if adjusted is None:
+        return None
+    total = adjusted.sum(axis=1, min_count=1)
+    _plot_line(ax, np.arange(len(total)), total, color='black', linestyle='--', linewidth=2,
+               marker='o', markersize=3, label='合計（季節調整済み）', zorder=4)
+    return adjusted.assign(合計=total).T
+
+
+# --- 4. タブ別の図表 ---
+def overview_views(ctx):
+    """全体概要: 営業収益・営業利益の積み上げ棒グラフ"""
+    pivot_revenue = ctx.pivot('営業収益')
+
+    fig1, ax1 = _subplots(figsize=(14, 6))
+    pivot_revenue.plot(kind='bar', stacked=True, ax=ax1,
+                      color=[ctx.color(r) for r in pivot_revenue.columns])
+    ax1.set_title('地域別営業収益の推移（四半期・積み上げ）', fontsize=14, fontweight='bold')
+    ax1.set_xlabel('決算四半期')
+    ax1.set_ylabel('営業収益（百万円）')
+    adjusted_revenue = _plot_adjusted_total(ax1, ctx, '営業収益')
+    ax1.legend(title='地域', bbox_to_anchor=(1.02, 1), loc='upper left')
+    _quarter_axis(ax1, ctx.quarters)
+    _thousands(ax1)
+    fig1.tight_layout()
+
+    pivot_profit = ctx.pivot('営業利益')
+
+    fig2, ax2 = _subplots(figsize=(14, 6))
+    pivot_profit.plot(kind='bar', stacked=True, ax=ax2,
+                     color=[ctx.color(r) for r in pivot_profit.columns])
+    ax2.set_title('地域別営業利益の推移（四半期・積み上げ）', fontsize=14, fontweight='bold')
+    ax2.set_xlabel('決算四半期')
+    ax2.set_ylabel('営業利益（百万円）')
+    ax2.axhline(y=0, color='black', linewidth=0.5)
+    adjusted_profit = _plot_adjusted_total(ax2, ctx, '営業利益')
+    ax2.legend(title='地域', bbox_to_anchor=(1.02, 1), loc='upper left')
+    _quarter_axis(ax2, ctx.quarters)
+    _thousands(ax2)
+    fig2.tight_layout()
+
+    revenue_tables = [TableBlock("営業収益一覧（百万円）", pivot_revenue.T)]
+    profit_tables = [TableBlock("営業利益一覧（百万円）", pivot_profit.T)]
+    if adjusted_revenue is not None:
+        revenue_tables.append(TableBlock("季節調整済み営業収益（百万円）", adjusted_revenue))
+    if adjusted_profit is not None:
+        profit_tables.append(TableBlock("季節調整済み営業利益（百万円）", adjusted_profit))
+    return [
+        ReportView("rev_html", "地域別営業収益の推移（四半期）", fig1, revenue_tables,
+                   "地域別営業収益レポート_四半期.html"),
+        ReportView("profit_html", "地域別営業利益の推移（四半期）", fig2, profit_tables,
+                   "地域別営業利益レポート_四半期.html"),
+    ]
+
+def _period_frame(ctx, cumulative, basis, metric):
+    """累計・半期の値（行: 期間, 列: 表示順の地域）。累計の行ラベルは「FY2025 2Q累計」の形"""
+    if basis == 'ytd':
+        frame = cumulative.ytd(metric).reindex(index=ctx.quarters, columns=ctx.regions)
+        frame.index = [f"{q.split('-')[0]} {q.split('-')[1]}累計" for q in frame.index]
+        return frame
+    return cumulative.halves(metric, ctx.quarters).reindex(columns=ctx.regions)
+
+def period_views(ctx, cumulative, basis):
+    """全体概要（累計・半期）: 累積和インデックスから求めた営業収益・営業利益の積み上げ棒グラフ"""
+    unit = analytics.PERIOD_BASES[basis]
+    revenue = _period_frame(ctx, cumulative, basis, '営業収益')
+    profit = _period_frame(ctx, cumulative, basis, '営業利益')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margin = profit / revenue * 100
+        share = revenue.div(revenue.sum(axis=1, min_count=1), axis=0) * 100
+    margin, share = margin.where(np.isfinite(margin)), share.where(np.isfinite(share))
+
+    figs = []
+    for frame, metric in ((revenue, '営業収益'), (profit, '営業利益')):
+        fig, ax = _subplots(figsize=(14, 6))
+        frame.plot(kind='bar', stacked=True, ax=ax, color=[ctx.color(r) for r in frame.columns])
+        ax.set_title(f'地域別{metric}の推移（{unit}・積み上げ）', fontsize=14, fontweight='bold')
+        ax.set_xlabel('決算期間')
+        ax.set_ylabel(f'{metric}（百万円）')
+        ax.axhline(y=0, color='black', linewidth=0.5)
+        ax.legend(title='地域', bbox_to_anchor=(1.02, 1), loc='upper left')
+        _quarter_axis(ax, list(frame.index))
+        _thousands(ax)
+        fig.tight_layout()
+        figs.append(fig)
+
+    return [
+        ReportView(f"rev_{basis}_html", f"地域別営業収益の推移（{unit}）", figs[0],
+                   [TableBlock(f"営業収益一覧（{unit}・百万円）", revenue.T),
+                    TableBlock(f"営業収益構成比（{unit}・%）", share.T, "{:.1f}")],
+                   f"地域別営業収益レポート_{unit}.html"),
+        ReportView(f"profit_{basis}_html", f"地域別営業利益の推移（{unit}）", figs[1],
+                   [TableBlock(f"営業利益一覧（{unit}・百万円）", profit.T),
+                    TableBlock(f"営業利益率（{unit}・%）", margin.T, "{:.1f}")],
+                   f"地域別営業利益レポート_{unit}.html"),
+    ]
+
+def anomaly_view(ctx):
+    """異常値: 地域 × 四半期のロバスト z スコア（指標の最大）のヒートマップと、表示範囲の検出一覧"""
+    anomalies = ctx.anomalies
+    quarters = [q for q in ctx.quarters if q in anomalies.quarters]
+    rows = [anomalies.quarters.index(q) for q in quarters]
+    cols = [anomalies.entities.index(r) for r in ctx.regions if r in anomalies.entities]
+    strength = np.fmax.reduce(np.abs(anomalies.zscore[:, rows][:, :, cols]), axis=0)  # 欠損を無視した指標の最大
+    heat = pd.DataFrame(strength, index=quarters, columns=[anomalies.entities[c] for c in cols]).T
+
+    # フラグの立ったセルに指標の略号と方向を表示（例: 率↓）
+    short = {'営業収益': '収', '営業利益': '利', '営業収益営業利益率': '率'}
+    flags = anomalies.flags[:, rows][:, :, cols]
+    signs = np.sign(anomalies.zscore[:, rows][:, :, cols])
+    labels = np.full(heat.shape, '', dtype=object)
+    for m, q, e in zip(*np.nonzero(flags)):
+        labels[e, q] += short.get(anomalies.metrics[m], anomalies.metrics[m][0]) + ('↑' if signs[m, q, e] > 0 else '↓')
+
+    fig, ax = _subplots(figsize=(14, max(3, 0.6 * len(heat) + 2)))
+    sns.heatmap(heat, cmap='Reds', vmin=0, vmax=anomalies.threshold * 2, annot=labels, fmt='', linewidths=0.5,
+                ax=ax, cbar_kws={'label': '|ロバストz|（指標の最大）'})
+    ax.set_title(f'異常値の検出（季節調整後の残差、|z| > {anomalies.threshold}）', fontsize=14, fontweight='bold')
+    ax.set_xlabel('決算四半期')
+    ax.set_ylabel('地域')
+    ax.tick_params(axis='x', rotation=45)
+    fig.tight_layout()
+
+    records = anomalies.records(quarters)
+    records = records[records['地域'].isin(ctx.regions)].set_index('決算年度')
+    return ReportView("anomaly_html", "異常値の検出（四半期）", fig,
+                      [TableBlock("検出された異常値一覧（|z| の大きい順）", records,
+                                  {'値': "{:,.1f}", '季節調整後の残差': "{:+,.1f}", 'ロバストz': "{:+.2f}"})],
+                      "異常値レポート_四半期.html")
+
+def composition_views(ctx):
+    """構成比推移: 営業収益構成比（エリア）・営業利益構成比（積み上げ棒）"""
+    pivot_rev_comp = ctx.pivot('営業収益構成比')
+
+    fig3, ax3 = _subplots(figsize=(14, 6))
+    pivot_rev_comp.plot(kind='area', stacked=True, ax=ax3, alpha=0.8,
+                       color=[ctx.color(r) for r in pivot_rev_comp.columns])
+    ax3.set_title('地域別営業収益構成比の推移（四半期）', fontsize=14, fontweight='bold')
+    ax3.set_xlabel('決算四半期')
+    ax3.set_ylabel('構成比（%）')
+    ax3.set_ylim(0, 100)
+    ax3.legend(title='地域', bbox_to_anchor=(1.02, 1), loc='upper left')
+    _quarter_axis(ax3, ctx.quarters)
+    fig3.tight_layout()
+
+    # 営業利益構成比 - 積み上げ棒グラフ（正負両方の積み上げに対応）
+    pivot_profit_comp = ctx.pivot('営業利益構成比')
+
+    fig4, ax4 = _subplots(figsize=(14, 6))
+    pivot_profit_comp.plot(kind='bar', stacked=True, ax=ax4,
+                          color=[ctx.color(r) for r in pivot_profit_comp.columns])
+    ax4.set_title('地域別営業利益構成比の推移（四半期・積み上げ）', fontsize=14, fontweight='bold')
+    ax4.set_xlabel('決算四半期')
+    ax4.set_ylabel('構成比（%）')
+    ax4.axhline(y=0, color='black', linewidth=0.5)
+    ax4.legend(title='地域', bbox_to_anchor=(1.02, 1), loc='upper left')
+    _quarter_axis(ax4, ctx.quarters)
+    fig4.tight_layout()
+
+    return [
+        ReportView("comp_rev_html", "営業収益構成比の推移（四半期）", fig3,
+                   [TableBlock("営業収益構成比一覧（%）", pivot_rev_comp.T, "{:.1f}", 'bar')],
+                   "営業収益構成比レポート_四半期.html"),
+        ReportView("comp_profit_html", "営業利益構成比の推移（四半期）", fig4,
+                   [TableBlock("営業利益構成比一覧（%）", pivot_profit_comp.T, "{:.1f}")],
+                   "営業利益構成比レポート_四半期.html"),
+    ]
+
+def margin_views(ctx):
+    """利益率推移: 地域別営業利益率の折れ線グラフ"""
+    df_filtered = ctx.df_filtered
+    positions = {q: i for i, q in enumerate(ctx.quarters)}
+    fig5, ax5 = _subplots(figsize=(14, 7))
+    for region in ctx.regions:
+        reg_data = df_filtered[df_filtered['地域'] == region].sort_values('四半期数値')
+        _plot_line(ax5, reg_data['決算年度'].map(positions), reg_data['営業収益営業利益率'],
+                   marker='o', label=region, color=ctx.color(region), linewidth=2, markersize=4)
+    adjusted_margin = _adjusted(ctx, '営業収益営業利益率')
+    if adjusted_margin is not None:
+        for region in ctx.regions:
+            _plot_line(ax5, np.arange(len(ctx.quarters)), adjusted_margin[region],
+                       color=ctx.color(region), linestyle='--', linewidth=1.2, alpha=0.7)
+        ax5.plot([], [], color='gray', linestyle='--', linewidth=1.2, label='破線: 季節調整済み')
+    _mark_anomalies(ax5, ctx, '営業収益営業利益率', ctx.pivot('営業収益営業利益率'))
+    ax5.set_title('地域別営業利益率の推移（四半期）', fontsize=14, fontweight='bold')
+    ax5.set_xlabel('決算四半期')
+    ax5.set_ylabel('営業利益率（%）')
+    ax5.axhline(y=0, color='black', linewidth=0.5)
+    ax5.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
+    _quarter_axis(ax5, ctx.quarters)
+    ax5.grid(True, alpha=0.3)
+    fig5.tight_layout()
+
+    pivot_margin = ctx.pivot('営業収益営業利益率').T
+    tables = [TableBlock("営業利益率一覧（%）", pivot_margin, "{:.1f}")]
+    if adjusted_margin is not None:
+        tables.append(TableBlock("季節調整済み営業利益率（%）", adjusted_margin.T, "{:.1f}"))
+    return [
+        ReportView("margin_html", "地域別営業利益率の推移（四半期）", fig5, tables,
+                   "営業利益率レポート_四半期.html"),
+    ]
+
+def _yoy_line_chart(ctx, yoy_filtered, column, title):
+    positions = {q: i for i, q in enumerate(ctx.quarters)}
+    fig, ax = _subplots(figsize=(14, 7))
+    for region in ctx.regions:
+        reg_data = yoy_filtered[yoy_filtered['地域'] == region].sort_values('四半期数値')
+        _plot_line(ax, reg_data['決算年度'].map(positions), reg_data[column],
+                   marker='o', label=region, color=ctx.color(region), linewidth=2, markersize=4)
+    ax.set_title(title, fontsize=14, fontweight='bold')
+    ax.set_xlabel('決算四半期')
+    ax.set_ylabel('成長率（%）')
+    ax.axhline(y=0, color='black', linewidth=0.5, linestyle='--')
+    ax.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
+    _quarter_axis(ax, ctx.quarters)
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+    return fig
+
+def yoy_views(ctx):
+    """前年同期比: 営業収益・営業利益の成長率"""
+    # 前年同期（4四半期前）との比較。df_raw は地域・四半期順にソート済み
+    yoy_df = ctx.df_raw.copy()
+    by_region = yoy_df.groupby('地域')
+    yoy_df['前年同期比'] = np.round(
+        (yoy_df['営業収益'] / by_region['営業収益'].shift(4) - 1) * 100, 1
+    )
+    yoy_df['営業利益前年同期比'] = np.round(
+        (yoy_df['営業利益'] / by_region['営業利益'].shift(4) - 1) * 100, 1
+    )
+    yoy_filtered = yoy_df[yoy_df['決算年度'].isin(ctx.quarters)]
+
+    fig6 = _yoy_line_chart(ctx, yoy_filtered, '前年同期比', '地域別営業収益 前年同期比成長率')
+    pivot_yoy = ctx.pivot('前年同期比', yoy_filtered).T
+
+    fig7 = _yoy_line_chart(ctx, yoy_filtered, '営業利益前年同期比', '地域別営業利益 前年同期比成長率')
+    pivot_yoy_profit = ctx.pivot('営業利益前年同期比', yoy_filtered).T
+
+    return [
+        ReportView("yoy_html", "地域別営業収益 前年同期比成長率", fig6,
+                   [TableBlock("前年同期比成長率一覧（%）", pivot_yoy, "{:.1f}")],
+                   "前年同期比レポート.html"),
+        ReportView("yoy_profit_html", "地域別営業利益 前年同期比成長率", fig7,
+                   [TableBlock("営業利益 前年同期比成長率一覧（%）", pivot_yoy_profit, "{:.1f}")],
+                   "営業利益前年同期比レポート.html"),
+    ]
+
+def _waterfall(ax, labels, start, deltas, colors, title):
+    """前年同期 → 増減要因 → 当期のウォーターフォール"""
+    deltas = np.asarray(deltas, dtype=float)
+    end = start + deltas.sum()
+    bottoms = start + np.concatenate([[0], np.cumsum(deltas)[:-1]])
+    x = np.arange(len(labels) + 2)
+    ax.bar(x[0], start, color='#999')
+    ax.bar(x[1:-1], deltas, bottom=bottoms, color=colors, edgecolor=['#2ca02c' if d >= 0 else '#d62728' for d in deltas],
+           linewidth=2)
+    ax.bar(x[-1], end, color='#555')
+    for xi, value, top in zip(x, [start, *deltas, end], [start, *(bottoms + np.maximum(deltas, 0)), end]):
+        ax.annotate(f"{value:+,.0f}" if 0 < xi < x[-1] else f"{value:,.0f}", (xi, top),
+                    ha='center', va='bottom', fontsize=8)
+    # 増減が見えるよう前年同期・当期の小さい方の近くから表示
+    low = min(start, end, *(bottoms + np.minimum(deltas, 0)))
+    high = max(start, end, *(bottoms + np.maximum(deltas, 0)))
+    if low > 0:
+        ax.set_ylim(max(0, low - (high - low) * 0.5), high + (high - low) * 0.15)
+    ax.set_xticks(x)
+    ax.set_xticklabels(['前年同期', *labels, '当期'], rotation=30, fontsize=9)
+    ax.set_title(title, fontsize=12, fontweight='bold')
+    ax.set_ylabel('百万円')
+    _thousands(ax)
+    ax.grid(True, alpha=0.3, axis='y')
+
+def contribution_view(ctx, contrib, metric='営業収益', quarter=None):
+    """前年同期比の寄与度分解: 地域別寄与度の積み上げ（表示範囲）と、選択四半期のウォーターフォール。表示範囲なしは None"""
+    quarters = [q for q in ctx.quarters if q in contrib.quarters]
+    if not quarters:
+        return None
+    quarter = quarter if quarter in quarters else quarters[-1]
+    table = contrib.frame(metric).loc[quarters, ctx.regions]
+    summary = contrib.summary(metric).loc[quarters]
+    x = np.arange(len(quarters))
+
+    fig = Figure(figsize=(14, 11))
+    grid = fig.add_gridspec(2, 2)
+    ax = fig.add_subplot(grid[0, :])
+    # 正の寄与は上、負の寄与は下に積み上げる
+    pos_bottom, neg_bottom = np.zeros(len(quarters)), np.zeros(len(quarters))
+    for region in ctx.regions:
+        values = table[region].fillna(0).to_numpy()
+        bottom = np.where(values >= 0, pos_bottom, neg_bottom)
+        ax.bar(x, values, bottom=bottom, color=ctx.color(region), label=region)
+        pos_bottom += np.maximum(values, 0)
+        neg_bottom += np.minimum(values, 0)
+    ax.plot(x, summary['成長率'], color='black', marker='o', linewidth=2, label='全体の成長率')
+    ax.axhline(y=0, color='black', linewidth=0.5)
+    ax.axvline(x=quarters.index(quarter), color='#999', linestyle='--', linewidth=1)
+    ax.set_title(f'{metric} 前年同期比の地域別寄与度', fontsize=14, fontweight='bold')
+    ax.set_ylabel('寄与度（ポイント）')
+    _quarter_axis(ax, quarters)
+    ax.legend(title='地域', bbox_to_anchor=(1.02, 1), loc='upper left')
+    ax.grid(True, alpha=0.3, axis='y')
+
+    # 選択四半期のウォーターフォール（地域別の増減・営業利益の要因）
+    row = contrib.quarters.index(quarter)
+    panels = [
+        (fig.add_subplot(grid[1, 0]), f'{metric}の増減（{quarter}・地域別）', ctx.regions,
+         contrib.totals[metric][row, 0], contrib.frame(metric, 'change').loc[quarter, ctx.regions].fillna(0),
+         [ctx.color(r) for r in ctx.regions]),
+        (fig.add_subplot(grid[1, 1]), f'営業利益の増減要因（{quarter}）', analytics.PROFIT_EFFECTS,
+         contrib.totals['営業利益'][row, 0], contrib.effects[row], ['#1f77b4', '#ff7f0e', '#9467bd', '#7f7f7f']),
+    ]
+    for panel_ax, title, labels, start, deltas, colors in panels:
+        if np.isnan(start):
+            panel_ax.text(0.5, 0.5, '前年同期のデータがありません', ha='center', va='center', transform=panel_ax.transAxes)
+            panel_ax.set_title(title, fontsize=12, fontweight='bold')
+            panel_ax.axis('off')
+        else:
+            _waterfall(panel_ax, labels, start, deltas, colors, title)
+    fig.tight_layout()
+
+    contribution = table.T
+    contribution.loc['全体'] = summary['成長率']
+    effects = contrib.effect_frame().loc[quarters]
+    profit = contrib.summary('営業利益').loc[quarters]
+    effects.insert(0, '前年同期', profit['前年同期'])
+    effects['当期'] = profit['当期']
+    return ReportView(
+        "contribution_html", f"{metric} 前年同期比の寄与度分解", fig,
+        [TableBlock(f"{metric} 前年同期比の寄与度一覧（ポイント、全体は成長率%）", contribution, "{:+.2f}"),
+         TableBlock(f"{metric} 前年同期差（百万円）", contrib.frame(metric, 'change').loc[quarters, ctx.regions].T,
+                    "{:+,.0f}"),
+         TableBlock("営業利益の前年同期差の要因分解（百万円）", effects.T, "{:,.0f}")],
+        f"{metric}寄与度レポート.html")
+
+def _seasonal_bar_chart(ctx, seasonal, title, ylabel, zero_line=False):
+    fig, ax = _subplots(figsize=(10, 6))
+    x = np.arange(4)
+    # 系列数に応じて棒の幅を決め、各四半期の中央に並べる
+    n = len(ctx.regions)
+    width = 0.8 / max(n, 1)
+    for i, region in enumerate(ctx.regions):
+        ax.bar(x + (i - (n - 1) / 2) * width, seasonal[region], width,
+               label=region, color=ctx.color(region))
+    ax.set_title(title, fontsize=14, fontweight='bold')
+    ax.set_xlabel('四半期')
+    ax.set_ylabel(ylabel)
+    ax.set_xticks(x)
+    ax.set_xticklabels(QUARTER_LABELS)
+    if zero_line:
+        ax.axhline(y=0, color='black', linewidth=0.5)
+    ax.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
+    _thousands(ax)
+    ax.grid(True, alpha=0.3, axis='y')
+    fig.tight_layout()
+    return fig
+
+def seasonal_views(ctx):
+    """季節性分析: Q1〜Q4 の四半期別平均（全期間）"""
+    # 四半期別の平均を計算
+    seasonal_df = ctx.df_raw.copy()
+    seasonal_df['Q'] = seasonal_df['決算種別']
+
+    def seasonal_mean(values):
+        return seasonal_df.pivot_table(
+            index='Q', columns='地域', values=values, aggfunc='mean'
+        ).reindex(QUARTER_LABELS).reindex(columns=ctx.regions)
+
+    seasonal_rev = seasonal_mean('営業収益')
+    fig8 = _seasonal_bar_chart(ctx, seasonal_rev, '地域別 四半期平均営業収益', '平均営業収益（百万円）')
+
+    seasonal_profit = seasonal_mean('営業利益')
+    fig9 = _seasonal_bar_chart(ctx, seasonal_profit, '地域別 四半期平均営業利益', '平均営業利益（百万円）',
+                               zero_line=True)
+
+    seasonal_margin = seasonal_mean('営業収益営業利益率')
+    fig10, ax10 = _subplots(figsize=(10, 6))
+    for region in ctx.regions:
+        ax10.plot(QUARTER_LABELS, seasonal_margin[region],
+                 marker='o', label=region, color=ctx.color(region), linewidth=2)
+    ax10.set_title('地域別 四半期平均営業利益率', fontsize=14, fontweight='bold')
+    ax10.set_xlabel('四半期')
+    ax10.set_ylabel('平均営業利益率（%）')
+    ax10.axhline(y=0, color='black', linewidth=0.5)
+    ax10.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
+    ax10.grid(True, alpha=0.3)
+    fig10.tight_layout()
+
+    return [
+        ReportView("seasonal_rev", "地域別 四半期平均営業収益", fig8,
+                   [TableBlock("四半期別平均営業収益（百万円）", seasonal_rev.T)]),
+        ReportView("seasonal_profit", "地域別 四半期平均営業利益", fig9,
+                   [TableBlock("四半期別平均営業利益（百万円）", seasonal_profit.T)]),
+        ReportView("seasonal_html", "四半期別季節性分析", fig10,
+                   [TableBlock("四半期別平均営業利益率（%）", seasonal_margin.T, "{:.1f}")],
+                   "季節性分析レポート.html"),
+    ]
+
+def decomposition_views(ctx):
+    """季節性分析: 傾向（中心化移動平均）を除いた季節成分。四半期平均と違い、成長による偏りを含まない"""
+    views = []
+    for metric, key in (('営業収益', 'seasonal_factor_rev'), ('営業利益', 'seasonal_factor_profit')):
+        if metric not in ctx.decomposition.metrics:
+            continue
+        factors = ctx.decomposition.seasonal_factors(metric).reindex(QUARTER_LABELS).reindex(columns=ctx.regions)
+        trend = ctx.decomposition.frame(metric, 'trend').reindex(columns=ctx.regions)
+        fig = _seasonal_bar_chart(ctx, factors, f'地域別 {metric}の季節成分（傾向除去後）',
+                                  '季節成分（百万円、傾向からの乖離）', zero_line=True)
+        views.append(ReportView(key, f"地域別 {metric}の季節成分", fig, [
+            TableBlock(f"四半期別 {metric}の季節成分（百万円）", factors.T),
+            TableBlock(f"{metric}の傾向（算出できる直近8四半期、百万円）",
+                       trend.dropna(how='all').tail(2 * len(QUARTER_LABELS)).T),
+        ]))
+    return views
+
+def forecast_view(ctx, store, forecasts, metric, model, horizon):
+    """業績予測: 表示範囲の実績＋予測値（予測区間付き）。データ不足・表示範囲なしは None"""
+    if (metric, model) not in forecasts:
+        return None
+    forecast = forecasts[(metric, model)]
+    fc_point = forecast.point.iloc[:horizon]
+    fc_lower = forecast.lower.iloc[:horizon]
+    fc_upper = forecast.upper.iloc[:horizon]
+
+    # 実績は表示範囲の四半期。最新四半期を含まない場合は、予測までの間の四半期を空けて表示する
+    frame = store.frame(metric)
+    fc_actual = frame.loc[[q for q in ctx.quarters if q in frame.index]]
+    if fc_actual.empty:
+        return None
+    skipped = list(frame.index[frame.index.get_loc(fc_actual.index[-1]) + 1:])
+    x_actual = np.arange(len(fc_actual))
+    x_future = np.arange(len(fc_actual) + len(skipped) - 1, len(fc_actual) + len(skipped) + horizon)
+
+    fig, ax = _subplots(figsize=(14, 7))
+    for region in ctx.regions:
+        color = ctx.color(region)
+        _plot_line(ax, x_actual, fc_actual[region], marker='o', label=region,
+                   color=color, linewidth=2, markersize=4)
+        # 最新四半期の実績から予測値へ破線でつなぐ
+        ax.plot(x_future, np.r_[frame[region].iloc[-1], fc_point[region]],
+                linestyle='--', marker='o', color=color, linewidth=2, markersize=4)
+        ax.fill_between(x_future[1:], fc_lower[region], fc_upper[region], color=color, alpha=0.12)
+    ax.axvline(x=x_future[0] + 0.5, color='gray', linewidth=1, linestyle=':')
+    ax.set_title(f'地域別{metric}の予測（{model}・95%予測区間）', fontsize=14, fontweight='bold')
+    ax.set_xlabel('決算四半期')
+    ax.set_ylabel(f'{metric}（百万円）')
+    ax.axhline(y=0, color='black', linewidth=0.5)
+    ax.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
+    _quarter_axis(ax, list(fc_actual.index) + skipped + list(fc_point.index))
+    _thousands(ax)
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+
+    tables = [TableBlock(f"{metric} 予測値一覧（百万円）", fc_point.T)]
+    if forecast.params is not None:
+        tables.append(TableBlock("Holt-Winters 平滑化パラメータ", forecast.params, "{:.2f}"))
+    return ReportView("forecast_html", f"地域別{metric}の予測（{model}）", fig, tables,
+                      f"{metric}予測レポート_四半期.html")
+
+def correlation_view(ctx, correlations, target):
+    """相関分析: 地域間相関係数のヒートマップ"""
+    corr_matrix = correlations[target]
+    # 系列数が多い場合は数値注記を省略
+    annotate = len(ctx.regions) <= 12
+
+    fig, ax = _subplots(figsize=(10, 8))
+    sns.heatmap(corr_matrix, ax=ax, cmap='RdBu_r', vmin=-1, vmax=1, center=0,
+                annot=annotate, fmt='.2f', square=True, linewidths=0.5,
+                cbar_kws={'label': '相関係数'})
+    ax.set_title(f'地域間相関係数（{target}）', fontsize=14, fontweight='bold')
+    ax.set_xlabel('')
+    ax.set_ylabel('')
+    fig.tight_layout()
+
+    return ReportView("corr_html", f"地域間相関係数（{target}）", fig,
+                      [TableBlock(f"相関係数一覧（{target}）", corr_matrix, "{:.2f}", 'diverging')],
+                      "地域間相関レポート.html")
+
+def seasonal_index_view(ctx, correlations):
+    """相関分析: 地域 × 四半期の季節指数ヒートマップ（年度平均 = 100）"""
+    seasonal_index = correlations['季節指数'].T
+    annotate = len(ctx.regions) <= 12
+
+    fig, ax = _subplots(figsize=(10, max(3, 0.5 * len(ctx.regions) + 1)))
+    sns.heatmap(seasonal_index, ax=ax, cmap='coolwarm', center=100,
+                annot=annotate, fmt='.1f', linewidths=0.5, cbar_kws={'label': '季節指数'})
+    ax.set_title('地域 × 四半期 季節指数', fontsize=14, fontweight='bold')
+    ax.set_xlabel('四半期')
+    ax.set_ylabel('')
+    fig.tight_layout()
+
+    return ReportView("seasonal_index_html", "地域別 季節指数（営業収益）", fig,
+                      [TableBlock("季節指数一覧", seasonal_index, "{:.1f}")],
+                      "季節指数レポート.html")
+
+DERIVED_CHARTS = {'line': '折れ線', 'bar': '積み上げ棒', 'heatmap': 'ヒートマップ'}
+
+def derived_metric_view(ctx, values, metric, chart='line'):
+    """カスタム指標: 式で定義した派生指標（values は全期間の 行: 四半期, 列: 地域）を選んだ図表の種類で描画"""
+    frame = values.reindex(index=ctx.quarters, columns=ctx.regions)
+    unit = f"（{metric.unit}）" if metric.unit else ''
+    x = np.arange(len(frame))
+    if chart == 'heatmap':
+        fig, ax = _subplots(figsize=(14, max(3, 0.6 * len(frame.columns) + 2)))
+        # 0 を中心に正負を対称な色の幅で表示（全て欠損なら自動）
+        limit = frame.abs().max().max()
+        limit = limit if pd.notna(limit) and limit > 0 else None
+        sns.heatmap(frame.T, ax=ax, cmap='RdBu_r', center=0, vmin=-limit if limit else None, vmax=limit,
+                    linewidths=0.5, cbar_kws={'label': metric.unit})
+        ax.set_xticks(x + 0.5)
+        ax.set_xticklabels(frame.index, rotation=45, ha='right')
+        ax.set_ylabel('')
+    else:
+        fig, ax = _subplots(figsize=(14, 6))
+        if chart == 'bar':
+            frame.plot(kind='bar', stacked=True, ax=ax, color=[ctx.color(r) for r in frame.columns])
+        else:
+            for region in frame.columns:
+                _plot_line(ax, x, frame[region], marker='o', label=region, color=ctx.color(region),
+                           linewidth=2, markersize=4)
+            ax.grid(True, alpha=0.3)
+        ax.axhline(y=0, color='black', linewidth=0.5)
+        ax.set_ylabel(f'{metric.name}{unit}')
+        ax.legend(title='地域', bbox_to_anchor=(1.02, 1), loc='upper left')
+        _quarter_axis(ax, ctx.quarters)
+    ax.set_title(f'地域別 {metric.name}（{metric.expression}）', fontsize=14, fontweight='bold')
+    ax.set_xlabel('決算四半期')
+    fig.tight_layout()
+
+    return ReportView("derived_html", f"地域別 {metric.name}", fig,
+                      [TableBlock(f"{metric.name}一覧{unit}", frame.T, metric.format)],
+                      "カスタム指標レポート.html")
+
+def period_comparison_view(ctx, comparison):
+    """期間比較: 2つの四半期区間の営業収益・営業利益（地域別）と、構成比・利益率の変化"""
+    table = comparison.table
+    regions = [r for r in ctx.regions if r in table.index]
+    base, target = comparison.base_label, comparison.target_label
+    x = np.arange(len(regions))
+    width = 0.38
+
+    fig, axes = _subplots(1, 3, figsize=(16, 6))
+    for ax, metric in zip(axes[:2], analytics.AMOUNT_COLS):
+        ax.bar(x - width / 2, table.loc[regions, f'{metric}（基準）'], width, label=f'基準: {base}',
+               color=[ctx.color(r) for r in regions], alpha=0.45)
+        ax.bar(x + width / 2, table.loc[regions, f'{metric}（比較）'], width, label=f'比較: {target}',
+               color=[ctx.color(r) for r in regions])
+        ax.set_title(f'{metric}（区間合計）', fontsize=12, fontweight='bold')
+        ax.set_ylabel(f'{metric}（百万円）')
+        ax.set_xticks(x)
+        ax.set_xticklabels(regions, rotation=45, ha='right')
+        ax.axhline(y=0, color='black', linewidth=0.5)
+        _thousands(ax)
+        ax.legend(fontsize=8)
+        ax.grid(True, alpha=0.3, axis='y')
+
+    ax = axes[2]
+    y = np.arange(len(regions))
+    ax.barh(y - width / 2, table.loc[regions, '営業収益構成比 差'], width, label='営業収益構成比', color='steelblue')
+    ax.barh(y + width / 2, table.loc[regions, '営業利益率 差'], width, label='営業利益率', color='darkorange')
+    ax.set_yticks(y)
+    ax.set_yticklabels(regions)
+    ax.invert_yaxis()
+    ax.axvline(x=0, color='black', linewidth=0.5)
+    ax.set_title('構成比・利益率の変化（pt）', fontsize=12, fontweight='bold')
+    ax.legend(fontsize=8)
+    ax.grid(True, alpha=0.3, axis='x')
+    fig.suptitle(f'期間比較: {target} vs {base}', fontsize=14, fontweight='bold')
+    fig.tight_layout()
+
+    rows = regions + [analytics.TOTAL_LABEL]
+    amounts = [f'{metric}{suffix}' for metric in analytics.AMOUNT_COLS for suffix in ('（基準）', '（比較）', ' 増減')]
+    ratios = [c for c in table.columns if c not in amounts]
+    # 水準（利益率・構成比）は符号なし、変化（増減・差・増減率・CAGR）は符号付き
+    ratio_formats = {c: "{:.1f}" if c.endswith(('（基準）', '（比較）')) else "{:+.1f}" for c in ratios}
+    amount_formats = {c: "{:+,.0f}" if c.endswith('増減') else "{:,.0f}" for c in amounts}
+    return ReportView("compare_html", f"期間比較（{target} vs {base}）", fig, [
+        TableBlock("区間合計・増減（百万円）", table.loc[rows, amounts], amount_formats),
+        TableBlock("増減率・利益率・構成比・CAGR（%・pt）", table.loc[rows, ratios], ratio_formats),
+    ], "期間比較レポート.html")
+
+def capex_view(ctx, capex, metric):
+    """設備投資: 選択指標の年度推移（表示範囲に含まれる年度）。該当年度なしは None"""
+    unit, fmt = analytics.CAPEX_METRICS[metric]
+    years = [y for y in capex[metric].index if any(q.startswith(y) for q in ctx.quarters)]
+    if not years:
+        return None
+    table = capex[metric].loc[years, ctx.regions]
+
+    fig, ax = _subplots(figsize=(14, 7))
+    for region in ctx.regions:
+        ax.plot(years, table[region], marker='o', label=region,
+                color=ctx.color(region), linewidth=2, markersize=5)
+    ax.set_title(f'地域別{metric}の推移（年度）', fontsize=14, fontweight='bold')
+    ax.set_xlabel('決算年度')
+    ax.set_ylabel(f'{metric}（{unit}）')
+    ax.axhline(y=0, color='black', linewidth=0.5)
+    ax.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
+    if unit == '百万円':
+        _thousands(ax)
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+
+    tables = [TableBlock(f"{metric}（{unit}）", table.T, fmt)]
+    if metric != '設備投資':
+        tables.append(TableBlock("設備投資（百万円）", capex['設備投資'].loc[years, ctx.regions].T))
+    return ReportView("capex_html", f"地域別{metric}（年度）", fig, tables, f"{metric}レポート_年度.html")
+
+COMPARISON_UNITS = {'営業収益': ('百万円', "{:,.0f}"), '営業利益': ('百万円', "{:,.0f}"),
+                    '営業利益率': ('%', "{:.1f}"), '営業収益 前年同期比': ('%', "{:.1f}")}
+
+def company_comparison_view(ctx, comparison, metric, colors):
+    """企業比較: 全社合計の指標を企業ごとに比較（表示範囲の四半期）"""
+    unit, fmt = COMPARISON_UNITS[metric]
+    table = comparison[metric].reindex(ctx.quarters)
+
+    fig, ax = _subplots(figsize=(14, 7))
+    for company in table.columns:
+        ax.plot(ctx.quarters, table[company], marker='o', label=company,
+                color=colors.get(company, '#333'), linewidth=2, markersize=4)
+    ax.set_title(f'企業別{metric}の推移（全社合計）', fontsize=14, fontweight='bold')
+    ax.set_xlabel('決算四半期')
+    ax.set_ylabel(f'{metric}（{unit}）')
+    ax.axhline(y=0, color='black', linewidth=0.5)
+    ax.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
+    ax.tick_params(axis='x', rotation=45)
+    if unit == '百万円':
+        _thousands(ax)
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+
+    return ReportView("company_html", f"企業別{metric}（全社合計）", fig,
+                      [TableBlock(f"企業別{metric}（{unit}）", table.T, fmt)],
+                      f"企業比較_{metric}レポート_四半期.html")
+
+def restatement_view(ctx, diff, metric):
+    """修正差分: 2つのデータバージョン間で修正されたセルと合計の変動（全期間）。修正なしは None"""
+    if diff.n_changed(metric) == 0:
+        return None
+    unit, fmt = analytics.DIFF_METRICS[metric]
+    quarters = diff.changed_quarters(metric)
+    totals = diff.totals(metric)
+    delta = diff.frame(metric) - diff.frame(metric, 'old')
+
+    fig, (ax1, ax2) = _subplots(2, 1, figsize=(14, 10))
+    x = np.arange(len(diff.quarters))
+    _plot_line(ax1, x, totals['修正前'], color='#999', linestyle='--', marker='o', markersize=3, label='修正前')
+    _plot_line(ax1, x, totals['修正後'], color='#1f77b4', marker='o', markersize=3, label='修正後')
+    for i, q in enumerate(diff.quarters):
+        if q in quarters:
+            ax1.axvspan(i - 0.5, i + 0.5, color='#ffe08a', alpha=0.5, linewidth=0)
+    ax1.set_title(f'全地域合計の{metric}（修正前後・修正を含む四半期を強調）', fontsize=14, fontweight='bold')
+    ax1.set_ylabel(f'{metric}（{unit}）')
+    _quarter_axis(ax1, diff.quarters, rotation=90, fontsize=8)
+    ax1.legend(loc='upper left')
+    if unit == '百万円':
+        _thousands(ax1)
+    ax1.grid(True, alpha=0.3)
+
+    heat = delta.where(diff.mask(metric)).T
+    limit = np.nanmax(np.abs(heat.to_numpy())) if np.isfinite(heat.to_numpy()).any() else 1
+    sns.heatmap(heat, cmap='RdBu_r', center=0, vmin=-limit, vmax=limit, ax=ax2,
+                linewidths=0.5, linecolor='#eee', cbar_kws={'label': f'修正額（{unit}）'})
+    ax2.set_title(f'地域別の修正額（修正後 − 修正前）', fontsize=14, fontweight='bold')
+    ax2.set_xlabel('決算四半期')
+    ax2.set_ylabel('')
+    ax2.tick_params(axis='y', rotation=0)
+    fig.tight_layout()
+
+    cells = diff.changed_cells(metric)
+    return ReportView(
+        "restatement_html", f"{metric}の修正差分", fig,
+        [TableBlock(f"修正されたセル（{metric}・{unit}）", cells,
+                    {'修正前': fmt, '修正後': fmt, '差分': fmt, '差分率(%)': "{:+.1f}"}),
+         TableBlock(f"修正後の{metric}（修正されたセルを強調）", diff.frame(metric).loc[quarters].T, fmt,
+                    mask=diff.mask(metric).loc[quarters].T),
+         TableBlock(f"全地域合計の変動（{unit}）", totals.loc[quarters].T, fmt)],
+        f"{metric}_修正差分レポート.html")
+
+def fx_label(currencies, shocks):
+    """為替シナリオの説明（例: 人民元 +10%・アセアン通貨 -5%）"""
+    return '・'.join(f"{c} {s:+.0f}%" for c, s in zip(currencies, shocks))
+
+def fx_scenario_view(ctx, scenarios, shocks):
+    """為替シナリオ: 外貨建て地域の円換算額に為替変動を適用した合計・利益率・構成比（表示範囲の四半期）"""
+    label = fx_label(scenarios.currencies, shocks)
+    actual = scenarios.scenario((0,) * len(shocks))
+    scenario = scenarios.scenario(shocks)
+    quarters = [q for q in ctx.quarters if q in scenarios.quarters]
+    x = np.arange(len(quarters))
+
+    fig, axes = _subplots(2, 2, figsize=(16, 10))
+    for ax, metric, unit in [(axes[0, 0], '営業収益', '百万円'), (axes[0, 1], '営業利益', '百万円'),
+                             (axes[1, 0], '営業利益率', '%')]:
+        ax.plot(x, actual['合計'].loc[quarters, metric], color='#999', linestyle='--', marker='o',
+                markersize=3, label='実績')
+        ax.plot(x, scenario['合計'].loc[quarters, metric], color='#1f77b4', marker='o', markersize=3,
+                label='シナリオ')
+        ax.set_title(f'全地域合計の{metric}', fontsize=12, fontweight='bold')
+        ax.set_ylabel(f'{metric}（{unit}）')
+        _quarter_axis(ax, quarters, fontsize=8)
+        ax.legend(loc='upper left')
+        if unit == '百万円':
+            _thousands(ax)
+        ax.grid(True, alpha=0.3)
+
+    # 感応度: 表示期間の営業利益合計の増減（通貨別の増減の和で刻み全体を求める）
+    ax = axes[1, 1]
+    rows = [scenarios.quarters.index(q) for q in quarters]
+    change = scenarios.sensitivity(rows, shocks)
+    pos = [scenarios.grid.index(s) for s in shocks]
+    if len(shocks) == 1:
+        ax.plot(scenarios.grid, change, color='#1f77b4', marker='o', markersize=4)
+        ax.plot(shocks[0], change[pos[0]], color='#d62728', marker='o', markersize=9)
+        ax.axhline(y=0, color='black', linewidth=0.5)
+        ax.set_xlabel(f'{scenarios.currencies[0]}の為替変動率（%、+は円安）')
+        ax.set_ylabel('営業利益の増減（百万円）')
+        _thousands(ax)
+        ax.grid(True, alpha=0.3)
+    else:
+        # 3通貨以上は先頭2通貨の面（他の通貨は選択中の変動率で固定）
+        grid_labels = [f"{s:+d}" for s in scenarios.grid]
+        sns.heatmap(pd.DataFrame(change, index=grid_labels, columns=grid_labels), cmap='RdBu', center=0,
+                    ax=ax, cbar_kws={'label': '営業利益の増減（百万円）'})
+        ax.add_patch(Rectangle((pos[1], pos[0]), 1, 1, fill=False, edgecolor='black', linewidth=2))
+        ax.set_ylabel(f'{scenarios.currencies[0]}（%、+は円安）')
+        ax.set_xlabel(f'{scenarios.currencies[1]}（%、+は円安）')
+    ax.set_title('為替感応度（表示期間の営業利益合計）', fontsize=12, fontweight='bold')
+    fig.suptitle(f'為替シナリオ: {label}', fontsize=14, fontweight='bold')
+    fig.tight_layout()
+
+    totals = pd.DataFrame({
+        '営業収益（実績）': actual['合計']['営業収益'], '営業収益（シナリオ）': scenario['合計']['営業収益'],
+        '営業利益（実績）': actual['合計']['営業利益'], '営業利益（シナリオ）': scenario['合計']['営業利益'],
+    }).loc[quarters].T
+    margins = pd.DataFrame({'実績': actual['合計']['営業利益率'],
+                            'シナリオ': scenario['合計']['営業利益率']}).loc[quarters].T
+    return ReportView(
+        "fx_html", f"為替シナリオ（{label}）", fig,
+        [TableBlock("全地域合計（百万円）", totals),
+         TableBlock("全地域合計の営業利益率（%）", margins, "{:.2f}"),
+         TableBlock("シナリオの地域別営業収益（百万円）", scenario['営業収益'].loc[quarters].T),
+         TableBlock("シナリオの営業収益構成比（%）", scenario['営業収益構成比'].loc[quarters].T, "{:.1f}")],
+        "為替シナリオレポート_四半期.html")
+
+def region_detail_view(ctx, region):
+    """地域詳細: 選択地域の4分割チャート＋業績・構成比テーブル。データなしは None"""
+    df_filtered = ctx.df_filtered
+    if df_filtered[df_filtered['地域'] == region].empty:
+        return None
+
+    # 前年同期比計算
+    reg_all = ctx.df_raw[ctx.df_raw['地域'] == region].sort_values('四半期数値').copy()
+    reg_all['前年同期比'] = np.round(
+        (reg_all['営業収益'] / reg_all['営業収益'].shift(4) - 1) * 100, 1
+    )
+    reg_detail = reg_all[reg_all['決算年度'].isin(ctx.quarters)].copy()
+
+    quarters_display = reg_detail['決算年度'].tolist()
+    x = np.arange(len(quarters_display))
+
+    # 2x2サブプロット
+    fig11, axs = _subplots(2, 2, figsize=(14, 10))
+
+    # 営業収益
+    axs[0, 0].bar(x, reg_detail['営業収益'], color=ctx.color(region, 'skyblue'))
+    detail_frame = reg_detail.set_index('決算年度')
+    _mark_anomalies(axs[0, 0], ctx, '営業収益', detail_frame[['営業収益']].set_axis([region], axis=1))
+    axs[0, 0].set_title('営業収益', fontsize=12, fontweight='bold')
+    axs[0, 0].set_ylabel('金額（百万円）')
+    _quarter_axis(axs[0, 0], quarters_display)
+    _thousands(axs[0, 0])
+
+    # 営業利益
+    colors = ['orange' if v >= 0 else 'red' for v in reg_detail['営業利益']]
+    axs[0, 1].bar(x, reg_detail['営業利益'], color=colors)
+    _mark_anomalies(axs[0, 1], ctx, '営業利益', detail_frame[['営業利益']].set_axis([region], axis=1))
+    axs[0, 1].set_title('営業利益', fontsize=12, fontweight='bold')
+    axs[0, 1].set_ylabel('金額（百万円）')
+    axs[0, 1].axhline(y=0, color='black', linewidth=0.5)
+    _quarter_axis(axs[0, 1], quarters_display)
+    _thousands(axs[0, 1])
+
+    # 前年同期比成長率
+    _plot_line(axs[1, 0], x, reg_detail['前年同期比'], marker='o',
+               color=ctx.color(region, 'green'), linewidth=2)
+    axs[1, 0].set_title('営業収益 前年同期比成長率', fontsize=12, fontweight='bold')
+    axs[1, 0].set_ylabel('成長率（%）')
+    axs[1, 0].axhline(y=0, color='black', linewidth=0.5, linestyle='--')
+    _quarter_axis(axs[1, 0], quarters_display)
+    axs[1, 0].grid(True, alpha=0.3)
+
+    # 営業利益率
+    _plot_line(axs[1, 1], x, reg_detail['営業収益営業利益率'], marker='o', color='purple', linewidth=2)
+    _mark_anomalies(axs[1, 1], ctx, '営業収益営業利益率',
+                    detail_frame[['営業収益営業利益率']].set_axis([region], axis=1))
+    axs[1, 1].set_title('営業利益率', fontsize=12, fontweight='bold')
+    axs[1, 1].set_ylabel('利益率（%）')
+    axs[1, 1].axhline(y=0, color='black', linewidth=0.5)
+    _quarter_axis(axs[1, 1], quarters_display)
+    axs[1, 1].grid(True, alpha=0.3)
+
+    fig11.tight_layout()
+
+    # 詳細テーブル
+    display_cols = ['決算年度', '営業収益', '営業利益', '前年同期比', '営業収益営業利益率']
+    display_df = reg_detail[display_cols].copy()
+    display_df = display_df.rename(columns={'営業収益営業利益率': '営業利益率'})
+    display_df = display_df.set_index('決算年度')
+
+    format_dict = {
+        '営業収益': '{:,.0f}',
+        '営業利益': '{:,.0f}',
+        '前年同期比': '{:.1f}',
+        '営業利益率': '{:.1f}'
+    }
+
+    # 構成比テーブル（横持ち・バーチャート風スタイル）
+    comp_df = reg_detail[['決算年度', '営業収益構成比', '営業利益構成比']].copy()
+    comp_df = comp_df.set_index('決算年度').T
+
+    return ReportView("detail_html", f"{region} - 業績推移（四半期）", fig11,
+                      [TableBlock("業績推移テーブル", display_df, format_dict),
+                       TableBlock("構成比推移", comp_df, "{:.1f}%", 'bar')],
+                      f"{region}_詳細レポート_四半期.html")
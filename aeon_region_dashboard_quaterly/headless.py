@@ -0,0 +1,140 @@
+"""Streamlit サーバーの起動とヘッドレスセッション（serve.py・loadtest.py 共通）
+
+Session は Streamlit の WebSocket プロトコルを直接操作し、ブラウザなしでスクリプトの再実行・ウィジェット操作を行う。
+
+依存: websockets（requirements.txt に記載）
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from urllib.parse import urljoin
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(BASE_DIR, "app.py")
+
+
+# --- 1. サーバー起動 ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(port, app_path=APP_PATH, timeout=60, extra_args=(), quiet=True):
+    """Streamlit サーバーを起動し、ヘルスチェックが通るまで待つ"""
+    output = subprocess.DEVNULL if quiet else None
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'streamlit', 'run', app_path,
+         '--server.headless', 'true', '--server.port', str(port),
+         '--browser.gatherUsageStats', 'false', *extra_args],
+        stdout=output, stderr=output,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("streamlit server exited during startup")
+        if is_healthy(url):
+            return proc, url
+        time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("streamlit server did not become healthy")
+
+def is_healthy(url):
+    """Streamlit のヘルスチェックエンドポイントが応答するか"""
+    try:
+        with urllib.request.urlopen(f"{url}/_stcore/health", timeout=2) as res:
+            return res.status == 200
+    except OSError:
+        return False
+
+
+# --- 2. セッション（Streamlit の WebSocket プロトコルを直接操作） ---
+class Session:
+    """ブラウザ1タブ相当のセッション"""
+
+    def __init__(self, base_url, fetch_images=True):
+        from streamlit.proto import Radio_pb2
+        self.base_url = base_url
+        self.ws_url = base_url.replace('http', 'ws', 1) + '/_stcore/stream'
+        self.fetch_images = fetch_images
+        # 新しい Streamlit は radio / selectbox を選択肢の文字列で送る
+        self.string_options = 'raw_value' in Radio_pb2.Radio.DESCRIPTOR.fields_by_name
+        self.ws = None
+        self.widgets = {}   # ラベル → (要素種別, proto)
+        self.downloads = []
+        self.images = []
+        self.states = {}    # ウィジェットID → WidgetState
+        self.choices = {}   # ラベル → 選択中の選択肢
+        self.errors = 0
+
+    async def connect(self):
+        import websockets
+        self.ws = await websockets.connect(self.ws_url, subprotocols=['streamlit'], max_size=None)
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def rerun(self, trigger=None):
+        """現在のウィジェット状態でスクリプトを再実行し、完了まで待つ"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        msg = BackMsg()
+        states = list(self.states.values())
+        if trigger is not None:
+            states.append(trigger)
+        msg.rerun_script.widget_states.widgets.extend(states)
+        self.widgets, self.downloads, self.images = {}, [], []
+
+        await self.ws.send(msg.SerializeToString())
+        while True:
+            fwd = ForwardMsg()
+            fwd.ParseFromString(await self.ws.recv())
+            kind = fwd.WhichOneof('type')
+            if kind == 'delta' and fwd.delta.WhichOneof('type') == 'new_element':
+                self._collect(fwd.delta.new_element)
+            elif kind == 'script_finished':
+                break
+        if self.fetch_images:
+            await asyncio.gather(*(self.get(url) for url in self.images))
+
+    def _collect(self, element):
+        kind = element.WhichOneof('type')
+        if kind in ('radio', 'selectbox', 'slider', 'multiselect'):
+            proto = getattr(element, kind)
+            self.widgets[proto.label] = (kind, proto)
+        elif kind == 'download_button':
+            self.downloads.append(element.download_button)
+        elif kind == 'imgs':
+            self.images.extend(img.url for img in element.imgs.imgs)
+        elif kind == 'exception':
+            self.errors += 1
+
+    async def get(self, url):
+        """メディア（画像・ダウンロードファイル）を取得"""
+        def fetch():
+            with urllib.request.urlopen(urljoin(self.base_url + '/', url.lstrip('/')), timeout=60) as res:
+                return len(res.read())
+        return await asyncio.to_thread(fetch)
+
+    def set_option(self, label, option):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        kind, proto = self.widgets[label]
+        state = WidgetState(id=proto.id)
+        if self.string_options:
+            state.string_value = option
+        else:
+            state.int_value = list(proto.options).index(option)
+        self.states[proto.id] = state
+        self.choices[label] = option
+
+    def set_slider(self, label, value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        _, proto = self.widgets[label]
+        state = WidgetState(id=proto.id)
+        state.double_array_value.data.append(value)
+        self.states[proto.id] = state
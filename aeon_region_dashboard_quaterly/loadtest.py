@@ -0,0 +1,206 @@
+"""同時セッション負荷試験ツール
+
+ローカルで app.py を Streamlit サーバーとして起動し、N 個の同時セッションで
+実際の操作列（表示四半期数スライダー、表示モード切替、地域選択、HTMLダウンロード）を再現する。
+スループット・操作別レイテンシ分位点・サーバープロセスのメモリ増加を報告する。
+
+起動:
+    python loadtest.py --sessions 8 --steps 20
+    python loadtest.py --url http://127.0.0.1:8501 --pid 12345   # 起動済みサーバーに対して実行
+
+メモリ増加が --max-rss-growth（MB/100リラン）を超えると終了コード 1 を返すため、
+Figure の閉じ忘れなどのリーク検知に CI で使える。
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import numpy as np
+
+from headless import APP_PATH, Session, free_port, start_server
+
+# 操作の出現比率（スライダー, 表示モード, 地域選択, ダウンロード）
+ACTION_WEIGHTS = {'slider': 0.4, 'mode': 0.2, 'region': 0.25, 'download': 0.15}
+
+
+# --- 1. メモリ計測 ---
+def rss_mb(pid):
+    """プロセスの常駐メモリ（MB）。取得できない場合は None"""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / 2 ** 20
+    except ImportError:
+        pass
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+# --- 2. 操作シナリオ ---
+async def perform(session, action, rng):
+    """1操作を実行し、(実際に行った操作名, 経過秒) を返す"""
+    if action == 'slider' and '表示四半期数' not in session.widgets:
+        action = 'mode'  # 年度指定モード中はスライダーがないので先に切り替える
+    start = time.perf_counter()
+    if action == 'slider':
+        _, proto = session.widgets['表示四半期数']
+        session.set_slider('表示四半期数', float(rng.randint(int(proto.min), int(proto.max))))
+        await session.rerun()
+    elif action == 'mode':
+        _, proto = session.widgets['表示モード']
+        options = list(proto.options)
+        current = session.choices.get('表示モード', options[proto.default])
+        session.set_option('表示モード', rng.choice([o for o in options if o != current] or options))
+        await session.rerun()
+    elif action == 'region':
+        _, proto = session.widgets['地域を選択']
+        session.set_option('地域を選択', rng.choice(list(proto.options)))
+        await session.rerun()
+    elif action == 'download' and session.downloads:
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        button = rng.choice(session.downloads)
+        await session.get(button.url)
+        # クリックはダウンロードと同時にスクリプトの再実行を起こす
+        await session.rerun(trigger=WidgetState(id=button.id, trigger_value=True))
+    return action, time.perf_counter() - start
+
+async def run_session(base_url, steps, think, seed, samples, fetch_images):
+    rng = random.Random(seed)
+    session = Session(base_url, fetch_images)
+    await session.connect()
+    try:
+        start = time.perf_counter()
+        await session.rerun()
+        samples.append(('initial_load', time.perf_counter() - start))
+        actions, weights = zip(*ACTION_WEIGHTS.items())
+        for _ in range(steps):
+            if think > 0:
+                await asyncio.sleep(rng.uniform(0, think))
+            samples.append(await perform(session, rng.choices(actions, weights)[0], rng))
+    finally:
+        await session.close()
+    return session.errors
+
+async def sample_memory(pid, interval, rss_samples, stop):
+    while not stop.is_set():
+        value = rss_mb(pid)
+        if value is not None:
+            rss_samples.append(value)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+# --- 3. 集計・レポート ---
+def summarize(samples, elapsed, rss_before, rss_after, rss_samples, errors):
+    by_action = {}
+    for action, seconds in samples:
+        by_action.setdefault(action, []).append(seconds * 1000)
+    latency = {}
+    for action, values in sorted(by_action.items()):
+        arr = np.array(values)
+        latency[action] = {
+            'count': len(arr),
+            **{f"p{p}": float(np.percentile(arr, p)) for p in (50, 90, 95, 99)},
+            'max': float(arr.max()),
+        }
+    reruns = len(samples)
+    report = {
+        'requests': reruns,
+        'errors': errors,
+        'elapsed_s': elapsed,
+        'throughput_rps': reruns / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': latency,
+    }
+    if rss_before is not None and rss_after is not None:
+        report['rss_mb'] = {
+            'before': rss_before,
+            'after': rss_after,
+            'peak': max(rss_samples) if rss_samples else rss_after,
+            'growth': rss_after - rss_before,
+            'growth_per_100_reruns': (rss_after - rss_before) / reruns * 100 if reruns else 0.0,
+        }
+    return report
+
+def print_report(report, sessions):
+    print(f"sessions={sessions} requests={report['requests']} errors={report['errors']} "
+          f"elapsed={report['elapsed_s']:.1f}s throughput={report['throughput_rps']:.2f} req/s")
+    print(f"{'action':<14}{'count':>7}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    for action, s in report['latency_ms'].items():
+        print(f"{action:<14}{s['count']:>7}{s['p50']:>9.0f}{s['p90']:>9.0f}{s['p95']:>9.0f}{s['p99']:>9.0f}{s['max']:>9.0f}")
+    if 'rss_mb' in report:
+        m = report['rss_mb']
+        print(f"server RSS: {m['before']:.0f} MB → {m['after']:.0f} MB (peak {m['peak']:.0f} MB, "
+              f"+{m['growth']:.1f} MB, {m['growth_per_100_reruns']:+.2f} MB/100 reruns)")
+
+async def run_load_test(base_url, pid, sessions, steps, think, seed, fetch_images):
+    # 1セッション分のウォームアップ後のメモリを基準とする（初回のデータ読み込み・キャッシュを除外）
+    await run_session(base_url, 0, 0, seed, [], fetch_images)
+    rss_before = rss_mb(pid) if pid else None
+    samples, rss_samples = [], []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_memory(pid, 0.5, rss_samples, stop)) if pid else None
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(
+        run_session(base_url, steps, think, seed + i, samples, fetch_images) for i in range(sessions)
+    ))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    if sampler is not None:
+        await sampler
+    rss_after = rss_mb(pid) if pid else None
+    return summarize(samples, elapsed, rss_before, rss_after, rss_samples, sum(errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ダッシュボードの同時セッション負荷試験")
+    parser.add_argument('--sessions', type=int, default=8, help="同時セッション数")
+    parser.add_argument('--steps', type=int, default=20, help="セッションあたりの操作数")
+    parser.add_argument('--think', type=float, default=0.5, help="操作間の最大待ち時間（秒）")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help="起動済みサーバーの URL（省略時はローカルに起動）")
+    parser.add_argument('--pid', type=int, help="--url 指定時にメモリを計測するサーバーの PID")
+    parser.add_argument('--app', default=APP_PATH, help="起動する Streamlit アプリ")
+    parser.add_argument('--no-images', action='store_true', help="チャート画像を取得しない")
+    parser.add_argument('--json', help="結果を JSON で保存するパス")
+    parser.add_argument('--max-rss-growth', type=float,
+                        help="許容するメモリ増加（MB/100リラン）。超えると終了コード 1")
+    args = parser.parse_args()
+
+    proc = None
+    if args.url:
+        base_url, pid = args.url.rstrip('/'), args.pid
+    else:
+        proc, base_url = start_server(free_port(), args.app)
+        pid = proc.pid
+    try:
+        report = asyncio.run(run_load_test(
+            base_url, pid, args.sessions, args.steps, args.think, args.seed, not args.no_images
+        ))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    print_report(report, args.sessions)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.max_rss_growth is not None and 'rss_mb' in report:
+        if report['rss_mb']['growth_per_100_reruns'] > args.max_rss_growth:
+            print(f"RSS growth exceeds {args.max_rss_growth} MB/100 reruns")
+            return 1
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,440 @@
+"""ダッシュボードの静的サイト事前生成
+
+代表的な表示条件（直近4/8/12/全四半期・各年度 × 各地域）について全タブを静的 HTML に書き出す。
+Python プロセスなしで配信できるよう、画像は assets/img/ に内容ハッシュ名で共有保存する。
+
+起動:
+    python prerender.py --out site --workers 4
+
+差分ビルド:
+    タブ単位の描画結果（フラグメント）を「入力データ＋表示条件＋描画コード」のハッシュで保存し、
+    ハッシュが変わったフラグメントだけを再描画する。入力の同じタブ（季節性分析など）は
+    表示条件をまたいで共有される。異常値・季節調整の重ね表示は全期間のデータから求めるため、
+    表示範囲の重ね表示の値も入力に含める。
+"""
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from urllib.parse import quote
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+import analytics
+import charts
+from entities import EntityRegistry, prepare_display
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_PATH = os.path.join(BASE_DIR, "data", "region_data.xlsx")
+ENTITIES_PATH = os.path.join(BASE_DIR, "data", "entities.json")
+# ダッシュボードと共通の他社データ・スナップショットの置き場所（app.py と同じ）
+METRICS_PATH = os.path.join(BASE_DIR, "data", "metrics.json")
+COMPANIES_DIR = os.path.join(BASE_DIR, "data", "companies")
+VERSIONS_DIR = os.path.join(BASE_DIR, "data", "versions")
+SNAPSHOTS_DIR = os.path.join(BASE_DIR, "data", "snapshots")
+VERSION_SNAPSHOTS_DIR = os.path.join(SNAPSHOTS_DIR, "versions")
+DEFAULT_COMPANY = "イオン"
+TITLE = "🌏 イオン 地域別業績分析ダッシュボード（四半期）"
+RECENT_RANGES = [4, 8, 12]
+# app.py のタブと同じ ID・ラベル・並び順（データのない任意タブはページに含めない）
+TABS = [
+    ('overview', "📊 全体概要"),
+    ('composition', "📈 構成比推移"),
+    ('margin', "💹 利益率推移"),
+    ('yoy', "🚀 前年同期比"),
+    ('seasonal', "📅 季節性分析"),
+    ('forecast', "🔮 業績予測"),
+    ('correlation', "🧮 相関分析"),
+    ('derived', "🧪 カスタム指標"),
+    ('compare', "⚖️ 期間比較"),
+    ('capex', "🏗️ 設備投資"),
+    ('fx', "💱 為替シナリオ"),
+    ('company', "🏢 企業比較"),
+    ('restatement', "🧾 修正差分"),
+    ('detail', "🔍 地域詳細"),
+]
+ALL_PERIOD_TABS = ('seasonal', 'correlation', 'compare', 'restatement')  # 表示範囲に依存しないタブ
+FC_HORIZON = 8
+SITE_CSS = charts.REPORT_CSS + """
+        h1 { color: #2C3E50; font-size: 24px; }
+        nav { margin: 10px 0; font-size: 14px; }
+        nav a { display: inline-block; margin: 2px 6px 2px 0; padding: 4px 10px; border-radius: 4px; background: #eef3f8; color: #1f77b4; text-decoration: none; }
+        nav a.active { background: #1f77b4; color: white; }
+        section { margin-top: 40px; }
+        .chart { text-align: center; margin: 20px 0; }
+        .chart img { max-width: 100%; }
+"""
+
+
+# --- 1. データと表示条件 ---
+@lru_cache(maxsize=1)
+def load_company_store(path=DATA_PATH):
+    """ダッシュボードと同じスナップショットをメモリマップで開く（プロセスごとに1回。なければ解析して書き出す）"""
+    paths = analytics.company_paths(path, COMPANIES_DIR, DEFAULT_COMPANY)
+    return analytics.open_store_snapshot(
+        os.path.join(SNAPSHOTS_DIR, analytics.snapshot_key(analytics.files_version(paths))),
+        lambda: analytics.build_store_from_files(paths, pd.read_excel))
+
+@lru_cache(maxsize=1)
+def load_data(path=DATA_PATH):
+    """データ読み込み（プロセスごとに1回）。返り値: (合算前データ, 表示用データ)"""
+    df = load_company_store(path).company_data(DEFAULT_COMPANY)
+    return df, prepare_display(df, EntityRegistry.load(ENTITIES_PATH))
+
+@lru_cache(maxsize=1)
+def load_metric_store(path=DATA_PATH):
+    """表示用データの指標ストア（プロセスごとに1回）"""
+    _, display = load_data(path)
+    return analytics.build_metric_store(display.df, display.series)
+
+# 指標ストアから全期間・全地域を一括で求める集計（app.py の load_* と同じ）
+ANALYSES = {
+    'forecasts': lambda store: analytics.fit_forecasts(store, horizon=FC_HORIZON),
+    'correlations': analytics.compute_correlations,
+    'contributions': analytics.growth_contributions,
+    'cumulative': analytics.build_cumulative_index,
+    'anomalies': analytics.detect_anomalies,
+    'decomposition': analytics.decompose_store,
+}
+
+@lru_cache(maxsize=None)
+def load_analysis(name, path=DATA_PATH):
+    """集計結果（プロセスごと・集計ごとに1回）"""
+    return ANALYSES[name](load_metric_store(path))
+
+@lru_cache(maxsize=1)
+def load_capex(path=DATA_PATH):
+    """設備投資指標（設備投資列がなければ None）"""
+    annual = load_company_store(path).company_annual(DEFAULT_COMPANY)
+    if annual is None:
+        return None
+    _, display = load_data(path)
+    return analytics.compute_capex_metrics(analytics.fold_entities(annual, display.mapping), list(display.series))
+
+def derived_metrics():
+    """カスタム指標タブの登録済みの派生指標"""
+    return analytics.load_derived_metrics(METRICS_PATH) or [analytics.DEFAULT_DERIVED]
+
+def saved_versions():
+    """ダッシュボードが保存したデータのバージョン（古い順）。保存はダッシュボードが行い、ここでは読むのみ"""
+    return list(analytics.list_versions(os.path.join(VERSIONS_DIR, DEFAULT_COMPANY)))
+
+def load_version_diff(old_version, new_version):
+    """直前と最新のバージョンの差分（app.py の load_version_diff と同じ。バージョンごとのスナップショットを共有）"""
+    archive = os.path.join(VERSIONS_DIR, DEFAULT_COMPANY)
+    old, new = (analytics.open_store_snapshot(
+        os.path.join(VERSION_SNAPSHOTS_DIR, DEFAULT_COMPANY, version),
+        lambda: analytics.build_store_from_files({DEFAULT_COMPANY: analytics.list_versions(archive)[version]},
+                                                 pd.read_excel),
+    ).company_data(DEFAULT_COMPANY) for version in (old_version, new_version))
+    weights = new.groupby('地域')['営業収益'].sum().to_dict()
+    entities = EntityRegistry.load(ENTITIES_PATH).order(set(old['地域']) | set(new['地域']), weights)
+    metrics = list(analytics.DIFF_METRICS)
+    return analytics.diff_stores(analytics.build_metric_store(old, entities, metrics=metrics),
+                                 analytics.build_metric_store(new, entities, metrics=metrics))
+
+def available_tabs(path=DATA_PATH):
+    """ページに載せるタブ（任意タブはダッシュボードと同じくデータがある場合のみ）"""
+    _, display = load_data(path)
+    available = {
+        'capex': load_capex(path) is not None,
+        'fx': bool(display.currencies),
+        'company': len(load_company_store(path).companies) > 1,
+        'restatement': len(saved_versions()) > 1,
+    }
+    return [(tab, label) for tab, label in TABS if available.get(tab, True)]
+
+def filter_states(quarters):
+    """事前生成する表示範囲 (ID, ラベル, 四半期リスト) の一覧"""
+    states = [(f"last{n}", f"直近{n}四半期", quarters[-n:]) for n in RECENT_RANGES if n <= len(quarters)]
+    states.append(("all", f"直近{len(quarters)}四半期（全期間）", list(quarters)))
+    for fy in sorted({q.split('-')[0] for q in quarters}):
+        states.append((fy, f"{fy}年度", [q for q in quarters if q.startswith(fy)]))
+    return states
+
+def code_version():
+    """描画コードのハッシュ（コード変更時は全フラグメントを再生成）"""
+    digest = hashlib.sha1()
+    for name in ('analytics.py', 'charts.py', 'entities.py', 'prerender.py', ENTITIES_PATH, METRICS_PATH):
+        path = os.path.join(BASE_DIR, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+def rows_fingerprint(df):
+    """データ行の内容ハッシュ"""
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()
+
+def overlay_fingerprint(quarters, path=DATA_PATH):
+    """表示範囲の異常値フラグ・季節調整済み系列のハッシュ（全期間から求めるため、範囲外の行の変更でも変わりうる）"""
+    anomalies, decomposition = load_analysis('anomalies', path), load_analysis('decomposition', path)
+    rows = [anomalies.quarters.index(q) for q in quarters]
+    digest = hashlib.sha1()
+    for values in (anomalies.zscore, decomposition.trend, decomposition.seasonal):
+        digest.update(np.ascontiguousarray(values[:, rows]).tobytes())
+    return digest.hexdigest()
+
+
+# --- 2. 描画単位（フラグメント） ---
+def plan_units(df_raw, display, quarters, states, tabs, version, path=DATA_PATH):
+    """各ページに必要なフラグメントを列挙。返り値: (ページ → フラグメントキー一覧, キー → 描画指示)"""
+    df = display.df
+    all_rows = rows_fingerprint(df)
+    pages, units = {}, {}
+
+    def unit(tab, state_quarters, rows, region=None):
+        key = hashlib.sha1(json.dumps(
+            [version, tab, state_quarters, rows, region], ensure_ascii=False
+        ).encode('utf-8')).hexdigest()[:24]
+        units[key] = (tab, state_quarters, region)
+        return key
+
+    # 表示範囲に依存しないタブは全ページで共有
+    inputs = {
+        'seasonal': all_rows,
+        'correlation': all_rows,
+        'compare': all_rows,
+        'restatement': saved_versions()[-2:],
+    }
+    if any(tab == 'company' for tab, _ in tabs):
+        inputs['company'] = rows_fingerprint(load_company_store(path).data)
+    if any(tab == 'capex' for tab, _ in tabs):
+        inputs['capex'] = rows_fingerprint(load_company_store(path).annual)
+    for state_id, _, state_quarters in states:
+        # 前年同期比は表示範囲の4四半期前までを参照する。異常値・季節調整の重ね表示は全期間から求める
+        first = quarters.index(state_quarters[0])
+        with_prior = quarters[max(0, first - 4):quarters.index(state_quarters[-1]) + 1]
+        selected = [rows_fingerprint(df[df['決算年度'].isin(state_quarters)]), overlay_fingerprint(state_quarters, path)]
+        prior = [rows_fingerprint(df[df['決算年度'].isin(with_prior)]), overlay_fingerprint(with_prior, path)]
+        shared = []
+        for tab, _ in tabs:
+            if tab in ALL_PERIOD_TABS:
+                shared.append(unit(tab, None, inputs[tab]))
+            elif tab in ('overview', 'composition', 'margin'):
+                shared.append(unit(tab, state_quarters, selected))
+            elif tab == 'yoy':
+                shared.append(unit(tab, state_quarters, prior))
+            elif tab == 'forecast':
+                # 予測タブは表示四半期数のみに依存
+                shared.append(unit(tab, len(state_quarters), all_rows))
+            elif tab in ('derived', 'fx'):
+                # 派生指標の式・為替シナリオは表示範囲外の四半期も参照しうる
+                shared.append(unit(tab, state_quarters, [all_rows, rows_fingerprint(df_raw)]))
+            elif tab in ('capex', 'company'):
+                shared.append(unit(tab, state_quarters, inputs[tab]))
+        for region in display.entities:
+            region_rows = rows_fingerprint(df_raw[(df_raw['地域'] == region) & df_raw['決算年度'].isin(with_prior)])
+            pages[(state_id, region)] = shared + [unit('detail', state_quarters, prior + [region_rows], region)]
+    return pages, units
+
+def build_views(data_path, tab, state_quarters, region):
+    """描画指示から ReportView の一覧を生成（app.py の build_views と同じ図表。タブ内の選択肢は主なものを全て）"""
+    df_raw, display = load_data(data_path)
+    df = display.df
+    all_quarters = sorted(df['決算年度'].unique(), key=analytics.sort_quarter_key)
+    if tab in ALL_PERIOD_TABS:
+        state_quarters = all_quarters
+    elif tab == 'forecast':
+        state_quarters = all_quarters[-state_quarters:]
+    anomalies = load_analysis('anomalies', data_path)
+    ctx = charts.ViewContext(df, state_quarters, display.series, display.colors,
+                             anomalies, load_analysis('decomposition', data_path))
+    if tab == 'overview':
+        views = charts.overview_views(ctx) + [charts.anomaly_view(ctx)]
+    elif tab == 'composition':
+        views = charts.composition_views(ctx)
+    elif tab == 'margin':
+        views = charts.margin_views(ctx)
+    elif tab == 'yoy':
+        contributions = load_analysis('contributions', data_path)
+        views = charts.yoy_views(ctx) + [charts.contribution_view(ctx, contributions, metric)
+                                         for metric in analytics.AMOUNT_COLS]
+    elif tab == 'seasonal':
+        views = charts.seasonal_views(ctx) + charts.decomposition_views(ctx)
+    elif tab == 'forecast':
+        store, forecasts = load_metric_store(data_path), load_analysis('forecasts', data_path)
+        views = [charts.forecast_view(ctx, store, forecasts, metric, 'Holt-Winters', FC_HORIZON)
+                 for metric in ('営業収益', '営業利益')]
+    elif tab == 'correlation':
+        correlations = load_analysis('correlations', data_path)
+        views = ([charts.correlation_view(ctx, correlations, target)
+                  for target in ('営業収益 前年同期比', '営業利益 前年同期比', '営業利益率')]
+                 + [charts.seasonal_index_view(ctx, correlations)])
+    elif tab == 'derived':
+        store = load_metric_store(data_path)
+        views = [charts.derived_metric_view(ctx, analytics.evaluate_expression(store, metric.expression), metric)
+                 for metric in derived_metrics()]
+    elif tab == 'compare':
+        cumulative = load_analysis('cumulative', data_path)
+        base_first, base_last, target_first, target_last = analytics.default_comparison(cumulative.quarters)
+        views = [charts.period_comparison_view(
+            ctx, analytics.compare_periods(cumulative, (base_first, base_last), (target_first, target_last)))]
+    elif tab == 'capex':
+        capex = load_capex(data_path)
+        views = [charts.capex_view(ctx, capex, metric) for metric in analytics.CAPEX_METRICS]
+    elif tab == 'company':
+        company_store = load_company_store(data_path)
+        comparison = analytics.compare_companies(company_store)
+        colors = EntityRegistry().colors(company_store.companies)
+        views = [charts.company_comparison_view(ctx, comparison, metric, colors) for metric in charts.COMPARISON_UNITS]
+    elif tab == 'fx':
+        # 為替シナリオは合算前の全地域で計算し、実績（変動なし）を表示
+        detail_ctx = charts.ViewContext(df_raw, state_quarters, display.entities, display.colors)
+        store = analytics.build_metric_store(df_raw, display.entities, metrics=analytics.AMOUNT_COLS)
+        scenarios = analytics.fx_scenarios(store, display.currencies, analytics.FX_GRID)
+        views = [charts.fx_scenario_view(detail_ctx, scenarios, (0,) * len(scenarios.currencies))]
+    elif tab == 'restatement':
+        diff = load_version_diff(*saved_versions()[-2:])
+        views = [charts.restatement_view(ctx, diff, metric) for metric in analytics.DIFF_METRICS]
+    elif tab == 'detail':
+        # 地域詳細は合算前のデータで表示（異常値のマーカーは合算後の系列にある地域のみ）
+        detail_ctx = charts.ViewContext(df_raw, state_quarters, display.entities, display.colors, anomalies)
+        views = [charts.region_detail_view(detail_ctx, region)]
+    else:
+        raise ValueError(f"unknown tab: {tab}")
+    return [v for v in views if v is not None]
+
+def render_unit(out_dir, data_path, key, tab, state_quarters, region):
+    """フラグメントを描画して保存（ワーカープロセスで実行）。返り値: 参照画像名の一覧"""
+    images, parts = [], []
+    for i, view in enumerate(build_views(data_path, tab, state_quarters, region)):
+        image, mime = charts.render_figure(view.fig, 'site')
+        name = f"{hashlib.sha1(image).hexdigest()[:24]}.{charts.IMAGE_EXTENSIONS[mime]}"
+        path = os.path.join(out_dir, 'assets', 'img', name)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(image)
+        images.append(name)
+        parts.append(f'<h3>{view.title}</h3>')
+        parts.append(f'<div class="chart"><img src="../assets/img/{name}" alt="{view.title}" loading="lazy"/></div>')
+        for j, block in enumerate(view.tables):
+            parts.append(f'<h4>{block.title}</h4>')
+            parts.append(block.styler().set_uuid(f"{key[:8]}_{i}_{j}").to_html())
+    with open(os.path.join(out_dir, 'fragments', f'{key}.html'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(parts))
+    return images
+
+def _init_worker():
+    font_name = charts.setup_font()
+    matplotlib.rcParams['axes.unicode_minus'] = False
+    sns.set_theme(style="whitegrid", rc={"font.family": font_name})
+
+
+# --- 3. ページ組み立て ---
+def page_path(state_id, region):
+    return f"{state_id}/{region}.html"
+
+def nav_link(href, label, active=False):
+    css = ' class="active"' if active else ''
+    return f'<a href="{quote(href)}"{css}>{label}</a>'
+
+def render_page(out_dir, state, region, states, regions, tabs, fragment_keys):
+    """1つの表示条件のページを組み立て（フラグメントの連結のみ）"""
+    state_id, state_label, _ = state
+    range_nav = ' '.join(nav_link(f"../{page_path(sid, region)}", label, sid == state_id)
+                         for sid, label, _ in states)
+    region_nav = ' '.join(nav_link(f"../{page_path(state_id, r)}", r, r == region) for r in regions)
+    tab_nav = ' '.join(f'<a href="#{tab}">{label}</a>' for tab, label in tabs)
+    sections = []
+    for (tab, label), key in zip(tabs, fragment_keys):
+        with open(os.path.join(out_dir, 'fragments', f'{key}.html'), encoding='utf-8') as f:
+            sections.append(f'<section id="{tab}"><h2>{label}</h2>\n{f.read()}\n</section>')
+    return f"""<!DOCTYPE html>
+<html lang="ja"><head><meta charset="utf-8">
+<title>{TITLE} - {state_label} / {region}</title>
+<link rel="stylesheet" href="../assets/style.css"></head>
+<body><div class="container">
+<h1>{TITLE}</h1>
+<nav>表示範囲: {range_nav}</nav>
+<nav>地域詳細: {region_nav}</nav>
+<nav>{tab_nav}</nav>
+{''.join(sections)}
+<p class="timestamp">事前生成ページ（{state_label} / {region}）</p>
+</div></body></html>
+"""
+
+def write_if_changed(path, content):
+    """内容が変わった場合のみ書き込み。書き込んだら True"""
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            if f.read() == content:
+                return False
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return True
+
+
+def build_site(out_dir, workers=None, data_path=DATA_PATH):
+    """静的サイトを生成（差分ビルド）。返り値: (再描画フラグメント数, 更新ページ数)"""
+    for sub in ('assets/img', 'fragments'):
+        os.makedirs(os.path.join(out_dir, sub), exist_ok=True)
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    df, display = load_data(data_path)
+    regions = display.entities
+    quarters = sorted(df['決算年度'].unique(), key=analytics.sort_quarter_key)
+    states = filter_states(quarters)
+    tabs = available_tabs(data_path)
+    pages, units = plan_units(df, display, quarters, states, tabs, code_version(), data_path)
+
+    # 入力が変わったフラグメントのみ並列に再描画
+    stale = {k: v for k, v in units.items()
+             if k not in manifest or not os.path.exists(os.path.join(out_dir, 'fragments', f'{k}.html'))}
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = {k: pool.submit(render_unit, out_dir, data_path, k, *v) for k, v in stale.items()}
+            for k, future in futures.items():
+                manifest[k] = future.result()
+
+    write_if_changed(os.path.join(out_dir, 'assets', 'style.css'), SITE_CSS)
+    updated = 0
+    for state in states:
+        os.makedirs(os.path.join(out_dir, state[0]), exist_ok=True)
+        for region in regions:
+            html = render_page(out_dir, state, region, states, regions, tabs, pages[(state[0], region)])
+            updated += write_if_changed(os.path.join(out_dir, page_path(state[0], region)), html)
+    links = '\n'.join(
+        f'<li>{label}: ' + ' '.join(nav_link(page_path(sid, r), r) for r in regions) + '</li>'
+        for sid, label, _ in states
+    )
+    write_if_changed(os.path.join(out_dir, 'index.html'), f"""<!DOCTYPE html>
+<html lang="ja"><head><meta charset="utf-8"><title>{TITLE}</title>
+<link rel="stylesheet" href="assets/style.css"></head>
+<body><div class="container"><h1>{TITLE}</h1><ul>
+{links}
+</ul></div></body></html>
+""")
+
+    # 使われなくなったフラグメント・画像を削除
+    manifest = {k: v for k, v in manifest.items() if k in units}
+    used_images = {name for names in manifest.values() for name in names}
+    for name in os.listdir(os.path.join(out_dir, 'fragments')):
+        if name[:-len('.html')] not in manifest:
+            os.remove(os.path.join(out_dir, 'fragments', name))
+    for name in os.listdir(os.path.join(out_dir, 'assets', 'img')):
+        if name not in used_images:
+            os.remove(os.path.join(out_dir, 'assets', 'img', name))
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return len(stale), updated
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="ダッシュボードの静的サイト事前生成")
+    parser.add_argument('--out', default=os.path.join(BASE_DIR, 'site'), help="出力ディレクトリ")
+    parser.add_argument('--workers', type=int, default=None, help="並列プロセス数（既定: CPU数）")
+    parser.add_argument('--data', default=DATA_PATH, help="region_data.xlsx のパス")
+    args = parser.parse_args()
+    rendered, updated = build_site(args.out, args.workers, args.data)
+    print(f"rendered fragments: {rendered}, updated pages: {updated} → {args.out}")
@@ -0,0 +1,96 @@
+"""本番起動用ランチャー（キャッシュのウォームアップと準備完了シグナル）
+
+Streamlit サーバーを起動し、既定の表示条件（直近12四半期・先頭の地域）を
+ヘッドレスのセッションで1回描画して、データ・集計・図表・HTMLレポートのキャッシュを温める。
+準備完了エンドポイントはウォームアップが終わるまで 503 を返すため、ロードバランサーの
+ヘルスチェックをこちらに向ければ、ウォームアップ前のレプリカにユーザーが振り分けられない。
+
+起動:
+    python serve.py --port 8501 --ready-port 8502
+
+エンドポイント（--ready-port）:
+    GET /ready   ウォームアップ完了後 200、それまでは 503
+    GET /live    Streamlit サーバーが応答していれば 200
+"""
+import argparse
+import asyncio
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from headless import APP_PATH, Session, is_healthy, start_server
+
+
+class ReadinessHandler(BaseHTTPRequestHandler):
+    state = {'ready': False, 'url': None}  # main() で更新
+
+    def do_GET(self):
+        if self.path == '/ready':
+            ok = self.state['ready']
+        elif self.path == '/live':
+            ok = self.state['url'] is not None and is_healthy(self.state['url'])
+        else:
+            self.send_error(404)
+            return
+        body = b'ok' if ok else b'not ready'
+        self.send_response(200 if ok else 503)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # ヘルスチェックのアクセスログは出さない
+
+
+async def warm_up(base_url):
+    """既定の表示条件で1回スクリプトを実行し、キャッシュを温める。返り値: 例外の件数"""
+    session = Session(base_url, fetch_images=False)
+    await session.connect()
+    try:
+        await session.rerun()
+    finally:
+        await session.close()
+    return session.errors
+
+def serve_readiness(host, port):
+    server = ThreadingHTTPServer((host, port), ReadinessHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="キャッシュをウォームアップしてからダッシュボードを公開")
+    parser.add_argument('--port', type=int, default=8501, help="Streamlit のポート")
+    parser.add_argument('--ready-host', default='0.0.0.0')
+    parser.add_argument('--ready-port', type=int, default=8502, help="準備完了エンドポイントのポート")
+    parser.add_argument('--app', default=APP_PATH, help="起動する Streamlit アプリ")
+    parser.add_argument('--startup-timeout', type=float, default=120, help="サーバー起動待ちの上限（秒）")
+    args, streamlit_args = parser.parse_known_args()
+
+    readiness = serve_readiness(args.ready_host, args.ready_port)
+    proc, url = start_server(args.port, args.app, args.startup_timeout, streamlit_args, quiet=False)
+    ReadinessHandler.state['url'] = url
+    signal.signal(signal.SIGTERM, lambda *_: proc.terminate())
+
+    start = time.perf_counter()
+    errors = asyncio.run(warm_up(url))
+    if errors:
+        # 既定の表示でエラーになるレプリカには振り分けさせない
+        print(f"warm-up failed: {errors} exception(s) in the default view", file=sys.stderr)
+        proc.terminate()
+        proc.wait()
+        readiness.shutdown()
+        return 1
+    ReadinessHandler.state['ready'] = True
+    print(f"warm-up finished in {time.perf_counter() - start:.1f}s; ready on :{args.ready_port}/ready")
+
+    code = proc.wait()
+    readiness.shutdown()
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
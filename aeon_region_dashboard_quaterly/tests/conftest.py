@@ -0,0 +1,29 @@
+"""テスト共通: アプリのモジュールを import できるようにし、合成データの指標ストアを作る"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics  # noqa: E402
+
+
+def quarter_labels(first_year, n, first_quarter=1):
+    """FY<年>-<n>Q 形式の連続した四半期ラベル"""
+    start = first_quarter - 1
+    return [f"FY{first_year + (start + i) // 4}-{(start + i) % 4 + 1}Q" for i in range(n)]
+
+
+@pytest.fixture
+def make_store():
+    """指標名 → (四半期数, エンティティ数) の配列から MetricStore を作る"""
+    def make(values, first_year=2019, first_quarter=1):
+        n_quarters, n_entities = next(iter(values.values())).shape
+        return analytics.MetricStore(
+            quarters=quarter_labels(first_year, n_quarters, first_quarter),
+            entities=[f"E{i}" for i in range(n_entities)],
+            values={metric: np.asarray(v, dtype=float) for metric, v in values.items()},
+        )
+    return make
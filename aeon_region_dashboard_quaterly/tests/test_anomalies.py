@@ -0,0 +1,31 @@
+"""異常値検出: 傾向のない両端の四半期（最新四半期を含む）も判定できること"""
+import numpy as np
+import pytest
+
+import analytics
+
+
+def seasonal_revenue(n_quarters=20, n_entities=3, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_quarters)[:, None]
+    pattern = np.array([10.0, -4.0, 2.0, -8.0])[t % analytics.SEASON_LENGTH]
+    return 500 + 5 * t + pattern + rng.normal(0, 1, (n_quarters, n_entities))
+
+
+@pytest.mark.parametrize('row', [-1, -2, 0])
+def test_spike_at_series_end_is_flagged(make_store, row):
+    revenue = seasonal_revenue()
+    revenue[row, 1] += 80
+    anomalies = analytics.detect_anomalies(make_store({'営業収益': revenue}))
+    flags = anomalies.mask('営業収益')
+    z = anomalies.zscore[0, :, 1]
+    assert flags.iloc[row, 1]
+    assert z[row] > anomalies.threshold and np.nanargmax(np.abs(z)) == row % len(z)
+    # 他の系列には影響しない（急変の前後は傾向の推定に含まれるため、同じ系列の隣接期は問わない）
+    assert not flags[['E0', 'E2']].to_numpy().any()
+
+
+def test_clean_series_has_no_flags(make_store):
+    anomalies = analytics.detect_anomalies(make_store({'営業収益': seasonal_revenue(seed=1)}))
+    assert not anomalies.flags.any()
+    assert np.isfinite(anomalies.zscore).all()
@@ -0,0 +1,54 @@
+"""API サーバー: クエリの解釈と、ダッシュボードと同じスナップショットからの読み込み"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import api_server
+
+
+
+@pytest.fixture
+def store(make_store):
+    return make_store({'営業収益': np.arange(24, dtype=float).reshape(8, 3)})
+
+
+def test_regions_are_parsed_in_order(store):
+    *_, regions, fmt = api_server.parse_query('regions=E2, E0', store)
+    assert regions == ('E2', 'E0')
+    assert fmt == 'json'
+
+
+def test_omitted_regions_select_all(store):
+    for query in ('', 'regions='):
+        *_, regions, _ = api_server.parse_query(query, store)
+        assert regions == ('E0', 'E1', 'E2')
+
+
+@pytest.mark.parametrize('query', ['regions=,', 'regions=%2C%20%2C', 'regions=%20'])
+def test_empty_region_list_is_rejected(store, query):
+    with pytest.raises(api_server.BadRequest, match="no regions specified"):
+        api_server.parse_query(query, store)
+
+
+def test_unknown_region_is_rejected(store):
+    with pytest.raises(api_server.BadRequest, match="unknown regions: X"):
+        api_server.parse_query('regions=E0,X', store)
+
+
+@pytest.mark.skipif(not os.path.exists(api_server.DATA_PATH), reason="data file not found")
+def test_repository_attaches_shared_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(api_server, 'SNAPSHOTS_DIR', str(tmp_path))
+    version, store, views = api_server.MetricsRepository().snapshot()
+    assert len(os.listdir(tmp_path)) == 1
+
+    # 2つ目のプロセス相当: スナップショットを開くだけで、データファイルは解析しない
+    def read_excel(*args, **kwargs):
+        raise AssertionError("data file parsed again")
+    monkeypatch.setattr(pd, 'read_excel', read_excel)
+    attached_version, attached_store, attached_views = api_server.MetricsRepository().snapshot()
+    assert attached_version == version
+    assert attached_store.entities == store.entities
+    for name, frame in views.items():
+        pd.testing.assert_frame_equal(attached_views[name], frame)
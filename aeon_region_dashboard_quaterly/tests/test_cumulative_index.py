@@ -0,0 +1,64 @@
+"""累積和インデックス: 差1回で求めた累計・半期・区間合計が groupby による集計と一致すること"""
+import numpy as np
+import pandas as pd
+
+import analytics
+
+
+def amounts(n_quarters, n_entities=3, seed=0):
+    rng = np.random.default_rng(seed)
+    return {'営業収益': rng.uniform(100, 500, (n_quarters, n_entities)),
+            '営業利益': rng.uniform(-20, 60, (n_quarters, n_entities))}
+
+
+def fiscal_year(frame):
+    return frame.index.str.split('-').str[0]
+
+
+def test_ytd_matches_groupby_cumsum(make_store):
+    store = make_store(amounts(12))
+    index = analytics.build_cumulative_index(store)
+    for metric in index.metrics:
+        frame = store.frame(metric)
+        pd.testing.assert_frame_equal(index.ytd(metric), frame.groupby(fiscal_year(frame)).cumsum())
+
+
+def test_halves_match_groupby_sum(make_store):
+    store = make_store(amounts(12, seed=1))
+    index = analytics.build_cumulative_index(store)
+    frame = store.frame('営業収益')
+    half = np.where(frame.index.str.endswith(('1Q', '2Q')), '上期', '下期')
+    expected = frame.groupby([fiscal_year(frame), half], sort=False).sum()
+    expected.index = [f"{fy} {h}" for fy, h in expected.index]
+    pd.testing.assert_frame_equal(index.halves('営業収益'), expected)
+
+
+def test_period_sum_matches_slice_sum(make_store):
+    store = make_store(amounts(16, seed=2))
+    index = analytics.build_cumulative_index(store)
+    frame = store.frame('営業利益')
+    for first, last in [(0, 15), (3, 3), (5, 12)]:
+        expected = frame.iloc[first:last + 1].sum().to_numpy()
+        np.testing.assert_allclose(index.period_sum('営業利益', store.quarters[first], store.quarters[last]), expected)
+
+
+def test_missing_quarter_makes_only_covering_sums_missing(make_store):
+    values = amounts(8, seed=3)
+    values['営業収益'][5, 1] = np.nan  # FY2020-2Q
+    store = make_store(values)
+    index = analytics.build_cumulative_index(store)
+    ytd = index.ytd('営業収益')
+    assert ytd['E1'].iloc[4:5].notna().all() and ytd['E1'].iloc[5:].isna().all()
+    assert ytd[['E0', 'E2']].notna().all().all()
+    halves = index.halves('営業収益')
+    assert np.isnan(halves.loc['FY2020 上期', 'E1']) and not np.isnan(halves.loc['FY2020 下期', 'E1'])
+
+
+def test_partial_first_fiscal_year(make_store):
+    store = make_store(amounts(7, seed=4), first_quarter=3)  # FY2019-3Q から
+    index = analytics.build_cumulative_index(store)
+    ytd = index.ytd('営業収益')
+    assert ytd.iloc[:2].isna().all().all()  # 1Q からそろっていない年度の累計は出さない
+    frame = store.frame('営業収益')
+    pd.testing.assert_frame_equal(ytd.iloc[2:], frame.iloc[2:].groupby(fiscal_year(frame.iloc[2:])).cumsum())
+    assert list(index.halves('営業収益').index) == ['FY2019 下期', 'FY2020 上期', 'FY2020 下期']
@@ -0,0 +1,55 @@
+"""派生指標の式: 許可した要素のみで評価し、属性参照・任意の関数呼び出し・添字を拒否すること"""
+import numpy as np
+import pytest
+
+import analytics
+
+
+@pytest.mark.parametrize('expression', [
+    "営業収益.__class__",                     # 属性参照
+    "営業収益.sum()",                         # メソッド呼び出し
+    "__import__('os').system('true')",        # 許可していない関数
+    "open('data/region_data.xlsx')",
+    "lag(営業収益, n=4)",                      # キーワード引数
+    "(lambda: 営業収益)()",                    # 関数以外の呼び出し
+    "営業収益[0]",                            # 添字
+    "営業収益[:, 0]",
+    "[営業収益]",
+    "営業収益 if 営業利益 else 0",
+    "営業収益 > 0",
+    "'営業収益'",
+])
+def test_rejects_disallowed_nodes(expression):
+    with pytest.raises(analytics.ExpressionError):
+        analytics.compile_expression(expression)
+
+
+def test_rejects_non_constant_extra_arguments():
+    with pytest.raises(analytics.ExpressionError):
+        analytics.compile_expression("lag(営業収益, 営業利益)")
+
+
+def test_syntax_error_is_expression_error():
+    with pytest.raises(analytics.ExpressionError):
+        analytics.compile_expression("営業収益 +")
+
+
+def test_allowed_expression_evaluates_vectorised(make_store):
+    rng = np.random.default_rng(0)
+    revenue = rng.uniform(100, 200, (8, 3))
+    profit = rng.uniform(5, 20, (8, 3))
+    store = make_store({'営業収益': revenue, '営業利益': profit, '営業収益営業利益率': profit / revenue * 100})
+    expression = "share(営業利益) - 営業利益率 / 2 + diff(営業収益, 4) ** 2"
+    _, names = analytics.compile_expression(expression)
+    assert set(names) == {'営業利益', '営業収益営業利益率', '営業収益'}
+    result = analytics.evaluate_expression(store, expression)
+    diff = np.full_like(revenue, np.nan)
+    diff[4:] = revenue[4:] - revenue[:-4]
+    expected = profit / profit.sum(axis=1, keepdims=True) * 100 - profit / revenue * 100 / 2 + diff ** 2
+    np.testing.assert_allclose(result.to_numpy(), expected)
+
+
+def test_unknown_metric_is_reported(make_store):
+    store = make_store({'営業収益': np.ones((4, 2))})
+    with pytest.raises(analytics.ExpressionError, match='営業利益'):
+        analytics.evaluate_expression(store, "営業利益 / 営業収益")
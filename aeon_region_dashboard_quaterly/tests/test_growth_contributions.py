@@ -0,0 +1,43 @@
+"""前年同期比の寄与度分解: 寄与度・営業利益の要因が全体の増減に一致すること"""
+import numpy as np
+
+import analytics
+
+M = analytics.SEASON_LENGTH
+
+
+def random_amounts(n_quarters=12, n_entities=4, seed=0):
+    rng = np.random.default_rng(seed)
+    revenue = rng.uniform(100, 500, (n_quarters, n_entities))
+    profit = revenue * rng.uniform(-0.05, 0.15, (n_quarters, n_entities))
+    return revenue, profit
+
+
+def test_contributions_sum_to_total_growth(make_store):
+    revenue, profit = random_amounts()
+    contrib = analytics.growth_contributions(make_store({'営業収益': revenue, '営業利益': profit}))
+    for metric in ('営業収益', '営業利益'):
+        np.testing.assert_allclose(np.nansum(contrib.contribution[metric][M:], axis=1), contrib.growth[metric][M:])
+        assert np.isnan(contrib.growth[metric][:M]).all()
+
+
+def test_profit_effects_sum_to_total_profit_change(make_store):
+    revenue, profit = random_amounts(seed=1)
+    contrib = analytics.growth_contributions(make_store({'営業収益': revenue, '営業利益': profit}))
+    prev, cur = contrib.totals['営業利益'].T
+    np.testing.assert_allclose(contrib.effects[M:].sum(axis=1), (cur - prev)[M:])
+    # 営業収益が正の期は3要因で説明でき、その他は0
+    np.testing.assert_allclose(contrib.effects[M:, analytics.PROFIT_EFFECTS.index('その他')], 0, atol=1e-6)
+    assert np.isnan(contrib.effects[:M]).all()
+
+
+def test_identity_holds_when_an_entity_has_profit_without_revenue(make_store):
+    revenue, profit = random_amounts(seed=2)
+    revenue[:, 0] = 0
+    profit[:, 0] = np.arange(len(profit)) * 10.0 - 30  # 収益0で利益だけが増減する（持株会社・調整額など）
+    revenue[5, 1] = np.nan  # 欠損は0として扱う
+    contrib = analytics.growth_contributions(make_store({'営業収益': revenue, '営業利益': profit}))
+    prev, cur = contrib.totals['営業利益'].T
+    np.testing.assert_allclose(contrib.effects[M:].sum(axis=1), (cur - prev)[M:])
+    other = contrib.effects[M:, analytics.PROFIT_EFFECTS.index('その他')]
+    assert np.abs(other).min() > 0
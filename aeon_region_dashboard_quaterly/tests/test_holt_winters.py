@@ -0,0 +1,60 @@
+"""Holt-Winters の一括当てはめ: 全列まとめた計算が系列ごとの当てはめと一致すること"""
+import numpy as np
+
+import analytics
+
+M = analytics.SEASON_LENGTH
+
+
+def fit_one(y, alpha, beta, gamma, horizon, m=M):
+    """1系列・1パラメータの加法型 Holt-Winters（ループによる参照実装）。返り値: (予測値, 1期先予測誤差の二乗和)"""
+    level = y[:m].mean()
+    trend = (y[m:2 * m].mean() - y[:m].mean()) / m
+    season = list(y[:m] - y[:m].mean())
+    sse = 0.0
+    for t in range(m, len(y)):
+        s_prev = season[t % m]
+        sse += (y[t] - (level + trend + s_prev)) ** 2
+        new_level = alpha * (y[t] - s_prev) + (1 - alpha) * (level + trend)
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        season[t % m] = gamma * (y[t] - new_level) + (1 - gamma) * s_prev
+        level = new_level
+    steps = np.arange(1, horizon + 1)
+    point = level + steps * trend + np.array([season[(len(y) + h - 1) % m] for h in steps])
+    return point, sse
+
+
+def seasonal_series(n_quarters, n_series, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_quarters)[:, None]
+    pattern = np.array([5.0, -3.0, 1.0, -3.0])[t % M]
+    return 100 + rng.uniform(-1, 2, n_series) * t + rng.uniform(0.5, 3, n_series) * pattern \
+        + rng.normal(0, 1, (n_quarters, n_series))
+
+
+def test_batch_matches_each_series_fitted_alone():
+    y = seasonal_series(20, 5)
+    point, spread, params = analytics.holt_winters_batch(y, horizon=8)
+    for j in range(y.shape[1]):
+        p, s, prm = analytics.holt_winters_batch(y[:, [j]], horizon=8)
+        np.testing.assert_allclose(point[:, j], p[:, 0])
+        np.testing.assert_allclose(spread[:, j], s[:, 0])
+        np.testing.assert_array_equal(params[j], prm[0])
+
+
+def test_batch_matches_reference_recursion_with_selected_parameters():
+    y = seasonal_series(24, 4, seed=1)
+    point, _, params = analytics.holt_winters_batch(y, horizon=6)
+    for j, (alpha, beta, gamma) in enumerate(params):
+        expected, _ = fit_one(y[:, j], alpha, beta, gamma, horizon=6)
+        np.testing.assert_allclose(point[:, j], expected)
+
+
+def test_selected_parameters_minimise_one_step_error():
+    y = seasonal_series(16, 1, seed=2)[:, 0]
+    _, _, params = analytics.holt_winters_batch(y[:, None], horizon=4)
+    best = fit_one(y, *params[0], horizon=4)[1]
+    for alpha in analytics.HW_GRID:
+        for beta in analytics.HW_TREND_GRID:
+            for gamma in analytics.HW_GRID:
+                assert best <= fit_one(y, alpha, beta, gamma, horizon=4)[1] + 1e-9
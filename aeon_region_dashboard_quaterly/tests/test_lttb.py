@@ -0,0 +1,28 @@
+"""LTTB による折れ線の間引き: 端点を残し、山・谷の形を保つこと"""
+import numpy as np
+import pytest
+
+from charts import lttb
+
+
+@pytest.mark.parametrize('n, n_out', [(100, 10), (57, 3), (1000, 64), (11, 10)])
+def test_keeps_endpoints_and_requested_count(n, n_out):
+    rng = np.random.default_rng(n)
+    x = np.arange(n, dtype=float)
+    keep = lttb(x, rng.normal(size=n), n_out)
+    assert keep[0] == 0 and keep[-1] == n - 1
+    assert len(keep) == n_out
+    assert (np.diff(keep) > 0).all()
+
+
+def test_short_series_is_unchanged():
+    x = np.arange(5, dtype=float)
+    np.testing.assert_array_equal(lttb(x, x ** 2, 10), np.arange(5))
+    np.testing.assert_array_equal(lttb(x, x ** 2, 2), np.arange(5))
+
+
+def test_keeps_isolated_spike():
+    y = np.zeros(200)
+    y[123] = 50.0
+    keep = lttb(np.arange(200, dtype=float), y, 12)
+    assert 123 in keep
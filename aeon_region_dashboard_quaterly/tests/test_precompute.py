@@ -0,0 +1,47 @@
+"""事前描画: バックグラウンドで描画した表示条件は、閲覧時にキャッシュ参照だけで表示される"""
+import os
+import runpy
+import threading
+import warnings
+
+import pytest
+
+import charts
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+pytest.importorskip('streamlit.testing.v1')
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def app_globals():
+    """app.py を実行コンテキストなしで実行し、モジュールの名前空間を返す（AppTest と同じ __main__ として）"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return runpy.run_path(APP, run_name='__main__')
+
+
+@pytest.mark.parametrize('tab, query', [
+    ('margin', {'mode': 'recent', 'n': '8'}),
+    ('yoy', {'mode': 'recent', 'n': '6'}),
+])
+def test_precomputed_state_is_a_cache_hit(app_globals, monkeypatch, tab, query):
+    import streamlit as st
+    st.cache_data.clear()
+    state = {'company': app_globals['DEFAULT_COMPANY'], 'region': '', 'tab': tab, **query}
+    # 事前描画スレッドと同じく、どのセッションの実行コンテキストも持たないスレッドで描画する
+    worker = threading.Thread(target=app_globals['precompute_state'], args=(state,))
+    worker.start()
+    worker.join()
+
+    rendered = []
+    render = charts.render_report_view
+    monkeypatch.setattr(charts, 'render_report_view', lambda view, *a, **k: rendered.append(view.key) or render(view, *a, **k))
+    at = AppTest.from_file(APP, default_timeout=300)
+    for key, value in {'tab': tab, **query}.items():
+        at.query_params[key] = value
+    at.run()
+    assert not at.exception
+    assert at.session_state['_recorded_state']['tab'] == tab
+    assert rendered == []
@@ -0,0 +1,37 @@
+"""静的サイト生成: ダッシュボードの全タブを事前生成ページに含める"""
+import ast
+import os
+
+import pytest
+
+import prerender
+
+APP = os.path.join(prerender.BASE_DIR, 'app.py')
+
+
+def app_tab_ids():
+    """app.py の TAB_IDS（ラベル → ID）を、アプリを実行せずに読み取る"""
+    with open(APP, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'TAB_IDS' for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise AssertionError("TAB_IDS not found in app.py")
+
+
+def test_prerender_covers_every_app_tab():
+    assert prerender.TABS == [(tab, label) for label, tab in app_tab_ids().items()]
+
+
+@pytest.mark.skipif(not os.path.exists(prerender.DATA_PATH), reason="data file not found")
+def test_every_available_tab_builds_views():
+    df, _ = prerender.load_data()
+    quarters = sorted(df['決算年度'].unique(), key=prerender.analytics.sort_quarter_key)[-8:]
+    region = df['地域'].iloc[0]
+    for tab, _ in prerender.available_tabs():
+        state_quarters = len(quarters) if tab == 'forecast' else quarters
+        views = prerender.build_views(prerender.DATA_PATH, tab, state_quarters, region)
+        assert views, tab
+    # 重ね表示（異常値・季節調整）を渡している
+    overview = prerender.build_views(prerender.DATA_PATH, 'overview', quarters, region)
+    assert any(view.key.startswith('anomaly') for view in overview)
@@ -0,0 +1,40 @@
+"""複数企業ストアのスナップショット: 縮めた金額列の型のまま保存し、company_data で元の型に戻す"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import analytics
+from conftest import quarter_labels
+
+
+def quarterly_frame(n_quarters=8, regions=('日本', '中国'), scale=1):
+    """prepare_quarterly_data の出力と同じ列を持つ合成データ（金額列は int64）"""
+    quarters = quarter_labels(2022, n_quarters)
+    rows = [(r, q, (i + 1) * 100 * scale, (i + 1) * 7 * scale) for i, q in enumerate(quarters) for r in regions]
+    df = pd.DataFrame(rows, columns=['地域', '決算年度', '営業収益', '営業利益'])
+    df['営業収益営業利益率'] = df['営業利益'] / df['営業収益'] * 100
+    return df
+
+
+def test_snapshot_keeps_downcast_amounts(tmp_path):
+    frames = {'A社': quarterly_frame(), 'B社': quarterly_frame(scale=3)}
+    store = analytics.build_company_store(frames)
+    assert store.data['営業収益'].dtype == np.int16
+
+    directory = os.path.join(tmp_path, 'snapshot')
+    attached = analytics.write_store_snapshot(store, directory)
+    with open(os.path.join(directory, analytics.SNAPSHOT_META), encoding='utf-8') as f:
+        meta = json.load(f)
+    stored = {entry['name']: np.dtype(entry['dtype']) for entry in meta['columns']}
+    assert stored['営業収益'] == np.int16
+    assert stored['営業収益営業利益率'] == np.float64
+    assert attached.data['営業収益'].dtype == np.int16
+
+    key = ['地域', '決算年度']
+    for company, df in frames.items():
+        restored = attached.company_data(company)
+        assert restored['営業収益'].dtype == np.int64
+        pd.testing.assert_frame_equal(restored[df.columns].sort_values(key).reset_index(drop=True),
+                                      df.sort_values(key).reset_index(drop=True))